@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
 from app.core.models import User, DashboardCache
+from app.core import metrics
+from app.core.realtime_hub import hub
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
@@ -26,4 +28,9 @@ async def clear_cache(
             detail=f"Error clearing cache: {str(e)}"
         )
 
-
+@router.get("/metrics")
+async def get_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """Get cache hit-rate and prefetch counters, plus this process's realtime buffers"""
+    return {"status": "success", "metrics": metrics.snapshot(), "realtime": hub.stats()}
@@ -2,7 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from app.core.database import get_db
-from app.core.models import User, ServiceToken, Todo, Notification
+from app.core.models import User, ServiceToken
+from app.core import counters
 from app.core.google_auth import get_authorization_url, exchange_code_for_tokens
 from app.core.security import create_access_token
 from app.core.schemas import Token, UserResponse
@@ -173,49 +174,33 @@ async def get_current_user_info(
     # In future, you can add a UserProfile model
     return current_user
 
-@router.get("/profile", response_model=dict)
-async def get_user_profile(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Get complete user profile including todos, notifications, etc."""
-    # Get todos count
-    todos_count = db.query(Todo).filter(Todo.user_id == current_user.id).count()
-    todos_completed = db.query(Todo).filter(
-        Todo.user_id == current_user.id,
-        Todo.completed == True
-    ).count()
-    
-    # Get notifications count
-    notifications_count = db.query(Notification).filter(
-        Notification.user_id == current_user.id
-    ).count()
-    notifications_unread = db.query(Notification).filter(
-        Notification.user_id == current_user.id,
-        Notification.read == False
-    ).count()
+def user_profile(db: Session, user: User) -> dict:
+    """Profile, stats and integrations for one user (also served through /api/batch)"""
+    stats = counters.get(db, user.id)
     
     # Check if Google services are connected
     service_token = db.query(ServiceToken).filter(
-        ServiceToken.user_id == current_user.id,
+        ServiceToken.user_id == user.id,
         ServiceToken.service_name == 'google'
     ).first()
     
     return {
         "user": {
-            "id": current_user.id,
-            "email": current_user.email,
-            "name": current_user.name,
-            "picture": current_user.picture,
-            "created_at": current_user.created_at.isoformat() if current_user.created_at else None,
-            "updated_at": current_user.updated_at.isoformat() if current_user.updated_at else None
+            "id": user.id,
+            "email": user.email,
+            "name": user.name,
+            "picture": user.picture,
+            "created_at": user.created_at.isoformat() if user.created_at else None,
+            "updated_at": user.updated_at.isoformat() if user.updated_at else None
         },
         "stats": {
-            "todos_total": todos_count,
-            "todos_completed": todos_completed,
-            "todos_pending": todos_count - todos_completed,
-            "notifications_total": notifications_count,
-            "notifications_unread": notifications_unread
+            "todos_total": stats["todos_total"],
+            "todos_completed": stats["todos_completed"],
+            "todos_pending": stats["todos_total"] - stats["todos_completed"],
+            "notifications_total": stats["notifications_total"],
+            "notifications_unread": stats["notifications_unread"],
+            "emails_unread": stats["emails_unread"],
+            "emails_high_unread": stats["emails_high_unread"]
         },
         "integrations": {
             "google_connected": service_token is not None,
@@ -224,4 +209,12 @@ async def get_user_profile(
         }
     }
 
+@router.get("/profile", response_model=dict)
+async def get_user_profile(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get complete user profile including todos, notifications, etc."""
+    return user_profile(db, current_user)
+
 
@@ -0,0 +1,138 @@
+"""
+Batch API
+Loads several read-only resources in one round trip.
+
+The token is checked once, for the whole batch. Each sub-request then runs in
+the threadpool at the same time as the others, with a pooled session of its
+own, because a Session and its objects can't be shared across threads. Loaders
+take the user's ID; only the profile loads the user itself. Each one is charged
+to its route's rate limit and gets the deadline its own route would have had;
+the batch's budget is the longest of those, so it never cuts one short.
+A batch takes as long as its slowest resource, not the sum of all of them. Each
+item gets its own status, so one failing resource doesn't fail the page.
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from app.api import auth, dashboard
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.dependencies import get_current_user
+from app.core.models import User
+from app.core.rate_limit import RateLimiter
+from app.core import deadline, fieldsets
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api", tags=["batch"])
+
+class BatchItem(BaseModel):
+    id: str
+    path: str  # e.g. "/api/dashboard/emails?limit=10"
+    params: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+def _int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Expected an integer, got {value!r}")
+
+def _fields(items: List[Any], fields: Any, section: str) -> Any:
+    keys = fieldsets.parse_fields(fields, dashboard.SECTIONS[section])
+    return items if keys is None else fieldsets.project(jsonable_encoder(items), keys)
+
+def _profile(db, user_id: int) -> dict:
+    user = db.query(User).filter(User.id == user_id).first()
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    return auth.user_profile(db, user)
+
+# GET path -> (loader taking a session, the user's ID and the query params, query params it accepts,
+# the route's rate limiter if it has one)
+RESOURCES: Dict[str, Tuple[Callable[..., Any], Tuple[str, ...], Optional[RateLimiter]]] = {
+    "/auth/profile": (_profile, (), None),
+    "/api/dashboard/todos": (
+        lambda db, user_id, fields=None: _fields(dashboard.list_todos(db, user_id), fields, 'todos'),
+        ("fields",),
+        None
+    ),
+    "/api/dashboard/notifications": (
+        lambda db, user_id, fields=None: _fields(dashboard.list_notifications(db, user_id), fields, 'notifications'),
+        ("fields",),
+        None
+    ),
+    "/api/dashboard/meetings": (
+        lambda db, user_id, fields=None: _fields(dashboard.list_meetings(db, user_id), fields, 'meetings'),
+        ("fields",),
+        None
+    ),
+    "/api/dashboard/emails": (
+        lambda db, user_id, limit=20, offset=0, fields=None: _fields(
+            dashboard.list_emails(db, user_id, _int(limit), _int(offset)), fields, 'emails'
+        ),
+        ("limit", "offset", "fields"),
+        dashboard.emails_rate_limit
+    ),
+}
+
+def _run(item: BatchItem, user_id: int) -> Dict[str, Any]:
+    """One sub-request, with its own session and the deadline its route would have had"""
+    url = urlsplit(item.path)
+    params = {**dict(parse_qsl(url.query)), **item.params}
+    resource = RESOURCES.get(url.path.rstrip("/"))
+    if resource is None:
+        return {"id": item.id, "status": status.HTTP_404_NOT_FOUND, "body": {"detail": f"{url.path} can't be batched"}}
+    loader, allowed, limiter = resource
+    unknown = set(params) - set(allowed)
+    if unknown:
+        return {"id": item.id, "status": status.HTTP_400_BAD_REQUEST, "body": {"detail": f"Unknown parameters: {', '.join(sorted(unknown))}"}}
+
+    if limiter is not None:
+        try:
+            # Keyed like the route's own limiter, so batching doesn't get around it
+            limiter.check(f"user:{user_id}")
+        except HTTPException as e:
+            return {"id": item.id, "status": e.status_code, "body": {"detail": e.detail}, "headers": e.headers}
+
+    db = SessionLocal()
+    try:
+        with deadline.deadline(deadline.route_deadline("GET", url.path)):
+            body = loader(db, user_id, **params)
+        return {"id": item.id, "status": status.HTTP_200_OK, "body": jsonable_encoder(body)}
+    except HTTPException as e:
+        return {"id": item.id, "status": e.status_code, "body": {"detail": e.detail}}
+    except deadline.DeadlineExceeded as e:
+        return {"id": item.id, "status": status.HTTP_504_GATEWAY_TIMEOUT, "body": {"detail": str(e)}}
+    except Exception as e:
+        logger.warning(f"Batched {url.path} failed for user {user_id}: {e}")
+        db.rollback()
+        return {"id": item.id, "status": status.HTTP_500_INTERNAL_SERVER_ERROR, "body": {"detail": "Internal error"}}
+    finally:
+        db.close()
+
+@router.post("/batch", dependencies=[Depends(RateLimiter("batch", 60))])
+async def run_batch(
+    batch: BatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Run several GETs concurrently and return each one's status and body, in request order"""
+    if not batch.requests:
+        return {"responses": []}
+    if len(batch.requests) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BATCH_MAX_REQUESTS} requests per batch"
+        )
+    if len({item.id for item in batch.requests}) != len(batch.requests):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Request ids must be unique")
+
+    responses = await asyncio.gather(*(run_in_threadpool(_run, item, current_user.id) for item in batch.requests))
+    return {"responses": responses}
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
-from app.core.models import User, ServiceToken, Todo, Notification, Email, Meeting
+from app.core.models import User, ServiceToken, Todo, Notification, Email
 from app.core.schemas import (
     DashboardData, DailyBrief, EmailResponse, MeetingResponse, 
     TodoResponse, NotificationResponse, Suggestion, TodoCreate, TodoUpdate
@@ -11,7 +13,7 @@ import redis
 import json
 from app.core.config import settings
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from typing import Dict, List, Optional
 from app.core.background_tasks import sync_user_data
 from app.core.google_utils import get_google_credentials
 
@@ -20,6 +22,11 @@ router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
 from app.core.cache import cache
 # redis_client removed in favor of SafeCache
 from app.core.rate_limit import RateLimiter
+from app.core.prefetch import request_prefetch
+from app.core.calendar_store import CalendarStore
+from app.core.local_state import invalidate_dashboard
+from app.core.events import publish_event, TODO_UPDATED
+from app.core import counters, dashboard_patch, fieldsets
 
 
 def get_time_ago(dt: datetime) -> str:
@@ -53,7 +60,7 @@ def get_time_of_day() -> str:
     else:
         return "evening"
 
-def generate_suggestions(meetings: List[MeetingResponse], emails: List[EmailResponse], todos: List[TodoResponse]) -> List[Suggestion]:
+def generate_suggestions(meetings: List[MeetingResponse], emails: List[EmailResponse], todos: List[TodoResponse], counts: Dict[str, int] = None) -> List[Suggestion]:
     """Generate AI-powered suggestions"""
     suggestions = []
     
@@ -68,12 +75,15 @@ def generate_suggestions(meetings: List[MeetingResponse], emails: List[EmailResp
         ))
     
     # Email suggestions
-    high_priority_emails = [e for e in emails if e.priority == "high" and e.unread]
-    if high_priority_emails:
+    if counts is not None:
+        high_priority_count = counts["emails_high_unread"]
+    else:
+        high_priority_count = len([e for e in emails if e.priority == "high" and e.unread])
+    if high_priority_count:
         suggestions.append(Suggestion(
             id=len(suggestions) + 1,
             type="action",
-            message=f"You have {len(high_priority_emails)} high-priority email{'s' if len(high_priority_emails) != 1 else ''} that may need attention",
+            message=f"You have {high_priority_count} high-priority email{'s' if high_priority_count != 1 else ''} that may need attention",
             action="View Emails"
         ))
     
@@ -89,21 +99,175 @@ def generate_suggestions(meetings: List[MeetingResponse], emails: List[EmailResp
     
     return suggestions
 
+# Sections of DashboardData and the keys `fields=` can pick from each
+SECTIONS = {
+    'dailyBrief': fieldsets.keys_of(DailyBrief),
+    'emails': fieldsets.keys_of(EmailResponse),
+    'meetings': fieldsets.keys_of(MeetingResponse),
+    'todos': fieldsets.keys_of(TodoResponse),
+    'notifications': fieldsets.keys_of(NotificationResponse),
+    'suggestions': fieldsets.keys_of(Suggestion),
+    'counts': frozenset(counters.FIELDS),
+}
+# Sections built from other sections
+_DEPENDS_ON = {
+    'dailyBrief': ('meetings', 'counts'),
+    'suggestions': ('meetings', 'todos', 'counts'),
+}
+# Sections read fresh on every partial request instead of cached (one primary-key read)
+_LIVE_SECTIONS = ('counts',)
+# Sections that quote the counts; rebuilt on every read, so a cached copy never shows stale totals
+_COUNTED_SECTIONS = ('dailyBrief', 'suggestions')
+
+def daily_brief(meetings: List[MeetingResponse], counts: Dict[str, int]) -> DailyBrief:
+    meeting_count = len(meetings)
+    unread_count = counts["emails_unread"]
+    return DailyBrief(
+        summary=f"Good {get_time_of_day()}! You have {meeting_count} meeting{'s' if meeting_count != 1 else ''} upcoming, {unread_count} unread email{'s' if unread_count != 1 else ''}.",
+        date=datetime.now(timezone.utc).strftime('%A, %B %d, %Y')
+    )
+
+def apply_counts(dashboard_data: DashboardData, counts: Dict[str, int]) -> DashboardData:
+    """Set the counts, and the sections quoting them, on a (possibly cached) dashboard"""
+    dashboard_data.counts = counts
+    dashboard_data.dailyBrief = daily_brief(dashboard_data.meetings, counts)
+    dashboard_data.suggestions = generate_suggestions(
+        dashboard_data.meetings, dashboard_data.emails, dashboard_data.todos, counts
+    )
+    return dashboard_data
+
+def compute_dashboard(db: Session, user_id: int, sections=None) -> DashboardData:
+    """Build the user's dashboard from the local tables (only `sections`, and what they need, if given)"""
+    needed = set(sections or SECTIONS)
+    for section in list(needed):
+        needed.update(_DEPENDS_ON.get(section, ()))
+    dashboard_data = DashboardData()
+
+    # Emails
+    if 'emails' in needed:
+        db_emails = db.query(Email).filter(Email.user_id == user_id).order_by(Email.received_at.desc()).limit(10).all()
+        dashboard_data.emails = [EmailResponse(
+            id=e.id,
+            from_email=e.sender,
+            subject=e.subject,
+            preview=e.preview,
+            priority=e.priority,
+            unread=e.is_read is False,
+            timestamp=get_time_ago(e.received_at),
+            time=get_time_ago(e.received_at),
+            thread_id=e.thread_id
+        ) for e in db_emails]
+
+    # Meetings (recurring series expanded from the local calendar)
+    if 'meetings' in needed:
+        db_meetings = CalendarStore(db, user_id).upcoming(5)
+        dashboard_data.meetings = [MeetingResponse(**m) for m in db_meetings]
+    
+    # Todos
+    if 'todos' in needed:
+        todos = db.query(Todo).filter(
+            Todo.user_id == user_id,
+            Todo.completed == False
+        ).limit(10).all()
+        dashboard_data.todos = [TodoResponse.model_validate(todo) for todo in todos]
+    
+    # Notifications
+    if 'notifications' in needed:
+        notifications = db.query(Notification).filter(
+            Notification.user_id == user_id,
+            Notification.read == False
+        ).order_by(Notification.created_at.desc()).limit(10).all()
+        dashboard_data.notifications = [
+            NotificationResponse(
+                id=notif.id,
+                type=notif.type,
+                message=notif.message,
+                read=notif.read,
+                time=get_time_ago(notif.created_at),
+                related_id=notif.related_id
+            ) for notif in notifications
+        ]
+    
+    # Badge counts (one row read, however many emails/todos the user has)
+    if 'counts' in needed:
+        dashboard_data.counts = counters.get(db, user_id)
+
+    # Daily Brief
+    if 'dailyBrief' in needed:
+        dashboard_data.dailyBrief = daily_brief(dashboard_data.meetings, dashboard_data.counts)
+    
+    # Suggestions
+    if 'suggestions' in needed:
+        dashboard_data.suggestions = generate_suggestions(
+            dashboard_data.meetings, dashboard_data.emails, dashboard_data.todos, dashboard_data.counts
+        )
+    
+    return dashboard_data
+
+def compute_sections(db: Session, user_id: int, shape: fieldsets.Shape) -> Dict:
+    """The sections of the dashboard `shape` asks for, as JSON.
+
+    Counts are always read fresh, and the sections quoting them are rebuilt from
+    them. The other sections come from the cached full summary, then from this
+    shape's own cache entry, and are only queried when neither is there.
+    """
+    counted = [section for section in shape if section in _COUNTED_SECTIONS]
+    stored = {
+        section: keys for section, keys in shape.items()
+        if section not in _LIVE_SECTIONS and section not in _COUNTED_SECTIONS
+    }
+    # What the counted sections are built from, with every key
+    sources = {dep for section in counted for dep in _DEPENDS_ON[section] if dep not in _LIVE_SECTIONS}
+    stored.update({source: None for source in sources})
+    body = {}
+    if stored:
+        summary = cache.get(f"dashboard:summary:{user_id}")
+        key = fieldsets.canonical(stored)
+        if summary:
+            body = fieldsets.apply(json.loads(summary), stored)
+        else:
+            body = dashboard_patch.cached_shape(user_id, key)
+            if body is None:
+                data = jsonable_encoder(compute_dashboard(db, user_id, stored))
+                body = fieldsets.apply(data, stored)
+                dashboard_patch.cache_shape(user_id, key, body)
+    if 'counts' in shape or counted:
+        counts = counters.get(db, user_id)
+        body['counts'] = counts
+        if counted:
+            live = apply_counts(DashboardData(**{source: body[source] for source in sources}), counts)
+            body.update({section: jsonable_encoder(getattr(live, section)) for section in counted})
+    return {section: fieldsets.project(body[section], keys) for section, keys in shape.items()}
+
 @router.get("/contextual-data", response_model=DashboardData, dependencies=[Depends(RateLimiter("dashboard", 60))])
 async def get_contextual_data(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    include: Optional[str] = Query(None, description="Comma-separated sections to return, e.g. counts,todos"),
+    fields: Optional[str] = Query(None, description="Comma-separated section.key pairs to keep, e.g. emails.subject")
 ):
-    """Get all contextual dashboard data (Cached + DB Read Only)"""
-    
+    """Get all contextual dashboard data (Cached + DB Read Only), or only the requested sections"""
+    shape = fieldsets.parse_shape(include, fields, SECTIONS)
+    if shape is not None:
+        body = compute_sections(db, current_user.id, shape)
+        if 'emails' in body:
+            request_prefetch(current_user.id, [e['id'] for e in body['emails']])
+        trigger_sync_if_stale(current_user)
+        return JSONResponse(content=body)
+
     # 1. Try Cache
     try:
         cache_key = f"dashboard:summary:{current_user.id}"
-        cached_data = redis_client.get(cache_key)
+        cached_data = cache.get(cache_key)
         
         if cached_data:
             try:
-                return DashboardData(**json.loads(cached_data))
+                dashboard_data = apply_counts(
+                    DashboardData(**json.loads(cached_data)), counters.get(db, current_user.id)
+                )
+                # The user is likely to open one of these next
+                request_prefetch(current_user.id, [e.id for e in dashboard_data.emails])
+                return dashboard_data
             except Exception as e:
                 print(f"Cache parse error: {e}")
     except Exception as e:
@@ -112,89 +276,21 @@ async def get_contextual_data(
     print(f"Cache miss for user {current_user.id}, computing from DB...")
     
     # 2. Fetch from DB (Fast!)
-    # Emails
-    db_emails = db.query(Email).filter(Email.user_id == current_user.id).order_by(Email.received_at.desc()).limit(10).all()
-    emails_response = [EmailResponse(
-        id=e.id,
-        from_email=e.sender,
-        subject=e.subject,
-        preview=e.preview,
-        priority=e.priority,
-        unread=e.is_read is False,
-        timestamp=get_time_ago(e.received_at),
-        time=get_time_ago(e.received_at),
-        thread_id=e.thread_id
-    ) for e in db_emails]
-
-    # Meetings
-    now = datetime.now()
-    db_meetings = db.query(Meeting).filter(
-        Meeting.user_id == current_user.id,
-        Meeting.start_time >= now
-    ).order_by(Meeting.start_time.asc()).limit(5).all()
-    
-    meetings_response = [MeetingResponse(
-        id=m.id,
-        title=m.title,
-        time=m.start_time.strftime("%I:%M %p") if m.start_time else "",
-        duration="30 min", # Placeholder
-        location=m.location or "Virtual",
-        attendees=json.loads(m.attendees) if m.attendees else [],
-        upcoming=True,
-        date=m.start_time.isoformat() if m.start_time else None,
-        start_datetime = m.start_time,
-        end_datetime = m.end_time,
-        description=m.description
-    ) for m in db_meetings]
-    
-    # Todos
-    todos = db.query(Todo).filter(
-        Todo.user_id == current_user.id,
-        Todo.completed == False
-    ).limit(10).all()
-    todos_response = [TodoResponse.model_validate(todo) for todo in todos]
-    
-    # Notifications
-    notifications = db.query(Notification).filter(
-        Notification.user_id == current_user.id,
-        Notification.read == False
-    ).order_by(Notification.created_at.desc()).limit(10).all()
-    notifications_response = [
-        NotificationResponse(
-            id=notif.id,
-            type=notif.type,
-            message=notif.message,
-            read=notif.read,
-            time=get_time_ago(notif.created_at),
-            related_id=notif.related_id
-        ) for notif in notifications
-    ]
-    
-    # Daily Brief
-    daily_brief = DailyBrief(
-        summary=f"Good {get_time_of_day()}! You have {len(meetings_response)} meeting{'s' if len(meetings_response) != 1 else ''} upcoming, {len([e for e in emails_response if e.unread])} unread priority email{'s' if len([e for e in emails_response if e.unread]) != 1 else ''}.",
-        date=datetime.now(timezone.utc).strftime('%A, %B %d, %Y')
-    )
-    
-    # Suggestions
-    suggestions = generate_suggestions(meetings_response, emails_response, todos_response)
+    dashboard_data = compute_dashboard(db, current_user.id)
     
-    dashboard_data = DashboardData(
-        dailyBrief=daily_brief,
-        emails=emails_response,
-        meetings=meetings_response,
-        todos=todos_response,
-        notifications=notifications_response,
-        suggestions=suggestions
-    )
-    
-    # 3. Cache Result (10 mins)
-    try:
-        redis_client.setex(cache_key, 600, json.dumps(dashboard_data.dict(), default=str))
-    except Exception as e:
-        print(f"Redis set error: {e}")
+    # 3. Cache Result (10 mins), as the next version patches are published against
+    dashboard_data.version = dashboard_patch.commit(current_user.id, dashboard_data.dict())
+    if dashboard_data.version is None:
+        cache.set(cache_key, json.dumps(dashboard_data.dict(), default=str), ex=dashboard_patch.SUMMARY_SECONDS)
+    request_prefetch(current_user.id, [e.id for e in dashboard_data.emails])
+
+    # 4. Trigger Background Sync
+    trigger_sync_if_stale(current_user, empty=not dashboard_data.emails and not dashboard_data.meetings)
 
-    # 4. Trigger Background Sync (Safe Strategy with Circuit Breaker)
+    return dashboard_data
+
+def trigger_sync_if_stale(current_user: User, empty: bool = False) -> None:
+    """Trigger Background Sync (Safe Strategy with Circuit Breaker)"""
     # Circuit Breaker Logic:
     # 1. Redis Lock (Fast, 5 min TTL) - Primary Check
     # 2. DB last_synced_at (Reliable, 5 min window) - Fallback Check
@@ -202,7 +298,7 @@ async def get_contextual_data(
     should_trigger_sync = False
     
     # If DB is empty, user needs data immediately
-    if not db_emails and not db_meetings:
+    if empty:
         should_trigger_sync = True
     else:
         # Check staleness if data exists
@@ -238,17 +334,29 @@ async def get_contextual_data(
             except Exception as e:
                 print(f"Background sync trigger failed: {e}")
 
-    return dashboard_data
+def select(items: List, keys):
+    """The list as is, or only the requested keys of each item (which the response model would reject)"""
+    if keys is None:
+        return items
+    return JSONResponse(content=fieldsets.project(jsonable_encoder(items), keys))
+
+# Also charged by each batched /emails request
+emails_rate_limit = RateLimiter("emails", 100)
 
-@router.get("/emails", response_model=List[EmailResponse], dependencies=[Depends(RateLimiter("emails", 100))])
+@router.get("/emails", response_model=List[EmailResponse], dependencies=[Depends(emails_rate_limit)])
 async def get_emails(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
     limit: int = 20,
-    offset: int = 0
+    offset: int = 0,
+    fields: Optional[str] = Query(None, description="Comma-separated keys to keep on each item")
 ):
     """Get emails from DB"""
-    emails = db.query(Email).filter(Email.user_id == current_user.id).order_by(Email.received_at.desc()).offset(offset).limit(limit).all()
+    keys = fieldsets.parse_fields(fields, SECTIONS['emails'])
+    return select(list_emails(db, current_user.id, limit, offset), keys)
+
+def list_emails(db: Session, user_id: int, limit: int = 20, offset: int = 0) -> List[EmailResponse]:
+    emails = db.query(Email).filter(Email.user_id == user_id).order_by(Email.received_at.desc()).offset(offset).limit(limit).all()
     
     return [EmailResponse(
         id=e.id,
@@ -265,37 +373,30 @@ async def get_emails(
 @router.get("/meetings", response_model=List[MeetingResponse])
 async def get_meetings(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    fields: Optional[str] = Query(None, description="Comma-separated keys to keep on each item")
 ):
     """Get meetings from DB"""
-    now = datetime.now()
-    meetings = db.query(Meeting).filter(
-        Meeting.user_id == current_user.id,
-        Meeting.start_time >= now
-    ).order_by(Meeting.start_time.asc()).limit(20).all()
-    
-    return [MeetingResponse(
-        id=m.id,
-        title=m.title,
-        time=m.start_time.strftime("%I:%M %p") if m.start_time else "",
-        duration="30 min",
-        location=m.location or "Virtual",
-        attendees=json.loads(m.attendees) if m.attendees else [],
-        upcoming=True,
-        date=m.start_time.isoformat() if m.start_time else None,
-        start_datetime = m.start_time,
-        end_datetime = m.end_time,
-        description=m.description
-    ) for m in meetings]
+    keys = fieldsets.parse_fields(fields, SECTIONS['meetings'])
+    return select(list_meetings(db, current_user.id), keys)
+
+def list_meetings(db: Session, user_id: int) -> List[MeetingResponse]:
+    meetings = CalendarStore(db, user_id).upcoming(20)
+    return [MeetingResponse(**m) for m in meetings]
 
 @router.get("/todos", response_model=List[TodoResponse])
 async def get_todos(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    fields: Optional[str] = Query(None, description="Comma-separated keys to keep on each item")
 ):
     """Get user's todos"""
+    keys = fieldsets.parse_fields(fields, SECTIONS['todos'])
+    return select(list_todos(db, current_user.id), keys)
+
+def list_todos(db: Session, user_id: int) -> List[TodoResponse]:
     todos = db.query(Todo).filter(
-        Todo.user_id == current_user.id,
+        Todo.user_id == user_id,
         Todo.completed == False
     ).all()
     return [TodoResponse.model_validate(todo) for todo in todos]
@@ -318,7 +419,8 @@ async def create_todo(
     db.commit()
     db.refresh(todo)
     # Invalidate dashboard cache
-    redis_client.delete(f"dashboard:summary:{current_user.id}")
+    invalidate_dashboard(current_user.id)
+    publish_event(current_user.id, TODO_UPDATED, {"id": todo.id})
     return TodoResponse.model_validate(todo)
 
 @router.patch("/todos/{todo_id}", response_model=TodoResponse)
@@ -347,17 +449,23 @@ async def update_todo(
     db.commit()
     db.refresh(todo)
     # Invalidate dashboard cache
-    redis_client.delete(f"dashboard:summary:{current_user.id}")
+    invalidate_dashboard(current_user.id)
+    publish_event(current_user.id, TODO_UPDATED, {"id": todo.id})
     return TodoResponse.model_validate(todo)
 
 @router.get("/notifications", response_model=List[NotificationResponse])
 async def get_notifications(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    fields: Optional[str] = Query(None, description="Comma-separated keys to keep on each item")
 ):
     """Get notifications"""
+    keys = fieldsets.parse_fields(fields, SECTIONS['notifications'])
+    return select(list_notifications(db, current_user.id), keys)
+
+def list_notifications(db: Session, user_id: int) -> List[NotificationResponse]:
     notifications = db.query(Notification).filter(
-        Notification.user_id == current_user.id
+        Notification.user_id == user_id
     ).order_by(Notification.created_at.desc()).limit(20).all()
     
     return [
@@ -2,24 +2,177 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
-from app.core.models import User, ServiceToken
+from app.core.models import User, ServiceToken, Email
 from app.core.schemas import (
     EmailDetailResponse, EmailReplyRequest, EmailForwardRequest, 
-    EmailMarkReadRequest, EmailThreadResponse, EmailResponse
+    EmailMarkReadRequest, EmailThreadResponse, EmailResponse,
+    EmailBulkQuery, EmailBulkActionRequest, EmailBulkResult, EmailBulkResponse
 )
 from app.core.google_services import GmailService
+from app.core.message_store import MessageStore
+from app.core.mutation_queue import MutationQueue
+from app.core.config import settings
+from app.core.prefetch import get_thread_listing, set_thread_listing
+from app.core.circuit_breaker import CircuitOpen, UpstreamCall, UpstreamRoute
+from app.core.quota import QuotaExhausted
+from app.core.singleflight import coalesce
+from app.core import metrics, local_state
 from app.api.dashboard import get_google_credentials
-from typing import List
+from typing import Dict, List, Optional
+import asyncio
 
 router = APIRouter(prefix="/api/emails", tags=["emails"])
 
+def _detail_response(email_data: Dict) -> EmailDetailResponse:
+    """Build the detail response from a decoded message dict"""
+    return EmailDetailResponse(
+        id=email_data['id'],
+        thread_id=email_data.get('thread_id') or '',
+        from_email=email_data.get('from', 'Unknown'),
+        to=email_data.get('to', ''),
+        subject=email_data.get('subject', 'No Subject'),
+        body=email_data.get('body', ''),
+        date=email_data.get('date', ''),
+        unread=email_data.get('unread', False),
+        snippet=email_data.get('snippet', '')
+    )
+
+def _stale_detail_response(email: Email) -> EmailDetailResponse:
+    """Detail response from the synced row only (no body stored locally)"""
+    return EmailDetailResponse(
+        id=email.id,
+        thread_id=email.thread_id or '',
+        from_email=email.sender or 'Unknown',
+        to='',
+        subject=email.subject or 'No Subject',
+        body=email.preview or '',
+        date=email.received_at.isoformat() if email.received_at else '',
+        unread=not email.is_read,
+        snippet=email.preview or ''
+    )
+
+def _load_original(store: MessageStore, gmail_service: GmailService, message_id: str) -> Optional[Dict]:
+    """Read a message through the local store, fetching and storing it on a miss"""
+    email_data = store.get(message_id)
+    if not email_data:
+        email_data = gmail_service.get_email_by_id(message_id)
+        if email_data:
+            store.put(email_data)
+    return email_data
+
+# Label changes behind each bulk action
+_BULK_LABELS = {
+    'read': ([], ['UNREAD']),
+    'unread': (['UNREAD'], []),
+    'archive': ([], ['INBOX']),
+    'trash': (['TRASH'], ['INBOX']),
+}
+
+def _bulk_message_ids(request: EmailBulkActionRequest, current_user: User, db: Session) -> List[str]:
+    """Message IDs named in the request, or selected by its local query"""
+    if request.message_ids is not None:
+        return list(dict.fromkeys(request.message_ids))
+    if request.query is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide message_ids or query"
+        )
+    query = db.query(Email.id).filter(Email.user_id == current_user.id)
+    if request.query.priority:
+        query = query.filter(Email.priority == request.query.priority)
+    if request.query.unread is not None:
+        query = query.filter(Email.is_read == (not request.query.unread))
+    if request.query.thread_id:
+        query = query.filter(Email.thread_id == request.query.thread_id)
+    return [row[0] for row in query.order_by(Email.received_at.desc()).limit(settings.EMAIL_BULK_MAX_MESSAGES).all()]
+
+@router.post("/bulk", response_model=EmailBulkResponse)
+async def bulk_email_action(
+    request: EmailBulkActionRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Apply one action to many messages; sent to Gmail as batchModify calls of up to 1000 IDs"""
+    if request.action in _BULK_LABELS:
+        add_label_ids, remove_label_ids = _BULK_LABELS[request.action]
+    elif request.action in ('label', 'unlabel') and request.label_id:
+        add_label_ids, remove_label_ids = ([request.label_id], []) if request.action == 'label' else ([], [request.label_id])
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported bulk action '{request.action}'"
+        )
+    
+    _require_google(current_user, db)
+    message_ids = _bulk_message_ids(request, current_user, db)
+    if len(message_ids) > settings.EMAIL_BULK_MAX_MESSAGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.EMAIL_BULK_MAX_MESSAGES} messages per request"
+        )
+    if not message_ids:
+        return EmailBulkResponse(action=request.action, total=0, results=[])
+    
+    try:
+        if request.action in ('read', 'unread'):
+            local_state.emails_read_changed(db, current_user.id, message_ids, request.action == 'read')
+        elif request.action in ('archive', 'trash'):
+            local_state.emails_removed(db, current_user.id, message_ids, keep_bodies=request.action == 'archive')
+        
+        queue = MutationQueue(db, current_user.id)
+        queue.enqueue_modify(message_ids, add_label_ids, remove_label_ids)
+        
+        if not request.wait:
+            results = [EmailBulkResult(id=message_id, status="queued") for message_id in message_ids]
+            return EmailBulkResponse(action=request.action, total=len(message_ids), results=results)
+        
+        credentials = get_google_credentials(current_user, db)
+        if not credentials:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Google account not connected"
+            )
+        gmail_service = GmailService(credentials, user_id=current_user.id)
+        await asyncio.to_thread(queue.drain, gmail_service)
+        outcomes = queue.outcomes(message_ids)
+        await asyncio.to_thread(queue.reconcile, gmail_service)
+        results = [
+            EmailBulkResult(id=message_id, status=outcome[0], error=outcome[1])
+            for message_id, outcome in outcomes.items()
+        ]
+        return EmailBulkResponse(action=request.action, total=len(message_ids), results=results)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error applying bulk action: {str(e)}"
+        )
+
+@router.post("/bulk/mark-high-priority-read", response_model=EmailBulkResponse)
+async def mark_high_priority_read(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Mark every unread high-priority email as read"""
+    request = EmailBulkActionRequest(action='read', query=EmailBulkQuery(priority='high', unread=True))
+    return await bulk_email_action(request, current_user, db)
+
 @router.get("/{message_id}", response_model=EmailDetailResponse)
 async def get_email(
     message_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(UpstreamRoute("gmail", "emails.detail", stale_max_age=0))
 ):
-    """Get full email details by message ID"""
+    """Get full email details by message ID (served from the local store when possible)"""
+    store = MessageStore(db, current_user.id)
+    email_data = store.get(message_id)
+    if email_data:
+        metrics.record('message_store.hit')
+        return _detail_response(email_data)
+    metrics.record('message_store.miss')
+    
     credentials = get_google_credentials(current_user, db)
     if not credentials:
         raise HTTPException(
@@ -28,8 +181,12 @@ async def get_email(
         )
     
     try:
-        gmail_service = GmailService(credentials)
-        email_data = gmail_service.get_email_by_id(message_id)
+        upstream.check()
+        gmail_service = GmailService(credentials, user_id=current_user.id)
+        email_data = await coalesce(
+            current_user.id, 'gmail.message', (message_id,),
+            lambda: gmail_service.get_email_by_id(message_id)
+        )
         
         if not email_data:
             raise HTTPException(
@@ -37,8 +194,18 @@ async def get_email(
                 detail="Email not found"
             )
         
-        return EmailDetailResponse(**email_data)
+        store.put(email_data)
+        return _detail_response(email_data)
+    except HTTPException:
+        raise
     except Exception as e:
+        if upstream.can_fall_back(e):
+            # Headers and preview from the last sync are better than nothing
+            email = db.query(Email).filter(Email.user_id == current_user.id, Email.id == message_id).first()
+            if email:
+                upstream.mark_stale()
+                return _stale_detail_response(email)
+            raise upstream.unavailable(e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching email: {str(e)}"
@@ -49,7 +216,8 @@ async def reply_to_email(
     message_id: str,
     request: EmailReplyRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(UpstreamRoute("gmail", "emails.send", stale_max_age=0, stale_on_error=False))
 ):
     """Reply to an email"""
     credentials = get_google_credentials(current_user, db)
@@ -60,11 +228,15 @@ async def reply_to_email(
         )
     
     try:
-        gmail_service = GmailService(credentials)
-        reply_id = gmail_service.reply_to_email(
+        upstream.check()
+        gmail_service = GmailService(credentials, user_id=current_user.id)
+        original = await asyncio.to_thread(_load_original, MessageStore(db, current_user.id), gmail_service, message_id)
+        reply_id = await asyncio.to_thread(
+            gmail_service.reply_to_email,
             message_id, 
             request.reply_text, 
-            current_user.email
+            current_user.email,
+            original=original
         )
         
         if not reply_id:
@@ -74,6 +246,10 @@ async def reply_to_email(
             )
         
         return {"status": "success", "message_id": reply_id}
+    except HTTPException:
+        raise
+    except (CircuitOpen, QuotaExhausted) as e:
+        raise upstream.unavailable(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -85,7 +261,8 @@ async def forward_email(
     message_id: str,
     request: EmailForwardRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(UpstreamRoute("gmail", "emails.send", stale_max_age=0, stale_on_error=False))
 ):
     """Forward an email"""
     credentials = get_google_credentials(current_user, db)
@@ -96,12 +273,21 @@ async def forward_email(
         )
     
     try:
-        gmail_service = GmailService(credentials)
-        forward_id = gmail_service.forward_email(
+        upstream.check()
+        gmail_service = GmailService(credentials, user_id=current_user.id)
+        original = await asyncio.to_thread(_load_original, MessageStore(db, current_user.id), gmail_service, message_id)
+        if not original:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Email not found"
+            )
+        forward_id = await asyncio.to_thread(
+            gmail_service.forward_email,
             message_id,
             request.to_emails,
             request.forward_text,
-            current_user.email
+            current_user.email,
+            original=original
         )
         
         if not forward_id:
@@ -111,37 +297,41 @@ async def forward_email(
             )
         
         return {"status": "success", "message_id": forward_id}
+    except HTTPException:
+        raise
+    except (CircuitOpen, QuotaExhausted) as e:
+        raise upstream.unavailable(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error forwarding email: {str(e)}"
         )
 
+def _require_google(current_user: User, db: Session):
+    """Queued Gmail actions need a connected account to be drained later"""
+    connected = db.query(ServiceToken.id).filter(
+        ServiceToken.user_id == current_user.id,
+        ServiceToken.service_name == 'google'
+    ).first()
+    if not connected:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Google account not connected"
+        )
+
 @router.delete("/{message_id}")
 async def delete_email(
     message_id: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Delete an email"""
-    credentials = get_google_credentials(current_user, db)
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Google account not connected"
-        )
+    """Delete an email (applied locally now, sent to Gmail in the background)"""
+    _require_google(current_user, db)
     
     try:
-        gmail_service = GmailService(credentials)
-        success = gmail_service.delete_email(message_id)
-        
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to delete email"
-            )
-        
-        return {"status": "success"}
+        local_state.email_deleted(db, current_user.id, message_id)
+        MutationQueue(db, current_user.id).enqueue_delete([message_id])
+        return {"status": "success", "queued": True}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -155,25 +345,17 @@ async def mark_email_read(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Mark email as read or unread"""
-    credentials = get_google_credentials(current_user, db)
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Google account not connected"
-        )
+    """Mark email as read or unread (applied locally now, sent to Gmail in the background)"""
+    _require_google(current_user, db)
     
     try:
-        gmail_service = GmailService(credentials)
-        success = gmail_service.mark_email_read(message_id, request.read)
-        
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to update email status"
-            )
-        
-        return {"status": "success", "read": request.read}
+        local_state.email_read_changed(db, current_user.id, message_id, request.read)
+        queue = MutationQueue(db, current_user.id)
+        if request.read:
+            queue.enqueue_modify([message_id], remove_label_ids=['UNREAD'])
+        else:
+            queue.enqueue_modify([message_id], add_label_ids=['UNREAD'])
+        return {"status": "success", "read": request.read, "queued": True}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -184,9 +366,24 @@ async def mark_email_read(
 async def get_email_thread(
     thread_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(UpstreamRoute("gmail", "emails.thread", stale_max_age=0))
 ):
-    """Get all emails in a thread"""
+    """Get all emails in a thread (prefetched listings and bodies are served locally)"""
+    store = MessageStore(db, current_user.id)
+    
+    # Prefetched thread: listing cached and every body stored -> no Gmail call at all
+    cached_ids = get_thread_listing(current_user.id, thread_id)
+    if cached_ids:
+        messages = store.get_many(cached_ids)
+        if len(messages) == len(cached_ids):
+            metrics.record('thread.hit')
+            return EmailThreadResponse(
+                thread_id=thread_id,
+                messages=[_detail_response(messages[message_id]) for message_id in cached_ids]
+            )
+    metrics.record('thread.miss')
+    
     credentials = get_google_credentials(current_user, db)
     if not credentials:
         raise HTTPException(
@@ -195,22 +392,61 @@ async def get_email_thread(
         )
     
     try:
-        gmail_service = GmailService(credentials)
-        messages = gmail_service.get_email_thread(thread_id)
+        upstream.check()
+        gmail_service = GmailService(credentials, user_id=current_user.id)
         
-        if not messages:
+        def fetch_thread():
+            # Threads can grow, so list them (cheap, no bodies) and only fetch bodies we don't have
+            listing = gmail_service.get_thread_message_ids(thread_id)
+            message_ids = [msg['id'] for msg in listing]
+            stored = store.get_many(message_ids)
+            missing_ids = [message_id for message_id in message_ids if message_id not in stored]
+            return {"listing": listing, "fetched": gmail_service.get_emails_by_ids(missing_ids) if missing_ids else []}
+        
+        result = await coalesce(current_user.id, 'gmail.thread', (thread_id,), fetch_thread)
+        listing = result["listing"]
+        
+        if not listing:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Thread not found"
             )
         
+        message_ids = [msg['id'] for msg in listing]
+        set_thread_listing(current_user.id, thread_id, message_ids)
+        messages = store.get_many(message_ids)
+        fetched = [msg for msg in result["fetched"] if msg['id'] not in messages]
+        if fetched:
+            store.put_many(fetched)
+            messages.update({msg['id']: msg for msg in fetched})
+        
+        thread_messages = []
+        for msg in listing:
+            if msg['id'] not in messages:
+                continue
+            email_data = dict(messages[msg['id']], unread=msg['unread'])
+            thread_messages.append(_detail_response(email_data))
+        
         return EmailThreadResponse(
             thread_id=thread_id,
-            messages=[EmailDetailResponse(**msg) for msg in messages]
+            messages=thread_messages
         )
     except HTTPException:
         raise
     except Exception as e:
+        if upstream.can_fall_back(e):
+            # Whatever part of the thread is stored locally
+            message_ids = cached_ids or [row[0] for row in db.query(Email.id).filter(
+                Email.user_id == current_user.id, Email.thread_id == thread_id
+            ).order_by(Email.received_at).all()]
+            messages = store.get_many(message_ids)
+            if messages:
+                upstream.mark_stale()
+                return EmailThreadResponse(
+                    thread_id=thread_id,
+                    messages=[_detail_response(messages[message_id]) for message_id in message_ids if message_id in messages]
+                )
+            raise upstream.unavailable(e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching thread: {str(e)}"
@@ -221,7 +457,8 @@ async def get_all_emails(
     query: str = "",
     max_results: int = 50,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(UpstreamRoute("gmail", "emails.list"))
 ):
     """Get all emails with optional query filter"""
     credentials = get_google_credentials(current_user, db)
@@ -231,9 +468,11 @@ async def get_all_emails(
             detail="Google account not connected"
         )
     
+    stale_key = f"{max_results}:{query}"
     try:
-        gmail_service = GmailService(credentials)
-        emails_data = gmail_service.get_all_emails(query, max_results)
+        upstream.check()
+        gmail_service = GmailService(credentials, user_id=current_user.id)
+        emails_data = await asyncio.to_thread(gmail_service.get_all_emails, query, max_results)
         
         emails = []
         for i, email_data in enumerate(emails_data):
@@ -249,8 +488,31 @@ async def get_all_emails(
                 thread_id=email_data.get('thread_id')
             ))
         
+        upstream.remember(stale_key, [email.dict() for email in emails])
         return emails
     except Exception as e:
+        if upstream.can_fall_back(e):
+            stale = upstream.recall(stale_key)
+            if stale is not None:
+                return [EmailResponse(**email) for email in stale]
+            if not query:
+                # Unfiltered list: the synced inbox is a close substitute
+                upstream.mark_stale()
+                rows = db.query(Email).filter(Email.user_id == current_user.id).order_by(
+                    Email.received_at.desc()
+                ).limit(max_results).all()
+                return [EmailResponse(
+                    id=row.id,
+                    from_email=row.sender or 'Unknown',
+                    subject=row.subject or 'No Subject',
+                    preview=row.preview or '',
+                    priority=row.priority or 'medium',
+                    unread=not row.is_read,
+                    timestamp=row.received_at.isoformat() if row.received_at else '',
+                    time=row.received_at.isoformat() if row.received_at else '',
+                    thread_id=row.thread_id
+                ) for row in rows]
+            raise upstream.unavailable(e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching emails: {str(e)}"
@@ -2,20 +2,60 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
-from app.core.models import User, ServiceToken, Notification
-from app.core.schemas import MeetingResponse, MeetingCreate, MeetingUpdate
+from app.core.models import User, ServiceToken, Notification, Meeting
+from app.core.schemas import (
+    MeetingResponse, MeetingCreate, MeetingUpdate, MeetingConflict,
+    TimeSlot, FreeBusyResponse, SlotSuggestionResponse
+)
 from app.core.google_services import CalendarService
+from app.core.calendar_store import CalendarStore, as_utc, parse_event_time
+from app.core.interval_index import get_index
+from app.core.circuit_breaker import CircuitOpen, UpstreamCall, UpstreamRoute
+from app.core.quota import QuotaExhausted
+from app.core.singleflight import coalesce
+from app.core import local_state
 from app.api.dashboard import get_google_credentials
-from typing import List
+from typing import Dict, List, Optional
+import asyncio
 from datetime import datetime, timedelta
+from dateutil import parser as date_parser
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 router = APIRouter(prefix="/api/meetings", tags=["meetings"])
 
+# Writes must reach Google, so they fail fast with a 503 while the circuit is open
+_write_route = UpstreamRoute("calendar", "meetings.write", stale_max_age=0, stale_on_error=False)
+# Calendar views outside the synced horizon fall back to the last good response
+_range_route = UpstreamRoute("calendar", "meetings.range")
+
+def _find_conflicts(db: Session, user_id: int, event: Dict) -> Optional[List[MeetingConflict]]:
+    """Other events overlapping `event`, or None if its time is outside the synced calendar"""
+    start, end = parse_event_time(event.get('start_datetime')), parse_event_time(event.get('end_datetime'))
+    if start is None or end is None or len(event.get('start_datetime') or '') == 10:
+        return None  # All-day events don't block time
+    
+    index = get_index(db, user_id)
+    if not index.covers(start, end):
+        return None
+    
+    event_id = event['id']
+    return [
+        MeetingConflict(
+            id=other['id'],
+            title=other['title'],
+            start_datetime=other['start_datetime'],
+            end_datetime=other['end_datetime']
+        )
+        for other in index.overlapping(start, end)
+        if other['id'] != event_id and not other['id'].startswith(f"{event_id}_")
+    ]
+
 @router.post("/", response_model=MeetingResponse)
 async def create_meeting(
     meeting_data: MeetingCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(_write_route)
 ):
     """Create a new meeting/event in Google Calendar"""
     credentials = get_google_credentials(current_user, db)
@@ -26,8 +66,10 @@ async def create_meeting(
         )
     
     try:
-        calendar_service = CalendarService(credentials)
-        event = calendar_service.create_event(
+        upstream.check()
+        calendar_service = CalendarService(credentials, user_id=current_user.id)
+        event = await asyncio.to_thread(
+            calendar_service.create_event,
             title=meeting_data.title,
             start_datetime=meeting_data.start_datetime,
             end_datetime=meeting_data.end_datetime,
@@ -42,6 +84,9 @@ async def create_meeting(
                 detail="Failed to create meeting"
             )
         
+        conflicts = _find_conflicts(db, current_user.id, event)
+        local_state.meeting_saved(db, current_user.id, event, created=True)
+        
         # Create notification for the meeting
         try:
             notification = Notification(
@@ -55,20 +100,113 @@ async def create_meeting(
         except Exception as e:
             print(f"Error creating notification: {e}")
         
-        return MeetingResponse(**event)
+        return MeetingResponse(**event, conflicts=conflicts)
     except HTTPException:
         raise
+    except (CircuitOpen, QuotaExhausted) as e:
+        raise upstream.unavailable(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error creating meeting: {str(e)}"
         )
 
+@router.get("/freebusy", response_model=FreeBusyResponse)
+async def get_free_busy(
+    start: str,
+    end: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Busy blocks in a range, answered from the local calendar index"""
+    try:
+        start_date, end_date = _parse_range_bound(start), _parse_range_bound(end)
+        if end_date <= start_date:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="end must be after start"
+            )
+        
+        index = get_index(db, current_user.id)
+        return FreeBusyResponse(
+            start=start_date.isoformat(),
+            end=end_date.isoformat(),
+            busy=[TimeSlot(start=s.isoformat(), end=e.isoformat()) for s, e in index.busy(start_date, end_date)],
+            complete=index.covers(start_date, end_date)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching free/busy: {str(e)}"
+        )
+
+@router.get("/suggest-slots", response_model=SlotSuggestionResponse)
+async def suggest_slots(
+    start: str,
+    end: str,
+    duration_minutes: int = 30,
+    limit: int = 5,
+    step_minutes: int = 15,
+    work_start_hour: Optional[int] = None,
+    work_end_hour: Optional[int] = None,
+    timezone: str = "UTC",
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Open slots of `duration_minutes` in a range, optionally within working hours"""
+    try:
+        start_date, end_date = _parse_range_bound(start), _parse_range_bound(end)
+        if end_date <= start_date or duration_minutes <= 0 or not 1 <= limit <= 50:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid range, duration or limit"
+            )
+        if (work_start_hour is None) != (work_end_hour is None) or (
+            work_start_hour is not None and not 0 <= work_start_hour < work_end_hour <= 24
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="work_start_hour and work_end_hour must be given together, with start < end"
+            )
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown timezone: {timezone}"
+            )
+        
+        index = get_index(db, current_user.id)
+        slots = index.free_slots(
+            start_date, end_date,
+            duration=timedelta(minutes=duration_minutes),
+            step=timedelta(minutes=step_minutes),
+            limit=limit,
+            work_start_hour=work_start_hour,
+            work_end_hour=work_end_hour,
+            tz=timezone
+        )
+        return SlotSuggestionResponse(
+            duration_minutes=duration_minutes,
+            slots=[TimeSlot(start=s.isoformat(), end=e.isoformat()) for s, e in slots],
+            complete=index.covers(start_date, end_date)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error suggesting slots: {str(e)}"
+        )
+
 @router.get("/{event_id}", response_model=MeetingResponse)
 async def get_meeting(
     event_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(UpstreamRoute("calendar", "meetings.detail", stale_max_age=0))
 ):
     """Get a specific meeting by event ID"""
     credentials = get_google_credentials(current_user, db)
@@ -79,8 +217,12 @@ async def get_meeting(
         )
     
     try:
-        calendar_service = CalendarService(credentials)
-        event = calendar_service.get_event_by_id(event_id)
+        upstream.check()
+        calendar_service = CalendarService(credentials, user_id=current_user.id)
+        event = await coalesce(
+            current_user.id, 'calendar.event', (event_id,),
+            lambda: calendar_service.get_event_by_id(event_id)
+        )
         
         if not event:
             raise HTTPException(
@@ -92,6 +234,12 @@ async def get_meeting(
     except HTTPException:
         raise
     except Exception as e:
+        if upstream.can_fall_back(e):
+            meeting = db.query(Meeting).filter(Meeting.user_id == current_user.id, Meeting.id == event_id).first()
+            if meeting and meeting.status != 'cancelled':
+                upstream.mark_stale()
+                return MeetingResponse(**CalendarStore(db, current_user.id).format_meeting(meeting))
+            raise upstream.unavailable(e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching meeting: {str(e)}"
@@ -102,7 +250,8 @@ async def update_meeting(
     event_id: str,
     meeting_data: MeetingUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(_write_route)
 ):
     """Update an existing meeting"""
     credentials = get_google_credentials(current_user, db)
@@ -113,8 +262,10 @@ async def update_meeting(
         )
     
     try:
-        calendar_service = CalendarService(credentials)
-        event = calendar_service.update_event(
+        upstream.check()
+        calendar_service = CalendarService(credentials, user_id=current_user.id)
+        event = await asyncio.to_thread(
+            calendar_service.update_event,
             event_id=event_id,
             title=meeting_data.title,
             start_datetime=meeting_data.start_datetime,
@@ -130,6 +281,9 @@ async def update_meeting(
                 detail="Failed to update meeting"
             )
         
+        conflicts = _find_conflicts(db, current_user.id, event)
+        local_state.meeting_saved(db, current_user.id, event)
+        
         # Create notification
         try:
             notification = Notification(
@@ -143,9 +297,11 @@ async def update_meeting(
         except Exception as e:
             print(f"Error creating notification: {e}")
         
-        return MeetingResponse(**event)
+        return MeetingResponse(**event, conflicts=conflicts)
     except HTTPException:
         raise
+    except (CircuitOpen, QuotaExhausted) as e:
+        raise upstream.unavailable(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -156,7 +312,8 @@ async def update_meeting(
 async def delete_meeting(
     event_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(_write_route)
 ):
     """Delete a meeting"""
     credentials = get_google_credentials(current_user, db)
@@ -167,8 +324,9 @@ async def delete_meeting(
         )
     
     try:
-        calendar_service = CalendarService(credentials)
-        success = calendar_service.delete_event(event_id)
+        upstream.check()
+        calendar_service = CalendarService(credentials, user_id=current_user.id)
+        success = await asyncio.to_thread(calendar_service.delete_event, event_id)
         
         if not success:
             raise HTTPException(
@@ -176,6 +334,8 @@ async def delete_meeting(
                 detail="Failed to delete meeting"
             )
         
+        local_state.meeting_deleted(db, current_user.id, event_id)
+        
         # Create notification
         try:
             notification = Notification(
@@ -192,21 +352,32 @@ async def delete_meeting(
         return {"status": "success"}
     except HTTPException:
         raise
+    except (CircuitOpen, QuotaExhausted) as e:
+        raise upstream.unavailable(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting meeting: {str(e)}"
         )
 
-@router.get("/range/events", response_model=List[MeetingResponse])
-async def get_events_by_date_range(
-    start_date: str,
-    end_date: str,
-    max_results: int = 100,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Get events within a date range (for calendar view)"""
+def _parse_range_bound(value: str) -> datetime:
+    """Parse a range bound from the calendar views; naive values are UTC (as sent to Google)"""
+    return as_utc(date_parser.parse(value))
+
+async def _events_in_range(
+    current_user: User,
+    db: Session,
+    upstream: UpstreamCall,
+    start_date: datetime,
+    end_date: datetime,
+    max_results: int
+) -> List[MeetingResponse]:
+    """Serve a calendar range from the local meetings table, or from Google outside the synced horizon"""
+    store = CalendarStore(db, current_user.id)
+    if store.covers(start_date, end_date):
+        events = store.query_range(start_date, end_date, max_results)
+        return [MeetingResponse(**event) for event in events]
+    
     credentials = get_google_credentials(current_user, db)
     if not credentials:
         raise HTTPException(
@@ -214,11 +385,46 @@ async def get_events_by_date_range(
             detail="Google account not connected"
         )
     
+    # Format for Google Calendar API (ISO 8601)
+    start_iso = start_date.isoformat().replace('+00:00', 'Z')
+    end_iso = end_date.isoformat().replace('+00:00', 'Z')
+    
+    stale_key = f"{start_iso}:{end_iso}:{max_results}"
     try:
-        calendar_service = CalendarService(credentials)
-        events = calendar_service.get_events_by_date_range(start_date, end_date, max_results)
-        
+        upstream.check()
+        calendar_service = CalendarService(credentials, user_id=current_user.id)
+        events = await coalesce(
+            current_user.id, 'calendar.range', (start_iso, end_iso, max_results),
+            lambda: calendar_service.get_events_by_date_range(start_iso, end_iso, max_results)
+        )
+    except Exception as e:
+        if not upstream.can_fall_back(e):
+            raise
+        events = upstream.recall(stale_key)
+        if events is None:
+            raise upstream.unavailable(e)
         return [MeetingResponse(**event) for event in events]
+    upstream.remember(stale_key, events)
+    return [MeetingResponse(**event) for event in events]
+
+@router.get("/range/events", response_model=List[MeetingResponse])
+async def get_events_by_date_range(
+    start_date: str,
+    end_date: str,
+    max_results: int = 100,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(_range_route)
+):
+    """Get events within a date range (for calendar view)"""
+    try:
+        return await _events_in_range(
+            current_user, db, upstream,
+            _parse_range_bound(start_date), _parse_range_bound(end_date),
+            max_results
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -229,16 +435,10 @@ async def get_events_by_date_range(
 async def get_weekly_events(
     week_start: str = None,  # ISO format date string
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(_range_route)
 ):
     """Get events for a week (for weekly calendar view)"""
-    credentials = get_google_credentials(current_user, db)
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Google account not connected"
-        )
-    
     try:
         # Parse week_start or use current week
         if week_start:
@@ -248,16 +448,12 @@ async def get_weekly_events(
             today = datetime.now()
             start_date = today - timedelta(days=today.weekday())
         
+        start_date = as_utc(start_date)
         end_date = start_date + timedelta(days=7)
         
-        # Format for Google Calendar API (ISO 8601)
-        start_iso = start_date.isoformat() + 'Z'
-        end_iso = end_date.isoformat() + 'Z'
-        
-        calendar_service = CalendarService(credentials)
-        events = calendar_service.get_events_by_date_range(start_iso, end_iso, 100)
-        
-        return [MeetingResponse(**event) for event in events]
+        return await _events_in_range(current_user, db, upstream, start_date, end_date, 100)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -268,16 +464,10 @@ async def get_weekly_events(
 async def get_monthly_events(
     month: str = None,  # Format: YYYY-MM
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    upstream: UpstreamCall = Depends(_range_route)
 ):
     """Get events for a month (for monthly calendar view)"""
-    credentials = get_google_credentials(current_user, db)
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Google account not connected"
-        )
-    
     try:
         # Parse month or use current month
         if month:
@@ -293,14 +483,9 @@ async def get_monthly_events(
         else:
             end_date = datetime(start_date.year, start_date.month + 1, 1)
         
-        # Format for Google Calendar API
-        start_iso = start_date.isoformat() + 'Z'
-        end_iso = end_date.isoformat() + 'Z'
-        
-        calendar_service = CalendarService(credentials)
-        events = calendar_service.get_events_by_date_range(start_iso, end_iso, 500)
-        
-        return [MeetingResponse(**event) for event in events]
+        return await _events_in_range(current_user, db, upstream, as_utc(start_date), as_utc(end_date), 500)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,54 +1,73 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.core.models import User as UserModel
+from app.core.database import get_db, SessionLocal
+from app.core.dependencies import get_current_user
+from app.core.models import User as UserModel, ServiceToken
 from app.core.security import verify_token
-# from app.api.dashboard import get_google_credentials # This should be removed if present
+from app.core.google_services import CalendarService
+from app.core.google_utils import get_google_credentials
 from app.core.config import settings
+from app.core import local_state, metrics
+from app.core.mutation_queue import MutationQueue
+from app.core.events import (
+    publish_event, replay, stream_id_key, EMAIL_NEW, RESYNC, REFRESH_DASHBOARD, DASHBOARD_PATCH, BATCH
+)
+from app.core.realtime_hub import hub, Subscription, DISCONNECT_ON_OVERFLOW
 import asyncio
 import json
 import logging
-from typing import AsyncGenerator
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional, Set, Tuple
 from app.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/realtime", tags=["realtime"])
 
-# Initialize Redis (Removed, using global cache)
-# redis_client = ...
+async def _hub_events(user_id: int, stream: Subscription, last_event_id: Optional[str] = None):
+    """(ID, event JSON) from a hub stream, after replaying what was missed since `last_event_id`.
 
+    The stream must be subscribed before calling, so nothing falls between the replay
+    and live events; duplicates are skipped. Heartbeats and resync hints have no ID.
+    """
+    last_sent = None
+    if last_event_id:
+        missed = await asyncio.to_thread(replay, user_id, last_event_id)
+        if missed is None:
+            yield None, RESYNC
+        else:
+            for item in missed:
+                yield item
+            last_sent = stream_id_key(missed[-1][0]) if missed else stream_id_key(last_event_id)
+    
+    while True:
+        event_id, data = await stream.get()
+        if event_id is not None and last_sent is not None and stream_id_key(event_id) <= last_sent:
+            continue
+        yield event_id, data
 
-async def event_generator(user_id: int) -> AsyncGenerator[str, None]:
-    """Generate Server-Sent Events using Redis Pub/Sub"""
+async def event_generator(user_id: int, last_event_id: str = None) -> AsyncGenerator[str, None]:
+    """Generate Server-Sent Events from the process-wide realtime hub, replaying missed ones first"""
+    stream = None
     try:
         # Send initial connection status
         yield f"data: {json.dumps({'type': 'status', 'status': 'connected', 'message': 'Real-time updates active'})}\n\n"
         
-        if not cache.enabled:
-             # Redis down fallback -> Degraded Mode
-             logger.warning("Redis unavailable for realtime updates. Fallback to heartbeat.")
-             yield f"data: {json.dumps({'type': 'status', 'status': 'degraded', 'message': 'Live updates paused (Degraded maintenance mode)'})}\n\n"
-             while True:
-                await asyncio.sleep(30)
-                yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-                
-        # Connection active
-        pubsub = cache.client.pubsub()
-        channel = f"updates:{user_id}"
-        await pubsub.subscribe(channel)
-
-        try:
-            async for message in pubsub.listen():
-                if message['type'] == 'message':
-                    data = message['data']
-                    yield f"data: {data}\n\n"
-        except asyncio.CancelledError:
-            raise
-        finally:
-            await pubsub.unsubscribe(channel)
-            await pubsub.close()
+        stream = await hub.subscribe(user_id, overflow=settings.REALTIME_SSE_OVERFLOW) if cache.enabled else None
+        if stream is None:
+            # Redis down fallback -> Degraded Mode (heartbeats from the hub's ticker only)
+            logger.warning("Redis unavailable for realtime updates. Fallback to heartbeat.")
+            yield f"data: {json.dumps({'type': 'status', 'status': 'degraded', 'message': 'Live updates paused (Degraded maintenance mode)'})}\n\n"
+            stream = hub.register(None)
+            while True:
+                _, data = await stream.get()
+                yield f"data: {data}\n\n"
+        
+        async for event_id, data in _hub_events(user_id, stream, last_event_id):
+            if data is None:
+                return  # Fell too far behind (disconnect policy); the client reconnects with Last-Event-ID
+            yield f"id: {event_id}\ndata: {data}\n\n" if event_id else f"data: {data}\n\n"
             
     except Exception as e:
         logger.error(f"Realtime error: {e}")
@@ -56,6 +75,9 @@ async def event_generator(user_id: int) -> AsyncGenerator[str, None]:
             'type': 'error',
             'message': 'Realtime service error'
         })}\n\n"
+    finally:
+        if stream is not None:
+            hub.unsubscribe(stream)
 
 async def get_user_from_request(request: Request, db: Session) -> UserModel:
     """Extract user from request for SSE"""
@@ -100,165 +122,7 @@ async def stream_updates(
         )
     
     return StreamingResponse(
-        event_generator(current_user.id),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
-    )
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.core.dependencies import get_current_user
-from app.core.models import User
-from app.core.google_services import GmailService, CalendarService
-from app.api.dashboard import get_google_credentials
-from app.core.security import verify_token
-from app.core.models import User as UserModel
-import asyncio
-import json
-from datetime import datetime, timedelta
-from typing import Dict, Set
-
-router = APIRouter(prefix="/api/realtime", tags=["realtime"])
-
-# Store active connections
-active_connections: Dict[int, Set] = {}
-
-async def event_generator(user_id: int, db: Session):
-    """Generate Server-Sent Events for real-time updates"""
-    # Add connection
-    if user_id not in active_connections:
-        active_connections[user_id] = set()
-    active_connections[user_id].add(id(asyncio.current_task()))
-    
-    try:
-        # Send initial connection message
-        yield f"data: {json.dumps({'type': 'connected', 'message': 'Real-time updates enabled'})}\n\n"
-        
-        last_email_check = datetime.now()
-        last_meeting_check = datetime.now()
-        
-        while True:
-            # Check for new emails every 30 seconds
-            if (datetime.now() - last_email_check).seconds >= 30:
-                try:
-                    user = db.query(User).filter(User.id == user_id).first()
-                    if not user:
-                        break
-                    credentials = get_google_credentials(user, db)
-                    if credentials:
-                        gmail_service = GmailService(credentials)
-                        # Get recent unread emails
-                        emails = gmail_service.get_unread_emails(max_results=5)
-                        
-                        if emails:
-                            yield f"data: {json.dumps({
-                                'type': 'emails',
-                                'data': emails,
-                                'timestamp': datetime.now().isoformat()
-                            })}\n\n"
-                    last_email_check = datetime.now()
-                except Exception as e:
-                    yield f"data: {json.dumps({
-                        'type': 'error',
-                        'message': f'Error checking emails: {str(e)}'
-                    })}\n\n"
-            
-            # Check for new/updated meetings every 60 seconds
-            if (datetime.now() - last_meeting_check).seconds >= 60:
-                try:
-                    user = db.query(User).filter(User.id == user_id).first()
-                    if not user:
-                        break
-                    credentials = get_google_credentials(user, db)
-                    if credentials:
-                        calendar_service = CalendarService(credentials)
-                        # Get upcoming meetings
-                        meetings = calendar_service.get_upcoming_events(max_results=10)
-                        
-                        if meetings:
-                            yield f"data: {json.dumps({
-                                'type': 'meetings',
-                                'data': meetings,
-                                'timestamp': datetime.now().isoformat()
-                            })}\n\n"
-                    last_meeting_check = datetime.now()
-                except Exception as e:
-                    yield f"data: {json.dumps({
-                        'type': 'error',
-                        'message': f'Error checking meetings: {str(e)}'
-                    })}\n\n"
-            
-            # Send heartbeat every 10 seconds
-            yield f"data: {json.dumps({
-                'type': 'heartbeat',
-                'timestamp': datetime.now().isoformat()
-            })}\n\n"
-            
-            await asyncio.sleep(10)
-    
-    except asyncio.CancelledError:
-        # Clean up connection
-        if user_id in active_connections:
-            active_connections[user_id].discard(id(asyncio.current_task()))
-            if not active_connections[user_id]:
-                del active_connections[user_id]
-        raise
-    except Exception as e:
-        yield f"data: {json.dumps({
-            'type': 'error',
-            'message': f'Connection error: {str(e)}'
-        })}\n\n"
-
-async def get_user_from_request(request: Request, db: Session) -> UserModel:
-    """Extract user from request for SSE (EventSource doesn't support custom headers well)"""
-    # Try to get token from query parameter (fallback for EventSource)
-    token = request.query_params.get('token')
-    if not token:
-        # Try to get from Authorization header
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-    
-    if not token:
-        return None
-    
-    try:
-        payload = verify_token(token)
-        user_id = int(payload.get("sub"))
-        user = db.query(UserModel).filter(UserModel.id == user_id).first()
-        return user
-    except Exception:
-        return None
-
-@router.get("/stream")
-async def stream_updates(
-    request: Request,
-    db: Session = Depends(get_db)
-):
-    """Server-Sent Events endpoint for real-time updates"""
-    # Get user from request (EventSource can pass token via query param)
-    current_user = await get_user_from_request(request, db)
-    
-    if not current_user:
-        async def error_generator():
-            yield f"data: {json.dumps({'type': 'error', 'message': 'Unauthorized'})}\n\n"
-        
-        return StreamingResponse(
-            error_generator(),
-            media_type="text/event-stream",
-            status_code=401,
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            }
-        )
-    
-    return StreamingResponse(
-        event_generator(current_user.id, db),
+        event_generator(current_user.id, request.headers.get("Last-Event-ID")),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -271,13 +135,22 @@ async def stream_updates(
 async def trigger_email_update(
     message_id: str,
     action: str,  # 'new', 'read', 'unread', 'deleted'
-    current_user: User = Depends(get_current_user),
+    current_user: UserModel = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Manually trigger an email update event (for testing)"""
-    # This would be called after email actions to notify connected clients
-    # For now, it's a placeholder - in production, this would be called
-    # automatically after email operations
+    """Apply an email change made outside this API to local state and notify connected clients"""
+    if action == 'read' or action == 'unread':
+        local_state.email_read_changed(db, current_user.id, message_id, action == 'read')
+    elif action == 'deleted':
+        local_state.email_deleted(db, current_user.id, message_id)
+    elif action == 'new':
+        publish_event(current_user.id, EMAIL_NEW, {"id": message_id})
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown email action '{action}'"
+        )
+    
     return {
         "status": "success",
         "message": f"Email {action} event triggered",
@@ -288,12 +161,281 @@ async def trigger_email_update(
 async def trigger_meeting_update(
     event_id: str,
     action: str,  # 'created', 'updated', 'deleted'
-    current_user: User = Depends(get_current_user),
+    current_user: UserModel = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Manually trigger a meeting update event (for testing)"""
+    """Apply a meeting change made outside this API to local state and notify connected clients"""
+    if action == 'deleted':
+        local_state.meeting_deleted(db, current_user.id, event_id)
+    elif action == 'created' or action == 'updated':
+        credentials = get_google_credentials(current_user, db)
+        if not credentials:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Google account not connected"
+            )
+        event = await asyncio.to_thread(CalendarService(credentials, user_id=current_user.id).get_event_by_id, event_id)
+        if not event:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Meeting not found"
+            )
+        local_state.meeting_saved(db, current_user.id, event, created=action == 'created')
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown meeting action '{action}'"
+        )
+    
     return {
         "status": "success",
         "message": f"Meeting {action} event triggered",
         "event_id": event_id
     }
+
+# --- WebSocket transport ---------------------------------------------------
+# Frames (JSON text, or msgpack binary when the client offers the "msgpack" subprotocol):
+#   client -> server  {"type": "auth", "token": ..., "last_event_id": ..., "acks": true}  (first frame)
+#                     {"type": "subscribe" | "unsubscribe", "topics": ["email", "meeting", "todo", "dashboard"]}
+#                     {"type": "mark_read", "ids": [...], "read": true}
+#                     {"type": "ack", "id": <last event ID processed>}
+#                     {"type": "ping"}
+#                     Commands may carry a "ref", echoed in the reply.
+#   server -> client  {"type": "event", "id": ..., "event": {...}}
+#                     {"type": "reply", "ref": ..., "ok": true, ...}
+#                     {"type": "pong"}
+# Keepalive uses protocol-level ping/pong frames (uvicorn --ws-ping-interval), not heartbeat messages.
+
+try:
+    import msgpack
+except ImportError:  # Optional: binary frames are only offered when it's installed
+    msgpack = None
+
+_MSGPACK = "msgpack"
+_TOPICS = {"email", "meeting", "todo", "dashboard"}
+
+# Close codes
+_POLICY_VIOLATION = 1008
+_TRY_AGAIN_LATER = 1013
+
+
+class _SlowConsumer(Exception):
+    """The client isn't reading (or acking) fast enough"""
+
+
+def _topic(event_type: str) -> str:
+    if event_type in (REFRESH_DASHBOARD, DASHBOARD_PATCH):
+        return "dashboard"
+    return event_type.split(".", 1)[0]
+
+
+def _authenticate(token: Optional[str]) -> Optional[int]:
+    if not token:
+        return None
+    try:
+        user_id = int(verify_token(token).get("sub"))
+    except Exception:
+        return None
+    db = SessionLocal()
+    try:
+        return user_id if db.query(UserModel.id).filter(UserModel.id == user_id).first() else None
+    finally:
+        db.close()
+
+
+def _mark_read(user_id: int, message_ids: List[str], read: bool) -> Dict[str, Any]:
+    """Same as PATCH /api/emails/{id}/read, for many messages: applied locally, queued for Gmail"""
+    if not message_ids or len(message_ids) > settings.EMAIL_BULK_MAX_MESSAGES:
+        raise ValueError(f"Between 1 and {settings.EMAIL_BULK_MAX_MESSAGES} message IDs are required")
+    db = SessionLocal()
+    try:
+        connected = db.query(ServiceToken.id).filter(
+            ServiceToken.user_id == user_id,
+            ServiceToken.service_name == 'google'
+        ).first()
+        if not connected:
+            raise ValueError("Google account not connected")
+        local_state.emails_read_changed(db, user_id, message_ids, read)
+        queue = MutationQueue(db, user_id)
+        if read:
+            queue.enqueue_modify(message_ids, remove_label_ids=['UNREAD'])
+        else:
+            queue.enqueue_modify(message_ids, add_label_ids=['UNREAD'])
+        return {"read": read, "queued": len(message_ids)}
+    finally:
+        db.close()
+
+
+class RealtimeSocket:
+    """One authenticated WebSocket: hub events out, client commands in"""
+
+    def __init__(self, websocket: WebSocket, user_id: int, binary: bool, acks: bool):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.binary = binary
+        self.topics: Optional[Set[str]] = None  # None means every topic
+        # IDs sent but not yet acked, for clients that ack
+        self.unacked: Optional[Deque[Tuple[int, int]]] = deque() if acks else None
+
+    async def send(self, message: Dict[str, Any] = None, text: str = None) -> None:
+        """Send a message (or pre-encoded JSON text); a send that can't complete in time means a slow consumer"""
+        if self.binary:
+            frame = self.websocket.send_bytes(msgpack.packb(message if message is not None else json.loads(text)))
+        else:
+            frame = self.websocket.send_text(text if text is not None else json.dumps(message, default=str))
+        try:
+            await asyncio.wait_for(frame, timeout=settings.REALTIME_WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise _SlowConsumer()
+
+    async def receive(self) -> Optional[Dict[str, Any]]:
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        try:
+            if message.get("bytes") is not None and msgpack is not None:
+                payload = msgpack.unpackb(message["bytes"])
+            else:
+                payload = json.loads(message.get("text") or message.get("bytes") or "")
+        except Exception:
+            return None
+        return payload if isinstance(payload, dict) else None
+
+    def _wanted(self, data: str) -> Optional[str]:
+        """The event JSON restricted to subscribed topics, or None if nothing is left"""
+        if self.topics is None:
+            return data
+        event = json.loads(data)
+        if event.get("type") != BATCH:
+            return data if _topic(event.get("type") or "") in self.topics else None
+        kept = [e for e in event.get("events") or [] if _topic(e.get("type") or "") in self.topics]
+        if not kept:
+            return None
+        if len(kept) == len(event["events"]):
+            return data
+        event["events"] = kept
+        return json.dumps(event, default=str)
+
+    async def pump(self, stream: Subscription, last_event_id: Optional[str]) -> None:
+        """Forward hub events until the connection ends or falls behind"""
+        async for event_id, data in _hub_events(self.user_id, stream, last_event_id):
+            if data is None:
+                raise _SlowConsumer()  # The hub dropped our backlog (OVERFLOW)
+            if event_id is not None:
+                data = self._wanted(data)
+                if data is None:
+                    continue
+                if self.unacked is not None:
+                    self.unacked.append(stream_id_key(event_id))
+                    if len(self.unacked) > settings.REALTIME_WS_MAX_UNACKED:
+                        raise _SlowConsumer()
+            if self.binary:
+                await self.send({"type": "event", "id": event_id, "event": json.loads(data)})
+            else:
+                # Sliced into the envelope rather than re-encoded
+                await self.send(text=f'{{"type":"event","id":{json.dumps(event_id)},"event":{data}}}')
+
+    async def serve_commands(self) -> None:
+        while True:
+            command = await self.receive()
+            if command is None:
+                await self.send({"type": "reply", "ok": False, "error": "Malformed message"})
+                continue
+            reply = await self.handle(command)
+            if reply is not None:
+                if "ref" in command:
+                    reply["ref"] = command["ref"]
+                await self.send(reply)
+
+    async def handle(self, command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        kind = command.get("type")
+        if kind == "ping":
+            return {"type": "pong"}
+        if kind == "ack":
+            if self.unacked is not None:
+                try:
+                    acked = stream_id_key(str(command.get("id")))
+                except ValueError:
+                    return {"type": "reply", "ok": False, "error": "Invalid event ID"}
+                while self.unacked and self.unacked[0] <= acked:
+                    self.unacked.popleft()
+            return None
+        if kind in ("subscribe", "unsubscribe"):
+            topics = set(command.get("topics") or []) & _TOPICS
+            if kind == "subscribe":
+                self.topics = topics if self.topics is None else self.topics | topics
+            else:
+                self.topics = (set(_TOPICS) if self.topics is None else self.topics) - topics
+            return {"type": "reply", "ok": True, "topics": sorted(self.topics)}
+        if kind == "mark_read":
+            try:
+                ids = [str(i) for i in command.get("ids") or []]
+                result = await asyncio.to_thread(_mark_read, self.user_id, ids, command.get("read", True) is not False)
+            except ValueError as e:
+                return {"type": "reply", "ok": False, "error": str(e)}
+            except Exception as e:
+                logger.error(f"mark_read over WebSocket failed for user {self.user_id}: {e}")
+                return {"type": "reply", "ok": False, "error": "Error updating email status"}
+            return {"type": "reply", "ok": True, **result}
+        return {"type": "reply", "ok": False, "error": f"Unknown command '{kind}'"}
+
+
+@router.websocket("/ws")
+async def realtime_socket(websocket: WebSocket):
+    """WebSocket carrying realtime events and client commands over one connection"""
+    binary = _MSGPACK in websocket.scope.get("subprotocols", []) and msgpack is not None
+    await websocket.accept(subprotocol=_MSGPACK if binary else None)
+    socket = RealtimeSocket(websocket, None, binary, acks=False)
+
+    # Non-browser clients may send a bearer header; browsers authenticate with the first frame
+    try:
+        hello = await asyncio.wait_for(socket.receive(), timeout=settings.REALTIME_WS_AUTH_TIMEOUT_SECONDS)
+    except (asyncio.TimeoutError, WebSocketDisconnect):
+        await _close(websocket, _POLICY_VIOLATION, "Authentication required")
+        return
+    hello = hello if hello and hello.get("type") == "auth" else {}
+    token = hello.get("token")
+    auth_header = websocket.headers.get("Authorization")
+    if not token and auth_header and auth_header.startswith("Bearer "):
+        token = auth_header.split(" ")[1]
+    user_id = await asyncio.to_thread(_authenticate, token)
+    if user_id is None:
+        await _close(websocket, _POLICY_VIOLATION, "Unauthorized")
+        return
+
+    socket = RealtimeSocket(websocket, user_id, binary, acks=bool(hello.get("acks")))
+    # No heartbeat messages: protocol pings keep the socket alive
+    stream = await hub.subscribe(user_id, overflow=DISCONNECT_ON_OVERFLOW, heartbeat=False) if cache.enabled else None
+    if stream is None:
+        await socket.send({"type": "status", "status": "degraded", "message": "Live updates paused (Degraded maintenance mode)"})
+        await _close(websocket, _TRY_AGAIN_LATER, "Realtime updates unavailable")
+        return
+
+    tasks = []
+    try:
+        await socket.send({"type": "status", "status": "connected", "message": "Real-time updates active"})
+        tasks = [
+            asyncio.ensure_future(socket.pump(stream, hello.get("last_event_id"))),
+            asyncio.ensure_future(socket.serve_commands()),
+        ]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        error = next(iter(done)).exception()
+        if isinstance(error, _SlowConsumer):
+            metrics.record('realtime.ws.slow_consumer')
+            await _close(websocket, _TRY_AGAIN_LATER, "Too far behind; reconnect with last_event_id")
+        elif error is not None and not isinstance(error, WebSocketDisconnect):
+            logger.error(f"Realtime socket error for user {user_id}: {error}")
+            await _close(websocket, 1011, "Realtime service error")
+    except (_SlowConsumer, WebSocketDisconnect):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        hub.unsubscribe(stream)
+
+
+async def _close(websocket: WebSocket, code: int, reason: str) -> None:
+    try:
+        await websocket.close(code=code, reason=reason)
+    except Exception:
+        pass  # Already gone
@@ -1,12 +1,22 @@
 from celery import Celery
+from celery.signals import task_prerun, task_postrun
 from app.core.config import settings
 from app.core.database import SessionLocal
-from app.core.models import User, ServiceToken, DashboardCache, Notification, Email, Meeting
+from app.core.models import User, ServiceToken, DashboardCache, Email
 from app.core.google_services import GmailService, CalendarService
+from app.core.quota import QuotaExhausted, BACKGROUND
+from app.core.circuit_breaker import CircuitOpen
+from app.core import counters, deadline, dashboard_patch, digest, events, reminders, web_push
 from app.core.google_utils import get_google_credentials
-from datetime import datetime, timedelta
+from app.core.message_store import MessageStore
+from app.core.calendar_store import CalendarStore
+from app.core.interval_index import bump_calendar_version
+from app.core.events import publish_event, REFRESH_DASHBOARD
+from app.core.mutation_queue import MutationQueue, schedule_drain, users_with_due_mutations
+from app.core.prefetch import prefetch_emails, dashboard_email_ids, invalidate_thread_listing
+from datetime import datetime, timedelta, timezone
 # import redis # Removed
-import json
+import math
 from app.core.cache import cache
 from dateutil import parser as date_parser
 
@@ -17,6 +27,28 @@ celery_app = Celery(
     backend=settings.CELERY_RESULT_BACKEND or 'redis://localhost:6379/0'
 )
 
+# No task may hold a worker forever: SoftTimeLimitExceeded is raised at the soft limit, the process is killed at the hard one
+celery_app.conf.task_soft_time_limit = settings.CELERY_SOFT_TIME_LIMIT_SECONDS
+celery_app.conf.task_time_limit = settings.CELERY_HARD_TIME_LIMIT_SECONDS
+
+# Tasks also run under a deadline, a little inside their soft limit, so Google calls and DB statements stop in time
+_task_deadlines = {}
+
+@task_prerun.connect
+def _start_task_deadline(task_id=None, task=None, **kwargs):
+    soft_limit = getattr(task, 'soft_time_limit', None) or celery_app.conf.task_soft_time_limit
+    if soft_limit:
+        _task_deadlines[task_id] = deadline.start(max(1, soft_limit - 5))
+
+@task_postrun.connect
+def _end_task_deadline(task_id=None, **kwargs):
+    token = _task_deadlines.pop(task_id, None)
+    if token is not None:
+        try:
+            deadline.end(token)
+        except ValueError:
+            pass  # Started in a different context (e.g. an eager call); nothing to undo here
+
 
 
 def parse_iso_datetime(dt_str):
@@ -41,22 +73,28 @@ def sync_user_data(user_id: int):
             return
         
         updates_made = False
+        throttled_for = 0  # Seconds until Google can be called again (quota or open circuit)
         
         # Sync emails
         try:
-            gmail_service = GmailService(credentials)
+            gmail_service = GmailService(credentials, user_id=user_id, lane=BACKGROUND)
             # Fetch more emails for DB
             emails_data = gmail_service.get_unread_emails(max_results=50)
             if not emails_data:
                 emails_data = gmail_service.get_recent_emails(max_results=20)
                 
+            high_priority = []
             if emails_data:
+                # Local state of these is ahead of Gmail until their queued mutations are sent
+                pending_ids = MutationQueue(db, user.id).pending_message_ids()
                 for email_data in emails_data:
                     # Check if email exists
                     email_id = email_data.get('id')
+                    if email_id in pending_ids:
+                        continue
                     existing_email = db.query(Email).filter(Email.id == email_id).first()
                     
-                    received_at = parse_iso_datetime(email_data.get('time') or email_data.get('timestamp'))
+                    received_at = parse_iso_datetime(email_data.get('timestamp'))
                     
                     if not existing_email:
                         new_email = Email(
@@ -72,92 +110,84 @@ def sync_user_data(user_id: int):
                         )
                         db.add(new_email)
                         updates_made = True
+                        # A new message changes its thread's listing
+                        if new_email.thread_id:
+                            invalidate_thread_listing(user.id, new_email.thread_id)
                         
-                        # Check for high priority notifications
+                        # High-priority mail is notified as one digest per window, below
                         if new_email.priority == 'high' and not new_email.is_read:
-                             # Check duplicate notification
-                            existing_notif = db.query(Notification).filter(
-                                Notification.user_id == user.id,
-                                Notification.type == 'email',
-                                Notification.related_id == int(email_id, 16) if email_id.isdigit() else None # Basic check, id is string actually. Notification related_id is Int... Schema mismatch. Fixing in Notification later?
-                                # For now skipping related_id link strictly or use hash
-                            ).first()
-                            
-                            # Simple notification creation without strict related_id integer constraint
-                            notif = Notification(
-                                user_id=user.id,
-                                type='email',
-                                message=f"New high-priority email: {new_email.subject}",
-                                read=False
-                            )
-                            db.add(notif)
+                            high_priority.append(new_email)
 
                     else:
                         # Update existing
                         existing_email.is_read = not email_data.get('unread', True)
                         # Could update other fields if they changed
 
+            db.commit()
+            if high_priority:
+                try:
+                    digest.add_high_priority_emails(db, user.id, high_priority)
+                except Exception as e:
+                    print(f"Error updating email digest for user {user_id}: {e}")
+                    db.rollback()
+
+            # Warm the local body store so opening recent/high-priority mail is a local read
+            try:
+                warmed = MessageStore(db, user.id).warm(gmail_service)
+                if warmed:
+                    print(f"Stored {warmed} message bodies for user {user_id}")
+                prefetch_emails(db, user.id, gmail_service, dashboard_email_ids(db, user.id))
+            except Exception as e:
+                print(f"Error warming message store for user {user_id}: {e}")
+
+        except (QuotaExhausted, CircuitOpen) as e:
+            print(f"Email sync for user {user_id} deferred: {e}")
+            throttled_for = max(throttled_for, e.retry_after)
+            db.rollback()
         except Exception as e:
             print(f"Error syncing emails for user {user_id}: {e}")
         
         # Sync calendar events
         try:
-            calendar_service = CalendarService(credentials)
-            meetings_data = calendar_service.get_upcoming_events(max_results=20)
+            calendar_service = CalendarService(credentials, user_id=user_id, lane=BACKGROUND)
+            # Keep a horizon around now in the meetings table so calendar views are served locally
+            window_start = datetime.now(timezone.utc) - timedelta(days=settings.CALENDAR_SYNC_PAST_DAYS)
+            window_end = datetime.now(timezone.utc) + timedelta(days=settings.CALENDAR_SYNC_FUTURE_DAYS)
+            meetings_data = calendar_service.get_events_for_sync(
+                window_start.isoformat().replace('+00:00', 'Z'),
+                window_end.isoformat().replace('+00:00', 'Z')
+            )
             
-            if meetings_data:
-                for meeting_data in meetings_data:
-                    meeting_id = meeting_data.get('id')
-                    existing_meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
-                    
-                    start_time = parse_iso_datetime(meeting_data.get('start_datetime') or meeting_data.get('date'))
-                    end_time = parse_iso_datetime(meeting_data.get('end_datetime'))
-                    
-                    if not existing_meeting:
-                        new_meeting = Meeting(
-                            id=meeting_id,
-                            user_id=user.id,
-                            title=meeting_data.get('title'),
-                            start_time=start_time,
-                            end_time=end_time,
-                            location=meeting_data.get('location'),
-                            description=meeting_data.get('description'),
-                            attendees=json.dumps(meeting_data.get('attendees', []))
-                        )
-                        db.add(new_meeting)
-                        updates_made = True
-                    else:
-                        # Update
-                        existing_meeting.start_time = start_time
-                        existing_meeting.end_time = end_time
-                        existing_meeting.title = meeting_data.get('title')
+            if CalendarStore(db, user.id).sync_window(meetings_data, window_start, window_end):
+                bump_calendar_version(user.id)
+                updates_made = True
         
+        except (QuotaExhausted, CircuitOpen) as e:
+            print(f"Calendar sync for user {user_id} deferred: {e}")
+            throttled_for = max(throttled_for, e.retry_after)
+            db.rollback()
         except Exception as e:
             print(f"Error syncing calendar for user {user_id}: {e}")
+            db.rollback()
         
         db.commit()
         
-        # Update last_synced_at
-        user.last_synced_at = datetime.now()
-        db.commit()
+        if throttled_for:
+            # Finish the sync once Google is available again; last_synced_at stays put so it still counts as due
+            sync_user_data.apply_async((user_id,), countdown=math.ceil(throttled_for))
+        else:
+            # Update last_synced_at
+            user.last_synced_at = datetime.now()
+            db.commit()
         
         # Cache Invalidation & Realtime Update
         if updates_made:
-            # 1. Invalidate Dashboard Cache (Force re-compute on next read)
-            try:
-                cache_key = f"dashboard:summary:{user_id}"
-                redis_client.delete(cache_key)
-            except Exception as e:
-                print(f"Redis cleanup error (safe to ignore): {e}")
-            
-            # 2. Publish Realtime Event
-            update_event = {
-                "type": "REFRESH_DASHBOARD",
-                "user_id": user_id,
-                "timestamp": datetime.now().isoformat()
-            }
-            # Publish to user's specific channel
-            redis_client.publish(f"updates:{user_id}", json.dumps(update_event))
+            # Publish what changed on the dashboard as a versioned patch (also re-caches the summary)
+            from app.api.dashboard import compute_dashboard
+            if dashboard_patch.commit(user_id, compute_dashboard(db, user_id).dict()) is None:
+                # No Redis for versions: invalidate and let clients refetch
+                cache.delete(f"dashboard:summary:{user_id}", dashboard_patch.shapes_key(user_id))
+                publish_event(user_id, REFRESH_DASHBOARD)
             print(f"Synced data for user {user_id} and published update event.")
         
     except Exception as e:
@@ -166,6 +196,138 @@ def sync_user_data(user_id: int):
     finally:
         db.close()
 
+@celery_app.task(soft_time_limit=60, time_limit=90)
+def prefetch_dashboard_emails(user_id: int, email_ids: list):
+    """Background task to prefetch bodies and threads of the emails on the dashboard"""
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return
+        
+        credentials = get_google_credentials(user, db)
+        if not credentials:
+            return
+        
+        stats = prefetch_emails(db, user_id, GmailService(credentials, user_id=user_id, lane=BACKGROUND), email_ids)
+        print(f"Prefetched {stats['bodies']} bodies and {stats['threads']} threads for user {user_id}")
+    except Exception as e:
+        print(f"Error in prefetch_dashboard_emails for user {user_id}: {e}")
+        db.rollback()
+    finally:
+        cache.delete(f"prefetch:queued:{user_id}")
+        db.close()
+
+@celery_app.task(soft_time_limit=90, time_limit=110)  # Inside the 120s drain lock
+def drain_mutations(user_id: int):
+    """Background task to send a user's queued Gmail mutations in batches"""
+    # Later enqueues must schedule a new drain rather than rely on this one
+    cache.delete(f"mutations:scheduled:{user_id}")
+    
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return
+        
+        credentials = get_google_credentials(user, db)
+        if not credentials:
+            return
+        
+        gmail_service = GmailService(credentials, user_id=user_id, lane=BACKGROUND)
+        queue = MutationQueue(db, user_id)
+        stats = queue.drain(gmail_service)
+        if stats.get("busy"):
+            schedule_drain(user_id)  # Another worker is draining; go again after it
+            return
+        if stats["failed"]:
+            queue.reconcile(gmail_service)
+        print(f"Sent {stats['sent']} mutations in {stats['calls']} calls for user {user_id} ({stats['retried']} to retry, {stats['failed']} failed)")
+        
+        # Come back for rows waiting on backoff
+        next_due = queue.next_due()
+        if next_due:
+            next_due = next_due if next_due.tzinfo else next_due.replace(tzinfo=timezone.utc)
+            schedule_drain(user_id, max(1, int((next_due - datetime.now(timezone.utc)).total_seconds()) + 1))
+    except Exception as e:
+        print(f"Error in drain_mutations for user {user_id}: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+@celery_app.task
+def drain_all_mutations():
+    """Catch queued mutations whose scheduled drain was lost (worker restart, Redis flush)"""
+    db = SessionLocal()
+    try:
+        for user_id in users_with_due_mutations(db):
+            schedule_drain(user_id, 0)
+    finally:
+        db.close()
+
+@celery_app.task
+def flush_realtime_events():
+    """Publish coalesced realtime events whose flushing process went away"""
+    try:
+        flushed = events.flush_abandoned()
+        if flushed:
+            print(f"Flushed abandoned realtime events for {flushed} users")
+    except Exception as e:
+        print(f"Error in flush_realtime_events: {e}")
+
+@celery_app.task
+def dispatch_reminders():
+    """Send the meeting reminders that have come due"""
+    db = SessionLocal()
+    try:
+        sent = reminders.dispatch_due(db)
+        if sent:
+            print(f"Sent {sent} meeting reminders")
+    except Exception as e:
+        print(f"Error in dispatch_reminders: {e}")
+    finally:
+        db.close()
+
+@celery_app.task
+def deliver_pushes(messages: list = None):
+    """Send queued push notifications (and any retries passed in), concurrently per push service"""
+    if messages is None:
+        # Later enqueues must schedule a new delivery rather than rely on this one
+        cache.delete("push:scheduled")
+    db = SessionLocal()
+    try:
+        stats = web_push.drain(db, messages)
+        if stats:
+            print(f"Push delivery: {stats}")
+    except Exception as e:
+        print(f"Error in deliver_pushes: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+@celery_app.task
+def schedule_reminders():
+    """Queue reminders for meetings stored before the scheduler existed (run once, by hand)"""
+    db = SessionLocal()
+    try:
+        print(f"Queued {reminders.schedule_upcoming(db)} meeting reminders")
+    finally:
+        db.close()
+
+@celery_app.task
+def reconcile_counters():
+    """Recount a slice of users' counters and repair any drift"""
+    db = SessionLocal()
+    try:
+        repaired = counters.reconcile(db)
+        if repaired:
+            print(f"Repaired counters for {repaired} users")
+    except Exception as e:
+        print(f"Error in reconcile_counters: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
 @celery_app.task
 def sync_all_users():
     """Sync data for all users with connected services"""
@@ -186,5 +348,21 @@ celery_app.conf.beat_schedule = {
         'task': 'app.core.background_tasks.sync_all_users',
         'schedule': 300.0,  # 5 minutes
     },
+    'drain-all-mutations': {
+        'task': 'app.core.background_tasks.drain_all_mutations',
+        'schedule': 60.0,
+    },
+    'dispatch-reminders': {
+        'task': 'app.core.background_tasks.dispatch_reminders',
+        'schedule': float(settings.REMINDER_POLL_SECONDS),
+    },
+    'flush-realtime-events': {
+        'task': 'app.core.background_tasks.flush_realtime_events',
+        'schedule': float(settings.REALTIME_COALESCE_SWEEP_SECONDS),
+    },
+    'reconcile-counters': {
+        'task': 'app.core.background_tasks.reconcile_counters',
+        'schedule': float(settings.COUNTERS_RECONCILE_SECONDS),
+    },
 }
 
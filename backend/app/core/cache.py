@@ -31,18 +31,18 @@ class SafeCache:
             logger.warning(f"Redis get failed: {e}")
             return None
 
-    def set(self, key, value, ex=None):
+    def set(self, key, value, ex=None, nx=False):
         if not self.enabled: return None
         try:
-            return self.client.set(key, value, ex=ex)
+            return self.client.set(key, value, ex=ex, nx=nx)
         except Exception as e:
             logger.warning(f"Redis set failed: {e}")
             return None
 
-    def delete(self, key):
+    def delete(self, *keys):
         if not self.enabled: return None
         try:
-            return self.client.delete(key)
+            return self.client.delete(*keys)
         except Exception as e:
             logger.warning(f"Redis delete failed: {e}")
             return None
@@ -55,6 +55,35 @@ class SafeCache:
             logger.warning(f"Redis exists failed: {e}")
             return False
 
+    def incr(self, key, amount=1, ex=None):
+        """Increment a counter, setting its expiry when it is first created"""
+        if not self.enabled: return None
+        try:
+            pipe = self.client.pipeline()
+            if ex:
+                pipe.set(key, 0, ex=ex, nx=True)
+            pipe.incrby(key, amount)
+            return pipe.execute()[-1]
+        except Exception as e:
+            logger.warning(f"Redis incr failed: {e}")
+            return None
+
+    def hincrby(self, key, field, amount=1):
+        if not self.enabled: return None
+        try:
+            return self.client.hincrby(key, field, amount)
+        except Exception as e:
+            logger.warning(f"Redis hincrby failed: {e}")
+            return None
+
+    def hgetall(self, key):
+        if not self.enabled: return {}
+        try:
+            return self.client.hgetall(key)
+        except Exception as e:
+            logger.warning(f"Redis hgetall failed: {e}")
+            return {}
+
     def publish(self, channel, message):
         if not self.enabled: return None
         try:
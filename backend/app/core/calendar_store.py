@@ -0,0 +1,290 @@
+"""
+Local Calendar Store
+Answers calendar range queries from the `meetings` table.
+
+Sync keeps a horizon of events around "now" (CALENDAR_SYNC_PAST_DAYS back and
+CALENDAR_SYNC_FUTURE_DAYS ahead). Recurring events are stored once, as their
+master row with its RRULE, and expanded here. Modified or cancelled instances
+are stored as their own rows and replace the occurrence they came from.
+"""
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session
+from app.core.models import Meeting, User
+from app.core.config import settings
+from datetime import datetime, timedelta, timezone
+from dateutil import parser as date_parser
+from dateutil.rrule import rrulestr
+from zoneinfo import ZoneInfo
+from typing import Dict, List, Optional, Set
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fields copied from a synced event onto its meetings row
+_EVENT_FIELDS = ('title', 'location', 'description', 'attendees', 'all_day',
+                 'timezone', 'recurrence', 'recurring_event_id', 'status')
+
+
+def as_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    """Treat naive datetimes (e.g. from SQLite) as UTC and normalise aware ones to UTC"""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_event_time(value: Optional[str]) -> Optional[datetime]:
+    """Parse a Google start/end value ('YYYY-MM-DD' or RFC 3339) into an aware UTC datetime"""
+    if not value:
+        return None
+    try:
+        return as_utc(date_parser.parse(value))
+    except (ValueError, OverflowError):
+        return None
+
+
+def _not_cancelled():
+    return or_(Meeting.status.is_(None), Meeting.status != 'cancelled')
+
+
+class CalendarStore:
+    """Range queries, recurrence expansion and sync upserts for one user's meetings"""
+
+    def __init__(self, db: Session, user_id: int):
+        self.db = db
+        self.user_id = user_id
+
+    # --- Reads -----------------------------------------------------------
+
+    def covers(self, start: datetime, end: datetime) -> bool:
+        """True if [start, end) lies inside the synced horizon"""
+        user = self.db.query(User).filter(User.id == self.user_id).first()
+        if not user or not user.calendar_synced_from or not user.calendar_synced_until:
+            return False
+        return as_utc(user.calendar_synced_from) <= as_utc(start) and as_utc(end) <= as_utc(user.calendar_synced_until)
+
+    def query_range(self, start: datetime, end: datetime, max_results: int = None) -> List[Dict]:
+        """Events overlapping [start, end), recurring series expanded, sorted by start time"""
+        start, end = as_utc(start), as_utc(end)
+
+        # Single events and modified instances that overlap the range
+        singles = self.db.query(Meeting).filter(
+            Meeting.user_id == self.user_id,
+            Meeting.recurrence.is_(None),
+            _not_cancelled(),
+            Meeting.start_time < end,
+            or_(Meeting.end_time > start, Meeting.start_time >= start)
+        ).all()
+        events = [self.format_meeting(m) for m in singles]
+
+        # Recurring series that started before the range ends
+        masters = self.db.query(Meeting).filter(
+            Meeting.user_id == self.user_id,
+            Meeting.recurrence.isnot(None),
+            _not_cancelled(),
+            Meeting.start_time < end
+        ).all()
+        if masters:
+            events.extend(self._expand_masters(masters, start, end))
+
+        events.sort(key=lambda e: e['start_datetime'] or '')
+        return events[:max_results] if max_results else events
+
+    def upcoming(self, limit: int) -> List[Dict]:
+        """The next `limit` events from now"""
+        now = datetime.now(timezone.utc)
+        events = self.query_range(now, now + timedelta(days=settings.CALENDAR_SYNC_FUTURE_DAYS))
+        return [e for e in events if parse_event_time(e['start_datetime']) >= now][:limit]
+
+    def _expand_masters(self, masters: List[Meeting], start: datetime, end: datetime) -> List[Dict]:
+        # Occurrences that were moved or cancelled are replaced by their own rows
+        overridden: Set[tuple] = {
+            (row.recurring_event_id, as_utc(row.original_start_time))
+            for row in self.db.query(Meeting.recurring_event_id, Meeting.original_start_time).filter(
+                Meeting.user_id == self.user_id,
+                Meeting.recurring_event_id.in_([m.id for m in masters])
+            ).all()
+        }
+
+        events = []
+        for master in masters:
+            try:
+                for occurrence_start in self._occurrences(master, start, end):
+                    if (master.id, occurrence_start) in overridden:
+                        continue
+                    events.append(self.format_meeting(master, occurrence_start))
+            except Exception as e:
+                logger.warning(f"Could not expand recurring event {master.id}: {e}")
+        return events
+
+    def _occurrences(self, master: Meeting, start: datetime, end: datetime) -> List[datetime]:
+        """UTC start times of the master's occurrences that overlap [start, end)"""
+        master_start = as_utc(master.start_time)
+        if master_start is None:
+            return []
+        duration = (as_utc(master.end_time) or master_start) - master_start
+
+        # Expand in the event's own zone so DST shifts land where Google puts them
+        try:
+            tz = ZoneInfo(master.timezone) if master.timezone and not master.all_day else timezone.utc
+        except Exception:
+            tz = timezone.utc
+        rules = "\n".join(master.recurrence or [])
+        window_start, window_end = start - duration, end
+
+        try:
+            ruleset = rrulestr(rules, dtstart=master_start.astimezone(tz), forceset=True)
+            occurrences = ruleset.between(window_start, window_end, inc=True)
+        except (ValueError, TypeError):
+            # Date-only UNTIL values (all-day series) need a floating dtstart
+            naive_start = master_start.astimezone(tz).replace(tzinfo=None)
+            ruleset = rrulestr(rules, dtstart=naive_start, forceset=True, ignoretz=True)
+            occurrences = [o.replace(tzinfo=tz) for o in ruleset.between(
+                window_start.astimezone(tz).replace(tzinfo=None),
+                window_end.astimezone(tz).replace(tzinfo=None),
+                inc=True
+            )]
+
+        result = []
+        for occurrence in occurrences:
+            occurrence_start = occurrence.astimezone(timezone.utc)
+            occurrence_end = occurrence_start + duration
+            if occurrence_start < end and (occurrence_end > start or occurrence_start >= start):
+                result.append(occurrence_start)
+        return result
+
+    def next_occurrence(self, master: Meeting, after: datetime) -> Optional[datetime]:
+        """UTC start of the master's first occurrence starting after `after` (within a year)"""
+        horizon = after + timedelta(days=366)
+        for occurrence_start in self._occurrences(master, after, horizon):
+            if occurrence_start > after:
+                return occurrence_start
+        return None
+
+    def occurs_at(self, master: Meeting, occurrence_start: datetime) -> bool:
+        """True if the series still has an occurrence at that start that wasn't moved or cancelled"""
+        events = self._expand_masters([master], occurrence_start, occurrence_start + timedelta(seconds=1))
+        return any(parse_event_time(e['start_datetime']) == occurrence_start for e in events)
+
+    def format_meeting(self, meeting: Meeting, occurrence_start: datetime = None) -> Dict:
+        """Format a row (or one occurrence of a recurring row) like CalendarService._format_event"""
+        start_dt = as_utc(meeting.start_time)
+        end_dt = as_utc(meeting.end_time) or start_dt
+        event_id = meeting.id
+
+        if occurrence_start is not None:
+            duration = (end_dt - start_dt) if start_dt else timedelta(0)
+            start_dt, end_dt = occurrence_start, occurrence_start + duration
+            # Same instance ID scheme Google uses, so get/update/delete by ID keep working
+            suffix = start_dt.strftime('%Y%m%d') if meeting.all_day else start_dt.strftime('%Y%m%dT%H%M%SZ')
+            event_id = f"{meeting.id}_{suffix}"
+
+        attendees = meeting.attendees or []
+        if isinstance(attendees, str):
+            try:
+                attendees = json.loads(attendees)
+            except ValueError:
+                attendees = []
+
+        if start_dt is None:
+            return {
+                'id': event_id, 'title': meeting.title or 'No Title', 'time': '', 'date': None,
+                'start_datetime': None, 'end_datetime': None, 'duration': 'Unknown',
+                'location': meeting.location or 'Not specified', 'attendees': attendees,
+                'description': meeting.description or '', 'upcoming': True,
+                'all_day': bool(meeting.all_day)
+            }
+
+        if meeting.all_day:
+            start_str, end_str = start_dt.strftime('%Y-%m-%d'), end_dt.strftime('%Y-%m-%d')
+        else:
+            start_str, end_str = start_dt.isoformat(), end_dt.isoformat()
+
+        return {
+            'id': event_id,
+            'title': meeting.title or 'No Title',
+            'time': start_dt.strftime('%I:%M %p'),
+            'date': start_dt.strftime('%Y-%m-%d'),
+            'start_datetime': start_str,
+            'end_datetime': end_str,
+            'duration': f"{int((end_dt - start_dt).total_seconds() / 60)} min",
+            'location': meeting.location or 'Not specified',
+            'attendees': attendees,
+            'description': meeting.description or '',
+            'upcoming': end_dt >= datetime.now(timezone.utc),
+            'all_day': bool(meeting.all_day)
+        }
+
+    # --- Writes ----------------------------------------------------------
+
+    def upsert_event(self, event: Dict, commit: bool = True) -> bool:
+        """Insert or update the row for a synced/created event; returns True if anything changed"""
+        values = {field: event.get(field) for field in _EVENT_FIELDS if field in event}
+        values['start_time'] = parse_event_time(event.get('start_datetime'))
+        values['end_time'] = parse_event_time(event.get('end_datetime'))
+        if 'original_start_time' in event:
+            values['original_start_time'] = parse_event_time(event.get('original_start_time'))
+
+        meeting = self.db.query(Meeting).filter(Meeting.id == event['id']).first()
+        if not meeting:
+            self.db.add(Meeting(id=event['id'], user_id=self.user_id, **values))
+            changed = True
+        else:
+            changed = False
+            for field, value in values.items():
+                current = getattr(meeting, field)
+                if isinstance(current, datetime) or isinstance(value, datetime):
+                    current, value = as_utc(current), as_utc(value)
+                if current != value:
+                    setattr(meeting, field, value)
+                    changed = True
+
+        if commit:
+            self.db.commit()
+        return changed
+
+    def delete_event(self, event_id: str, commit: bool = True) -> bool:
+        """Remove an event (and any stored instances of it); returns True if a row was deleted"""
+        deleted = self.db.query(Meeting).filter(
+            Meeting.user_id == self.user_id,
+            or_(Meeting.id == event_id, Meeting.recurring_event_id == event_id)
+        ).delete(synchronize_session=False)
+        if commit:
+            self.db.commit()
+        return deleted > 0
+
+    def sync_window(self, events: List[Dict], window_start: datetime, window_end: datetime) -> bool:
+        """Replace the stored window with a full listing from Google; returns True if anything changed"""
+        window_start, window_end = as_utc(window_start), as_utc(window_end)
+        seen = set()
+        changed = False
+
+        for event in events:
+            if event.get('status') == 'cancelled' and not event.get('recurring_event_id'):
+                # The whole event (or series) was deleted
+                changed = self.delete_event(event['id'], commit=False) or changed
+                continue
+            seen.add(event['id'])
+            changed = self.upsert_event(event, commit=False) or changed
+        self.db.flush()
+
+        # Anything in the window that Google no longer lists is gone
+        stale = self.db.query(Meeting).filter(
+            Meeting.user_id == self.user_id,
+            Meeting.id.notin_(seen),
+            or_(
+                and_(Meeting.start_time >= window_start, Meeting.start_time < window_end),
+                Meeting.recurrence.isnot(None),
+                Meeting.start_time.is_(None)
+            )
+        ).delete(synchronize_session=False)
+        changed = changed or stale > 0
+
+        user = self.db.query(User).filter(User.id == self.user_id).first()
+        if user:
+            user.calendar_synced_from = window_start
+            user.calendar_synced_until = window_end
+        self.db.commit()
+        return changed
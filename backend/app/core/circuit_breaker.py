@@ -0,0 +1,280 @@
+"""
+Upstream Circuit Breaker
+Stops calling Gmail/Calendar for a user while Google is failing, instead of
+tying up a worker until httplib2 gives up on every request.
+
+Each (service, user) circuit counts failures (5xx, network errors and calls
+slower than CIRCUIT_SLOW_CALL_SECONDS) within CIRCUIT_FAILURE_WINDOW_SECONDS.
+When the count reaches CIRCUIT_FAILURE_THRESHOLD the circuit opens, and calls
+fail at once with CircuitOpen for CIRCUIT_OPEN_SECONDS. After that, a single probe
+call is let through (half-open). If it succeeds the circuit closes; if it fails
+the circuit opens again.
+
+Routes opt in with an UpstreamRoute dependency. It remembers the last good
+response, serves that (marked stale) while the circuit is open, and schedules
+a background sync to refresh the local data.
+"""
+from fastapi import Depends, HTTPException, Response, status
+from googleapiclient.errors import HttpError
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.dependencies import get_current_user
+from app.core.models import User
+from app.core.quota import QuotaExhausted
+from app.core import metrics
+from typing import Any, Dict, Optional
+import json
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """The circuit for this service and user is open; the call was not made"""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"Google {service} is unavailable; retry in {retry_after:.0f}s")
+        self.service = service
+        self.retry_after = retry_after
+
+
+def _is_network_error(error: Exception) -> bool:
+    try:
+        from httplib2 import HttpLib2Error
+        from google.auth.exceptions import TransportError
+    except ImportError:
+        return isinstance(error, OSError)
+    return isinstance(error, (OSError, HttpLib2Error, TransportError))
+
+
+def counts_as_failure(error: Exception) -> bool:
+    """Errors that say Google is unhealthy (not that the request was wrong)"""
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500
+    return _is_network_error(error)
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Errors a route may answer with stale data instead of failing"""
+    return isinstance(error, (CircuitOpen, QuotaExhausted)) or counts_as_failure(error)
+
+
+class CircuitBreaker:
+    """Failure-rate circuit per user for one upstream service, shared through Redis"""
+
+    def __init__(self, service: str):
+        self.service = service
+        # Per-process state when Redis is unavailable: key -> {failures, open_until, tripped, probing}
+        self._local: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, user_id: Optional[int]) -> str:
+        return f"circuit:{self.service}:{user_id if user_id is not None else 'anonymous'}"
+
+    def before_call(self, user_id: Optional[int]) -> None:
+        """Raise CircuitOpen unless a call may go out now"""
+        retry_after = self.retry_after(user_id, probe=True)
+        if retry_after:
+            metrics.record(f'circuit.{self.service}.rejected')
+            raise CircuitOpen(self.service, retry_after)
+
+    def retry_after(self, user_id: Optional[int], probe: bool = False) -> float:
+        """Seconds until the circuit lets calls through (0 if closed or half-open).
+        
+        With probe, a half-open circuit lets only the first caller through.
+        """
+        key = self._key(user_id)
+        if not cache.enabled:
+            return self._local_retry_after(key, probe)
+        try:
+            pipe = cache.client.pipeline(transaction=False)
+            pipe.pttl(f"{key}:open")
+            pipe.exists(f"{key}:tripped")
+            open_ms, tripped = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Circuit breaker state unavailable ({e})")
+            return 0
+        if open_ms and open_ms > 0:
+            return open_ms / 1000
+        if tripped and probe:
+            # Half-open: one call probes, the rest wait for its result
+            if not cache.set(f"{key}:probe", "1", ex=math.ceil(settings.CIRCUIT_SLOW_CALL_SECONDS) + 5, nx=True):
+                return 1
+        return 0
+
+    def record(self, user_id: Optional[int], elapsed: float, error: Optional[Exception] = None) -> None:
+        """Report how a call went"""
+        failed = (error is not None and counts_as_failure(error)) or elapsed > settings.CIRCUIT_SLOW_CALL_SECONDS
+        key = self._key(user_id)
+        if not cache.enabled:
+            self._local_record(key, failed)
+            return
+
+        tripped = cache.exists(f"{key}:tripped")
+        if not failed:
+            if tripped:
+                # The probe got through: close the circuit
+                cache.delete(f"{key}:tripped")
+                cache.delete(f"{key}:probe")
+                logger.info(f"Circuit {key} closed")
+            return
+
+        metrics.record(f'circuit.{self.service}.failures')
+        failures = cache.incr(f"{key}:failures", ex=settings.CIRCUIT_FAILURE_WINDOW_SECONDS) or 0
+        if tripped or failures >= settings.CIRCUIT_FAILURE_THRESHOLD:
+            self._open(key)
+
+    def _open(self, key: str) -> None:
+        open_seconds = settings.CIRCUIT_OPEN_SECONDS
+        cache.set(f"{key}:open", "1", ex=open_seconds)
+        # Stays half-open after the open period until a probe succeeds
+        cache.set(f"{key}:tripped", "1", ex=open_seconds * 10)
+        cache.delete(f"{key}:failures")
+        cache.delete(f"{key}:probe")
+        metrics.record(f'circuit.{self.service}.opened')
+        logger.warning(f"Circuit {key} opened for {open_seconds}s")
+
+    # --- Per-process fallback ------------------------------------------------
+
+    def _local_retry_after(self, key: str, probe: bool) -> float:
+        now = time.monotonic()
+        with self._lock:
+            state = self._local.get(key)
+            if not state:
+                return 0
+            if state["open_until"] > now:
+                return state["open_until"] - now
+            if state["tripped"] and probe:
+                if state["probing"]:
+                    return 1
+                state["probing"] = True
+            return 0
+
+    def _local_record(self, key: str, failed: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            state = self._local.get(key)
+            if not failed:
+                if state and state["tripped"]:
+                    del self._local[key]
+                return
+            if state is None:
+                if len(self._local) >= 10000:
+                    self._local.clear()
+                state = self._local[key] = {"failures": [], "open_until": 0, "tripped": False, "probing": False}
+            window_start = now - settings.CIRCUIT_FAILURE_WINDOW_SECONDS
+            state["failures"] = [t for t in state["failures"] if t > window_start] + [now]
+            if state["tripped"] or len(state["failures"]) >= settings.CIRCUIT_FAILURE_THRESHOLD:
+                state.update(failures=[], open_until=now + settings.CIRCUIT_OPEN_SECONDS, tripped=True, probing=False)
+
+
+# Global instances
+breakers = {
+    'gmail': CircuitBreaker('gmail'),
+    'calendar': CircuitBreaker('calendar'),
+}
+
+
+def _schedule_refresh(user_id: int, delay: float) -> None:
+    """Sync the user's data once Google is expected back (at most one pending per user)"""
+    if cache.enabled and not cache.set(f"circuit:refresh:{user_id}", "1", ex=max(30, math.ceil(delay) + 30), nx=True):
+        return
+    try:
+        from app.core.background_tasks import sync_user_data
+        sync_user_data.apply_async((user_id,), countdown=math.ceil(delay))
+    except Exception as e:
+        cache.delete(f"circuit:refresh:{user_id}")
+        logger.warning(f"Stale refresh trigger failed for user {user_id}: {e}")
+
+
+class UpstreamCall:
+    """Circuit state and stale-response handling for one request"""
+
+    def __init__(self, route: "UpstreamRoute", user_id: int, response: Response):
+        self.route = route
+        self.user_id = user_id
+        self.response = response
+
+    @property
+    def retry_after(self) -> float:
+        return breakers[self.route.service].retry_after(self.user_id)
+
+    def can_fall_back(self, error: Exception) -> bool:
+        """True if this route answers `error` with stale data (or a 503) instead of a 500"""
+        return self.route.should_fall_back(error)
+
+    def check(self) -> None:
+        """Fail fast (CircuitOpen) before any work if the circuit is open"""
+        retry_after = self.retry_after
+        if retry_after:
+            raise CircuitOpen(self.route.service, retry_after)
+
+    def _stale_key(self, key: str) -> str:
+        return f"stale:{self.route.name}:{self.user_id}:{key}"
+
+    def remember(self, key: str, payload: Any) -> None:
+        """Keep a good response to fall back on"""
+        if self.route.stale_max_age <= 0:
+            return
+        try:
+            value = json.dumps({"at": time.time(), "payload": payload}, default=str)
+        except (TypeError, ValueError):
+            return
+        cache.set(self._stale_key(key), value, ex=self.route.stale_max_age)
+
+    def recall(self, key: str) -> Optional[Any]:
+        """The last good response for `key`, marked stale on this response; None if there is none"""
+        if self.route.stale_max_age <= 0:
+            return None
+        cached = cache.get(self._stale_key(key))
+        if not cached:
+            return None
+        try:
+            entry = json.loads(cached)
+        except Exception:
+            return None
+        self.mark_stale(time.time() - entry["at"])
+        return entry["payload"]
+
+    def mark_stale(self, age: Optional[float] = None) -> None:
+        """Flag this response as served from local/cached data and refresh it in the background"""
+        self.response.headers["X-Stale"] = "1"
+        self.response.headers["Warning"] = '110 - "Response is Stale"'
+        if age is not None:
+            self.response.headers["Age"] = str(max(0, int(age)))
+        metrics.record(f'circuit.{self.route.name}.stale')
+        _schedule_refresh(self.user_id, self.retry_after or settings.CIRCUIT_OPEN_SECONDS)
+
+    def unavailable(self, error: Exception) -> HTTPException:
+        """503 for an upstream failure with nothing stale to serve"""
+        retry_after = getattr(error, 'retry_after', None) or self.retry_after or settings.CIRCUIT_OPEN_SECONDS
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Google {self.route.service} is temporarily unavailable",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+class UpstreamRoute:
+    """Per-route upstream policy, used as a dependency.
+
+    stale_max_age: how long a good response may be served while Google is down (0 = never)
+    stale_on_error: also serve stale data when a call fails, not only when the circuit is open
+    """
+
+    def __init__(self, service: str, name: str, stale_max_age: int = None, stale_on_error: bool = True):
+        self.service = service
+        self.name = name
+        self.stale_max_age = settings.CIRCUIT_STALE_MAX_AGE_SECONDS if stale_max_age is None else stale_max_age
+        self.stale_on_error = stale_on_error
+
+    def should_fall_back(self, error: Exception) -> bool:
+        if isinstance(error, CircuitOpen):
+            return True
+        return self.stale_on_error and is_upstream_failure(error)
+
+    async def __call__(self, response: Response, current_user: User = Depends(get_current_user)) -> UpstreamCall:
+        return UpstreamCall(self, current_user.id, response)
@@ -34,5 +34,123 @@ class Settings(BaseSettings):
     # Security
     ENCRYPTION_KEY: str = os.getenv("ENCRYPTION_KEY", "")
 
+    # Message Body Store
+    MESSAGE_STORE_USER_BUDGET_BYTES: int = int(os.getenv("MESSAGE_STORE_USER_BUDGET_BYTES", str(5 * 1024 * 1024)))
+    MESSAGE_STORE_WARM_LIMIT: int = int(os.getenv("MESSAGE_STORE_WARM_LIMIT", "20"))
+    MESSAGE_STORE_WARM_DAYS: int = int(os.getenv("MESSAGE_STORE_WARM_DAYS", "3"))
+    # A read only moves a body up the LRU if it wasn't already touched this recently
+    MESSAGE_STORE_TOUCH_MINUTES: int = int(os.getenv("MESSAGE_STORE_TOUCH_MINUTES", "10"))
+
+    # Dashboard Prefetch (budgets are upstream message fetches per minute)
+    PREFETCH_DASHBOARD_EMAILS: int = int(os.getenv("PREFETCH_DASHBOARD_EMAILS", "10"))
+    PREFETCH_USER_BUDGET_PER_MINUTE: int = int(os.getenv("PREFETCH_USER_BUDGET_PER_MINUTE", "60"))
+    PREFETCH_GLOBAL_BUDGET_PER_MINUTE: int = int(os.getenv("PREFETCH_GLOBAL_BUDGET_PER_MINUTE", "3000"))
+    PREFETCH_THREAD_TTL_SECONDS: int = int(os.getenv("PREFETCH_THREAD_TTL_SECONDS", "120"))
+
+    # Local Calendar (sync horizon around "now" that is served from the meetings table)
+    CALENDAR_SYNC_PAST_DAYS: int = int(os.getenv("CALENDAR_SYNC_PAST_DAYS", "30"))
+    CALENDAR_SYNC_FUTURE_DAYS: int = int(os.getenv("CALENDAR_SYNC_FUTURE_DAYS", "90"))
+    # Rebuild interval used for the in-process busy-time index when Redis is unavailable
+    INTERVAL_INDEX_TTL_SECONDS: int = int(os.getenv("INTERVAL_INDEX_TTL_SECONDS", "60"))
+
+    # Gmail Mutation Queue (label changes/deletes are acknowledged locally, then sent in batches)
+    MUTATION_DRAIN_DELAY_SECONDS: int = int(os.getenv("MUTATION_DRAIN_DELAY_SECONDS", "2"))
+    MUTATION_MAX_ATTEMPTS: int = int(os.getenv("MUTATION_MAX_ATTEMPTS", "6"))
+    MUTATION_BACKOFF_BASE_SECONDS: int = int(os.getenv("MUTATION_BACKOFF_BASE_SECONDS", "5"))
+    MUTATION_BACKOFF_MAX_SECONDS: int = int(os.getenv("MUTATION_BACKOFF_MAX_SECONDS", "600"))
+    EMAIL_BULK_MAX_MESSAGES: int = int(os.getenv("EMAIL_BULK_MAX_MESSAGES", "5000"))
+
+    # Rate Limiter fallback while Redis is down (per-process LRU, shared with local workers via mmap)
+    RATE_LIMIT_FALLBACK_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_FALLBACK_MAX_KEYS", "10000"))
+    RATE_LIMIT_FALLBACK_SWEEP_SECONDS: int = int(os.getenv("RATE_LIMIT_FALLBACK_SWEEP_SECONDS", "30"))
+    RATE_LIMIT_SHARED_SLOTS: int = int(os.getenv("RATE_LIMIT_SHARED_SLOTS", "8192"))
+    RATE_LIMIT_SHARED_PATH: Optional[str] = os.getenv("RATE_LIMIT_SHARED_PATH")
+
+    # Google API Quota Governor (units per second; background work leaves QUOTA_BACKGROUND_RESERVE for users)
+    GMAIL_QUOTA_USER_PER_SECOND: int = int(os.getenv("GMAIL_QUOTA_USER_PER_SECOND", "250"))
+    GMAIL_QUOTA_PROJECT_PER_SECOND: int = int(os.getenv("GMAIL_QUOTA_PROJECT_PER_SECOND", "20000"))
+    CALENDAR_QUOTA_USER_PER_SECOND: int = int(os.getenv("CALENDAR_QUOTA_USER_PER_SECOND", "10"))
+    CALENDAR_QUOTA_PROJECT_PER_SECOND: int = int(os.getenv("CALENDAR_QUOTA_PROJECT_PER_SECOND", "160"))
+    QUOTA_BACKGROUND_RESERVE: float = float(os.getenv("QUOTA_BACKGROUND_RESERVE", "0.3"))
+    QUOTA_MAX_WAIT_INTERACTIVE_SECONDS: float = float(os.getenv("QUOTA_MAX_WAIT_INTERACTIVE_SECONDS", "2"))
+    QUOTA_MAX_WAIT_BACKGROUND_SECONDS: float = float(os.getenv("QUOTA_MAX_WAIT_BACKGROUND_SECONDS", "60"))
+    QUOTA_BACKOFF_BASE_SECONDS: float = float(os.getenv("QUOTA_BACKOFF_BASE_SECONDS", "2"))
+    QUOTA_BACKOFF_MAX_SECONDS: float = float(os.getenv("QUOTA_BACKOFF_MAX_SECONDS", "120"))
+    QUOTA_MAX_RETRIES: int = int(os.getenv("QUOTA_MAX_RETRIES", "3"))
+
+    # Upstream Circuit Breaker (per Google service and user; routes may serve stale data while open)
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_FAILURE_WINDOW_SECONDS: int = int(os.getenv("CIRCUIT_FAILURE_WINDOW_SECONDS", "60"))
+    CIRCUIT_OPEN_SECONDS: int = int(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+    CIRCUIT_SLOW_CALL_SECONDS: float = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "10"))
+    CIRCUIT_STALE_MAX_AGE_SECONDS: int = int(os.getenv("CIRCUIT_STALE_MAX_AGE_SECONDS", "86400"))
+
+    # Request Deadlines (time budget per route; Google calls, token refreshes and DB statements share it)
+    DEADLINE_DEFAULT_SECONDS: float = float(os.getenv("DEADLINE_DEFAULT_SECONDS", "15"))
+    DEADLINE_READ_SECONDS: float = float(os.getenv("DEADLINE_READ_SECONDS", "5"))
+    DEADLINE_DASHBOARD_SECONDS: float = float(os.getenv("DEADLINE_DASHBOARD_SECONDS", "2"))
+    DEADLINE_SEND_SECONDS: float = float(os.getenv("DEADLINE_SEND_SECONDS", "10"))
+    DEADLINE_BULK_SECONDS: float = float(os.getenv("DEADLINE_BULK_SECONDS", "30"))
+    GOOGLE_HTTP_TIMEOUT_SECONDS: float = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "20"))
+    CELERY_SOFT_TIME_LIMIT_SECONDS: int = int(os.getenv("CELERY_SOFT_TIME_LIMIT_SECONDS", "120"))
+    CELERY_HARD_TIME_LIMIT_SECONDS: int = int(os.getenv("CELERY_HARD_TIME_LIMIT_SECONDS", "150"))
+
+    # Single-Flight Reads (identical overlapping Google reads share one call, across processes via Redis)
+    SINGLEFLIGHT_LOCK_SECONDS: int = int(os.getenv("SINGLEFLIGHT_LOCK_SECONDS", "30"))
+    SINGLEFLIGHT_RESULT_SECONDS: int = int(os.getenv("SINGLEFLIGHT_RESULT_SECONDS", "5"))
+
+    # Realtime Hub (one Redis pattern subscription and heartbeat ticker per process, bounded buffer per open stream)
+    REALTIME_QUEUE_SIZE: int = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+    REALTIME_STREAM_BUFFER_BYTES: int = int(os.getenv("REALTIME_STREAM_BUFFER_BYTES", "262144"))
+    REALTIME_MEMORY_BUDGET_BYTES: int = int(os.getenv("REALTIME_MEMORY_BUDGET_BYTES", "67108864"))
+    REALTIME_SSE_OVERFLOW: str = os.getenv("REALTIME_SSE_OVERFLOW", "resync")  # or "disconnect"
+    REALTIME_HEARTBEAT_SECONDS: float = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "30"))
+    REALTIME_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("REALTIME_CONNECT_TIMEOUT_SECONDS", "2"))
+    # Per-user event stream kept for Last-Event-ID replay
+    REALTIME_STREAM_MAXLEN: int = int(os.getenv("REALTIME_STREAM_MAXLEN", "500"))
+    REALTIME_STREAM_TTL_SECONDS: int = int(os.getenv("REALTIME_STREAM_TTL_SECONDS", "86400"))
+    REALTIME_REPLAY_MAX_EVENTS: int = int(os.getenv("REALTIME_REPLAY_MAX_EVENTS", "200"))
+    # Events per user are merged until quiet for the window (at most the max delay); 0 publishes at once
+    REALTIME_COALESCE_WINDOW_MS: int = int(os.getenv("REALTIME_COALESCE_WINDOW_MS", "250"))
+    REALTIME_COALESCE_MAX_DELAY_MS: int = int(os.getenv("REALTIME_COALESCE_MAX_DELAY_MS", "1000"))
+    # Windows left open by a process that went away are flushed by a beat sweep this often
+    REALTIME_COALESCE_SWEEP_SECONDS: int = int(os.getenv("REALTIME_COALESCE_SWEEP_SECONDS", "5"))
+    # WebSocket transport (a client that can't take a frame within the send timeout, or leaves
+    # too many events unacked, is disconnected and resumes from its last event ID)
+    REALTIME_WS_AUTH_TIMEOUT_SECONDS: float = float(os.getenv("REALTIME_WS_AUTH_TIMEOUT_SECONDS", "10"))
+    REALTIME_WS_SEND_TIMEOUT_SECONDS: float = float(os.getenv("REALTIME_WS_SEND_TIMEOUT_SECONDS", "10"))
+    REALTIME_WS_MAX_UNACKED: int = int(os.getenv("REALTIME_WS_MAX_UNACKED", "500"))
+
+    # Dashboard Patches (last published dashboard per user, diffed against to push versioned patches)
+    DASHBOARD_DOCUMENT_TTL_SECONDS: int = int(os.getenv("DASHBOARD_DOCUMENT_TTL_SECONDS", "604800"))
+
+    # Meeting Reminders (Redis delayed queue fed by meetings writes; the dispatcher polls it every REMINDER_POLL_SECONDS)
+    MEETING_REMINDER_MINUTES: int = int(os.getenv("MEETING_REMINDER_MINUTES", "15"))
+    REMINDER_BATCH_SIZE: int = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+    REMINDER_POLL_SECONDS: int = int(os.getenv("REMINDER_POLL_SECONDS", "15"))
+
+    # Web Push (VAPID key as PEM or base64url; delivery runs from the push:outbox queue, concurrently per push service)
+    VAPID_PRIVATE_KEY: str = os.getenv("VAPID_PRIVATE_KEY", "")
+    VAPID_ADMIN_EMAIL: str = os.getenv("VAPID_ADMIN_EMAIL", "admin@example.com")
+    PUSH_CONCURRENCY: int = int(os.getenv("PUSH_CONCURRENCY", "256"))
+    PUSH_CONNECTIONS_PER_HOST: int = int(os.getenv("PUSH_CONNECTIONS_PER_HOST", "8"))
+    PUSH_TIMEOUT_SECONDS: float = float(os.getenv("PUSH_TIMEOUT_SECONDS", "10"))
+    PUSH_TTL_SECONDS: int = int(os.getenv("PUSH_TTL_SECONDS", "86400"))
+    PUSH_BATCH_SIZE: int = int(os.getenv("PUSH_BATCH_SIZE", "1000"))
+    PUSH_DRAIN_SECONDS: int = int(os.getenv("PUSH_DRAIN_SECONDS", "60"))
+    PUSH_MAX_ATTEMPTS: int = int(os.getenv("PUSH_MAX_ATTEMPTS", "4"))
+    PUSH_RETRY_BASE_SECONDS: int = int(os.getenv("PUSH_RETRY_BASE_SECONDS", "10"))
+    # Allow http:// endpoints, e.g. a local stand-in push service for testing
+    PUSH_ALLOW_INSECURE_ENDPOINTS: bool = os.getenv("PUSH_ALLOW_INSECURE_ENDPOINTS", "false").lower() == "true"
+    # Notifications of one kind within this window are folded into one row and push
+    NOTIFICATION_DIGEST_WINDOW_SECONDS: int = int(os.getenv("NOTIFICATION_DIGEST_WINDOW_SECONDS", "1800"))
+
+    # User Counters (kept up to date on every write; the reconciler recounts this many rows per run)
+    COUNTERS_RECONCILE_BATCH: int = int(os.getenv("COUNTERS_RECONCILE_BATCH", "200"))
+    COUNTERS_RECONCILE_SECONDS: int = int(os.getenv("COUNTERS_RECONCILE_SECONDS", "600"))
+
+    # Batch API (sub-requests per POST /api/batch, run concurrently)
+    BATCH_MAX_REQUESTS: int = int(os.getenv("BATCH_MAX_REQUESTS", "10"))
+
 settings = Settings()
 
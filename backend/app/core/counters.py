@@ -0,0 +1,198 @@
+"""
+User Counters
+Per-user totals (todos, notifications, unread emails) kept in `user_counters`,
+so profile stats and dashboard badges are one primary-key read.
+
+Counts change in the same transaction as the rows they count. After every
+flush, the inserted, deleted and updated Todo, Notification and Email objects
+are turned into per-user deltas. These are applied as `count = count + delta`,
+so concurrent writers never overwrite each other. Bulk UPDATE/DELETE statements
+skip the ORM, so their callers run `emails_changing` on the same IDs first.
+
+A user's row is created on first read by counting their rows once. The
+reconciler recounts the least recently checked rows a slice at a time and
+repairs any drift (e.g. from writes made outside this code).
+"""
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.models import Email, Notification, Todo, UserCounters
+from app.core import metrics
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+TODO_FIELDS = ('todos_total', 'todos_completed')
+NOTIFICATION_FIELDS = ('notifications_total', 'notifications_unread')
+EMAIL_FIELDS = ('emails_unread', 'emails_high_unread')
+FIELDS = TODO_FIELDS + NOTIFICATION_FIELDS + EMAIL_FIELDS
+
+# Model -> attributes its counts depend on
+_TRACKED = {
+    Todo: ('completed',),
+    Notification: ('read',),
+    Email: ('is_read', 'priority'),
+}
+_FIELDS_BY_MODEL = {Todo: TODO_FIELDS, Notification: NOTIFICATION_FIELDS, Email: EMAIL_FIELDS}
+
+
+def _contribution(model, values: Dict) -> Dict[str, int]:
+    """What one row with these attribute values adds to its user's counters"""
+    if model is Todo:
+        return {'todos_total': 1, 'todos_completed': int(values['completed'] is True)}
+    if model is Notification:
+        return {'notifications_total': 1, 'notifications_unread': int(values['read'] is False)}
+    unread = values['is_read'] is False
+    return {'emails_unread': int(unread), 'emails_high_unread': int(unread and values['priority'] == 'high')}
+
+
+def _apply(connection, deltas: Dict[int, Dict[str, int]]) -> None:
+    table = UserCounters.__table__
+    for user_id, changes in deltas.items():
+        changes = {field: delta for field, delta in changes.items() if delta}
+        if changes:
+            connection.execute(table.update().where(table.c.user_id == user_id).values(
+                {field: table.c[field] + delta for field, delta in changes.items()}
+            ))
+
+
+# --- Flush hook ------------------------------------------------------------
+
+@event.listens_for(SessionLocal, "after_flush")
+def _count_flushed(session, flush_context):
+    deltas = defaultdict(lambda: defaultdict(int))
+    recount = defaultdict(set)
+
+    def add(obj, values, sign):
+        for field, value in _contribution(type(obj), values).items():
+            deltas[obj.user_id][field] += sign * value
+
+    for obj in session.new:
+        if type(obj) in _TRACKED:
+            add(obj, {attr: getattr(obj, attr) for attr in _TRACKED[type(obj)]}, 1)
+    for obj in session.deleted:
+        if type(obj) in _TRACKED:
+            add(obj, {attr: getattr(obj, attr) for attr in _TRACKED[type(obj)]}, -1)
+    for obj in session.dirty:
+        if type(obj) not in _TRACKED:
+            continue
+        state = inspect(obj)
+        current, previous = {}, {}
+        for attr in _TRACKED[type(obj)]:
+            history = state.attrs[attr].history
+            current[attr] = getattr(obj, attr)
+            if history.deleted:
+                previous[attr] = history.deleted[0]
+            elif history.added:
+                # Set without the old value ever being loaded; count this user's rows again
+                recount[obj.user_id].add(type(obj))
+                break
+            else:
+                previous[attr] = current[attr]
+        else:
+            if current != previous:
+                add(obj, current, 1)
+                add(obj, previous, -1)
+
+    try:
+        _apply(session.connection(), deltas)
+        for user_id, models in recount.items():
+            _recount(session, user_id, [f for m in models for f in _FIELDS_BY_MODEL[m]])
+    except Exception as e:
+        # The reconciler repairs the row; never fail the caller's write over a counter
+        logger.warning(f"Failed to update user counters: {e}")
+
+
+# --- Counting --------------------------------------------------------------
+
+def _counts(db: Session, user_ids: List[int], fields: Iterable[str] = FIELDS) -> Dict[int, Dict[str, int]]:
+    """Count from the tables themselves, grouped by user"""
+    fields = set(fields)
+    result = {user_id: {} for user_id in user_ids}
+    if fields & set(TODO_FIELDS):
+        for user_id, total, completed in db.query(
+            Todo.user_id, func.count(Todo.id), func.sum(case((Todo.completed == True, 1), else_=0))
+        ).filter(Todo.user_id.in_(user_ids)).group_by(Todo.user_id):
+            result[user_id].update(todos_total=total, todos_completed=completed or 0)
+    if fields & set(NOTIFICATION_FIELDS):
+        for user_id, total, unread in db.query(
+            Notification.user_id, func.count(Notification.id), func.sum(case((Notification.read == False, 1), else_=0))
+        ).filter(Notification.user_id.in_(user_ids)).group_by(Notification.user_id):
+            result[user_id].update(notifications_total=total, notifications_unread=unread or 0)
+    if fields & set(EMAIL_FIELDS):
+        for user_id, unread, high in db.query(
+            Email.user_id, func.count(Email.id), func.sum(case((Email.priority == 'high', 1), else_=0))
+        ).filter(Email.user_id.in_(user_ids), Email.is_read == False).group_by(Email.user_id):
+            result[user_id].update(emails_unread=unread, emails_high_unread=high or 0)
+    for counts in result.values():
+        for field in fields:
+            counts.setdefault(field, 0)
+    return result
+
+
+def _recount(db: Session, user_id: int, fields: Iterable[str] = FIELDS) -> None:
+    counts = _counts(db, [user_id], fields)[user_id]
+    table = UserCounters.__table__
+    db.connection().execute(table.update().where(table.c.user_id == user_id).values(counts))
+
+
+def get(db: Session, user_id: int) -> Dict[str, int]:
+    """The user's counters, creating their row from a full count the first time"""
+    row = db.query(UserCounters).filter(UserCounters.user_id == user_id).first()
+    if row is None:
+        counts = _counts(db, [user_id])[user_id]
+        # Inserted in a session of its own, so reading counters never commits or discards the caller's work
+        insert = SessionLocal()
+        try:
+            insert.add(UserCounters(user_id=user_id, reconciled_at=datetime.now(timezone.utc), **counts))
+            insert.commit()
+        except IntegrityError:
+            # Created by a concurrent request
+            insert.rollback()
+        finally:
+            insert.close()
+        return {field: counts[field] for field in FIELDS}
+    return {field: getattr(row, field) for field in FIELDS}
+
+
+def emails_changing(db: Session, user_id: int, message_ids: List[str], read: Optional[bool]) -> None:
+    """Adjust email counters for a bulk read change (read=True/False) or delete (None) about to run"""
+    if not message_ids:
+        return
+    # Rows that will stop being unread (read or delete), or start being unread
+    query = db.query(func.count(Email.id), func.sum(case((Email.priority == 'high', 1), else_=0))).filter(
+        Email.user_id == user_id,
+        Email.id.in_(message_ids),
+        Email.is_read == (read is False)
+    )
+    changed, high = query.one()
+    sign = 1 if read is False else -1
+    _apply(db.connection(), {user_id: {'emails_unread': sign * (changed or 0), 'emails_high_unread': sign * (high or 0)}})
+
+
+def reconcile(db: Session, limit: int = None) -> int:
+    """Recount the least recently reconciled rows and repair drift; returns how many were wrong"""
+    limit = limit or settings.COUNTERS_RECONCILE_BATCH
+    rows = db.query(UserCounters).order_by(UserCounters.reconciled_at.asc()).limit(limit).all()
+    if not rows:
+        return 0
+    counts = _counts(db, [row.user_id for row in rows])
+    now = datetime.now(timezone.utc)
+    repaired = 0
+    for row in rows:
+        actual = counts[row.user_id]
+        if any(getattr(row, field) != actual[field] for field in FIELDS):
+            logger.info(f"Counters for user {row.user_id} drifted; repairing")
+            for field in FIELDS:
+                setattr(row, field, actual[field])
+            repaired += 1
+        row.reconciled_at = now
+    db.commit()
+    if repaired:
+        metrics.record('counters.repaired', repaired)
+    return repaired
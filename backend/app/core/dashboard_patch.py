@@ -0,0 +1,196 @@
+"""
+Dashboard Patches
+Keeps the last dashboard published to each user as a versioned document in Redis
+and pushes only what changed over the realtime stream.
+
+A commit diffs a freshly built dashboard against the stored document. It stores
+the new document under the next version and publishes a `dashboard.patch` event:
+
+    {"base": 41, "version": 42, "patch": {
+        "emails": {"added": [...], "changed": {"<id>": {"unread": false}}, "removed": ["<id>"], "order": [...]},
+        "dailyBrief": {"replace": {...}}
+    }}
+
+A client applies a patch only when its `base` is the version it holds, ignores
+patches it is already past, and otherwise fetches a snapshot. The snapshot is
+the cached /contextual-data response, which always carries the version it
+was stored with. `base` is None when there was no document to diff against.
+
+Versions start from the Redis clock in ms and then count up, so they keep
+increasing even after a document expires.
+
+Partial responses (`include=`/`fields=`) are cached per shape, as fields of one
+hash per user. That way a commit or an invalidation drops every shape at once.
+Each entry records when it was stored and is ignored once older than the summary
+would be. The hash's own TTL only cleans up entries nobody asks for again.
+"""
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.events import publish_event, DASHBOARD_PATCH
+from app.core import metrics
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Sections holding items with an `id`; anything else is replaced whole when it changes
+_LIST_SECTIONS = ('emails', 'meetings', 'todos', 'notifications', 'suggestions')
+
+# Lifetime of the cached /contextual-data response
+SUMMARY_SECONDS = 600
+
+# KEYS[1] = document hash, KEYS[2] = summary cache, KEYS[3] = per-shape cache
+# ARGV = expected version ('' for none), document JSON, document TTL, summary TTL, '1' to keep the version
+# Stores the document and the matching summary only if nobody committed since we read
+# the document, dropping cached shapes of the old one. Returns the stored version, or
+# -1 if we lost the race.
+_COMMIT_SCRIPT = """
+pcall(redis.replicate_commands)
+local current = redis.call('HGET', KEYS[1], 'version')
+if (current or '') ~= ARGV[1] then
+    return -1
+end
+local version
+if ARGV[5] == '1' then
+    version = tonumber(current)
+elseif current then
+    version = tonumber(current) + 1
+else
+    local t = redis.call('TIME')
+    version = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+end
+redis.call('HSET', KEYS[1], 'version', version, 'document', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SET', KEYS[2], '{"version":' .. version .. ',' .. string.sub(ARGV[2], 2), 'EX', ARGV[4])
+if ARGV[5] ~= '1' then
+    redis.call('DEL', KEYS[3])
+end
+return version
+"""
+
+_commit = None
+
+
+def _document_key(user_id: int) -> str:
+    return f"dashboard:document:{user_id}"
+
+
+def _summary_key(user_id: int) -> str:
+    return f"dashboard:summary:{user_id}"
+
+
+def shapes_key(user_id: int) -> str:
+    return f"dashboard:shapes:{user_id}"
+
+
+def cached_shape(user_id: int, shape: str) -> Optional[Dict[str, Any]]:
+    """A cached partial response, or None if there isn't a fresh one"""
+    if not cache.enabled:
+        return None
+    try:
+        stored = cache.client.hget(shapes_key(user_id), shape)
+        if not stored:
+            return None
+        entry = json.loads(stored)
+    except Exception as e:
+        logger.warning(f"Reading dashboard shape {shape} for user {user_id} failed: {e}")
+        return None
+    if time.time() - entry.get('at', 0) > SUMMARY_SECONDS:
+        return None
+    return entry.get('body')
+
+
+def cache_shape(user_id: int, shape: str, body: Dict[str, Any]) -> None:
+    if not cache.enabled:
+        return
+    try:
+        pipe = cache.client.pipeline(transaction=False)
+        pipe.hset(shapes_key(user_id), shape, json.dumps({"at": time.time(), "body": body}, default=str))
+        pipe.expire(shapes_key(user_id), SUMMARY_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Caching dashboard shape {shape} for user {user_id} failed: {e}")
+
+
+def _diff_list(before: List[Dict], after: List[Dict]) -> Dict[str, Any]:
+    old = {str(item.get('id')): item for item in before}
+    new_ids = [str(item.get('id')) for item in after]
+    ops: Dict[str, Any] = {}
+
+    added = [item for item in after if str(item.get('id')) not in old]
+    changed = {}
+    for item in after:
+        previous = old.get(str(item.get('id')))
+        if previous is None or previous == item:
+            continue
+        fields = {key: value for key, value in item.items() if previous.get(key) != value}
+        fields.update({key: None for key in previous if key not in item})
+        changed[str(item.get('id'))] = fields
+    kept = set(new_ids)
+    removed = [item_id for item_id in old if item_id not in kept]
+
+    if added:
+        ops['added'] = added
+    if changed:
+        ops['changed'] = changed
+    if removed:
+        ops['removed'] = removed
+    if new_ids != list(old):
+        ops['order'] = new_ids
+    return ops
+
+
+def diff(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """Patch turning dashboard `before` into `after` (empty if they are the same)"""
+    patch = {}
+    for section, value in after.items():
+        previous = before.get(section)
+        if section in _LIST_SECTIONS and isinstance(value, list) and isinstance(previous, list):
+            ops = _diff_list(previous, value)
+            if ops:
+                patch[section] = ops
+        elif previous != value:
+            patch[section] = {"replace": value}
+    return patch
+
+
+def commit(user_id: int, dashboard: Dict[str, Any]) -> Optional[int]:
+    """Store `dashboard` as the user's current version and publish the patch from the last one.
+
+    Also caches it as the /contextual-data response. Returns the version, or None
+    if Redis is unavailable (callers then fall back to invalidate-and-refetch).
+    """
+    global _commit
+    if not cache.enabled:
+        return None
+    dashboard = {key: value for key, value in dashboard.items() if key != 'version'}
+    document = json.dumps(dashboard, default=str)
+    after = json.loads(document)  # Compare in the same JSON form as the stored copy
+
+    for _ in range(3):
+        try:
+            if _commit is None:
+                _commit = cache.client.register_script(_COMMIT_SCRIPT)
+            current, stored = cache.client.hmget(_document_key(user_id), ['version', 'document'])
+            before = json.loads(stored) if stored else None
+            patch = diff(before, after) if before is not None else None
+            unchanged = before is not None and not patch
+            version = int(_commit(
+                keys=[_document_key(user_id), _summary_key(user_id), shapes_key(user_id)],
+                args=[current or '', document, settings.DASHBOARD_DOCUMENT_TTL_SECONDS, SUMMARY_SECONDS, '1' if unchanged else '0']
+            ))
+        except Exception as e:
+            logger.warning(f"Dashboard commit failed for user {user_id}: {e}")
+            return None
+        if version < 0:
+            continue  # Someone else committed in between; diff against theirs
+        if not unchanged:
+            base = int(current) if patch is not None else None
+            publish_event(user_id, DASHBOARD_PATCH, {"base": base, "version": version, "patch": patch})
+            metrics.record('dashboard.patch' if patch is not None else 'dashboard.snapshot')
+        return version
+
+    logger.warning(f"Dashboard commit for user {user_id} kept losing races; giving up")
+    return None
@@ -1,13 +1,27 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core import deadline
 
 engine = create_engine(
     settings.DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+@event.listens_for(engine, "before_cursor_execute")
+def _check_deadline(conn, cursor, statement, parameters, context, executemany):
+    """Don't start a statement the request no longer has time for"""
+    deadline.check("database query")
+
+if engine.dialect.name == "postgresql":
+    @event.listens_for(engine, "begin")
+    def _statement_timeout(conn):
+        """Let Postgres cancel statements that would outlive the request's deadline"""
+        remaining = deadline.remaining()
+        if remaining is not None:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {max(1, int(remaining * 1000))}")
+
 Base = declarative_base()
 
 def get_db():
@@ -0,0 +1,155 @@
+"""
+Request Deadlines
+Every API request (and every Celery task) runs with a deadline held in a
+context variable. Code that waits on the network or the database asks for the
+remaining budget instead of using its own fixed timeout:
+- Google calls use it as their socket timeout, and are skipped once it's gone;
+- token refreshes are bounded the same way;
+- every DB statement checks it, and on Postgres each transaction gets a
+  matching statement_timeout;
+- quota waits never outlast it.
+
+DeadlineMiddleware picks the budget per route (ROUTE_DEADLINES). If the handler
+hasn't started a response when the budget (plus a small grace period) runs out,
+it is cancelled and the client gets a 504.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.core.config import settings
+from typing import Optional
+import asyncio
+import json
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Absolute time.monotonic() by which the current request/task must finish
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+# Time allowed after the deadline for a handler to turn a timeout into its own response
+_GRACE_SECONDS = 0.5
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before `operation` could start"""
+
+    def __init__(self, operation: str = "operation"):
+        super().__init__(f"Deadline exceeded before {operation}")
+        self.operation = operation
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, or None if there is no deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(operation: str = "operation") -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(operation)
+
+
+def bounded(timeout: float, operation: str = "operation") -> float:
+    """`timeout` cut down to the remaining budget; raises DeadlineExceeded if none is left"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded(operation)
+    return min(timeout, left)
+
+
+def start(seconds: float):
+    """Begin a budget of `seconds` in the current context; pass the returned token to end()"""
+    new = time.monotonic() + seconds
+    current = _deadline.get()
+    return _deadline.set(new if current is None else min(current, new))
+
+
+def end(token) -> None:
+    _deadline.reset(token)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """Run a block with at most `seconds` of budget (a tighter enclosing deadline still wins)"""
+    if seconds is None:
+        yield
+        return
+    token = start(seconds)
+    try:
+        yield
+    finally:
+        end(token)
+
+
+# (method or None for any, path pattern, seconds or None for no deadline); first match wins
+ROUTE_DEADLINES = [
+    (None, re.compile(r"^/api/realtime/stream"), None),  # Long-lived event stream
+    ("POST", re.compile(r"^/api/emails/bulk"), settings.DEADLINE_BULK_SECONDS),
+    ("POST", re.compile(r"^/api/emails/[^/]+/(reply|forward)$"), settings.DEADLINE_SEND_SECONDS),
+    ("GET", re.compile(r"^/api/dashboard"), settings.DEADLINE_DASHBOARD_SECONDS),
+    # Reads, each under its own route's deadline; the batch as a whole gets the longest of them
+    ("POST", re.compile(r"^/api/batch$"), max(
+        settings.DEADLINE_DEFAULT_SECONDS, settings.DEADLINE_READ_SECONDS, settings.DEADLINE_DASHBOARD_SECONDS
+    )),
+    ("GET", re.compile(r"^/api/"), settings.DEADLINE_READ_SECONDS),
+    (None, re.compile(r"^/api/meetings"), settings.DEADLINE_SEND_SECONDS),  # Calendar writes
+]
+
+
+def route_deadline(method: str, path: str) -> Optional[float]:
+    for route_method, pattern, seconds in ROUTE_DEADLINES:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return seconds
+    return settings.DEADLINE_DEFAULT_SECONDS
+
+
+class DeadlineMiddleware:
+    """ASGI middleware that gives each HTTP request its route's time budget"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        seconds = route_deadline(scope["method"], scope["path"])
+        if not seconds:
+            return await self.app(scope, receive, send)
+
+        state = {"started": False, "timed_out": False}
+
+        async def guarded_send(message):
+            if state["timed_out"]:
+                return  # The 504 has already been sent
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        with deadline(seconds):
+            # The task copies the current context, so the handler sees the deadline
+            task = asyncio.ensure_future(self.app(scope, receive, guarded_send))
+        done, _ = await asyncio.wait({task}, timeout=seconds + _GRACE_SECONDS)
+        if task in done:
+            return task.result()
+        if state["started"]:
+            return await task  # Too late to replace the response; let it finish
+
+        state["timed_out"] = True
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        logger.warning(f"{scope['method']} {scope['path']} cancelled after its {seconds}s deadline")
+        body = json.dumps({"detail": "Request deadline exceeded"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
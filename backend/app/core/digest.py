@@ -0,0 +1,94 @@
+"""
+Notification Digests
+Folds a user's notifications of one kind into one row and one push per window.
+
+The first high-priority email opens a digest: a `notifications` row whose
+created_at marks the start of the window. Until NOTIFICATION_DIGEST_WINDOW_SECONDS
+have passed, or the user reads it, later emails are folded into that row rather
+than added as rows. The row keeps the email IDs and senders it covers in
+`details`, its size in `count`, and the summary ("5 high-priority emails from 3
+senders") in `message`. An email seen again by an overlapping sync is not
+counted twice.
+
+Each update is pushed with the same Web Push topic and notification tag. An
+undelivered push is replaced by the newer one, and on screen the summary is
+updated rather than added to.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified
+from app.core.config import settings
+from app.core.models import Email, Notification
+from app.core.push_notifications import PushNotificationService
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMAIL_TOPIC = "email-digest"
+
+
+def _sender_name(sender: Optional[str]) -> str:
+    """'Jane Doe <jane@example.com>' -> 'Jane Doe'"""
+    if not sender:
+        return "unknown sender"
+    name = sender.split("<", 1)[0].strip().strip('"')
+    return name or sender.strip("<> ")
+
+
+def _open_digest(db: Session, user_id: int) -> Optional[Notification]:
+    window_start = datetime.now(timezone.utc) - timedelta(seconds=settings.NOTIFICATION_DIGEST_WINDOW_SECONDS)
+    return db.query(Notification).filter(
+        Notification.user_id == user_id,
+        Notification.type == 'email',
+        Notification.read == False,
+        Notification.created_at >= window_start
+    ).order_by(Notification.created_at.desc()).first()
+
+
+def add_high_priority_emails(db: Session, user_id: int, emails: List[Email]) -> Optional[Notification]:
+    """Fold newly stored high-priority emails into the user's email digest, then push it"""
+    if not emails:
+        return None
+
+    digest = _open_digest(db, user_id)
+    if digest is None:
+        digest = Notification(user_id=user_id, type='email', message="", read=False)
+        db.add(digest)
+    details = digest.details or {}
+    email_ids = list(details.get("email_ids", []))
+    senders = list(details.get("senders", []))
+    new = [email for email in emails if email.id not in email_ids]
+    if not new:
+        return digest
+    for email in new:
+        email_ids.append(email.id)
+        name = _sender_name(email.sender)
+        if name not in senders:
+            senders.append(name)
+    digest.details = {"email_ids": email_ids, "senders": senders}
+    flag_modified(digest, "details")
+    digest.count = count = len(email_ids)
+
+    if count == 1:
+        latest = new[-1]
+        title = "High Priority Email"
+        body = f"New email from {senders[0]}: {latest.subject or '(No subject)'}"
+        digest.message = f"New high-priority email: {latest.subject or '(No subject)'}"
+    else:
+        title = "High Priority Emails"
+        body = f"{count} high-priority emails from {len(senders)} sender{'s' if len(senders) != 1 else ''}"
+        digest.message = body
+    db.commit()
+
+    try:
+        PushNotificationService(db).send_notification(
+            user_id=user_id,
+            title=title,
+            body=body,
+            data={"type": "email_digest", "count": count, "notification_id": digest.id},
+            topic=EMAIL_TOPIC
+        )
+    except Exception as e:
+        logger.warning(f"Failed to push email digest for user {user_id}: {e}")
+    return digest
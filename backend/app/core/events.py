@@ -0,0 +1,367 @@
+"""
+Realtime Events
+Publishes per-user update events on the `updates:{user_id}` channel that
+/api/realtime/stream relays to the browser.
+
+Events are small and specific ("email.read" with the message ID, "meeting.updated"
+with the fields that changed), so clients can patch what they show instead of
+refetching the whole dashboard.
+
+Every event is also appended to a capped per-user Redis Stream (`events:{user_id}`),
+and its stream ID is sent along as the SSE `id:`. A client that reconnects with
+Last-Event-ID gets what it missed replayed from the stream. It only gets a
+resync hint when that part of the stream has already been trimmed.
+
+Producers don't publish directly. Events for a user are buffered in Redis
+(shared by API and Celery workers) until no new event has arrived for
+REALTIME_COALESCE_WINDOW_MS, or until REALTIME_COALESCE_MAX_DELAY_MS after the
+first one. They are then merged by entity ID and sent as one event, or as one
+"batch" event if several kinds remain.
+
+The process that opened a window flushes it from a timer. Open windows are
+also listed in `events:pending:windows`, scored by when they opened, so a beat
+sweep can flush the ones whose owner exited before its timer fired.
+"""
+from app.core.cache import cache
+from app.core.config import settings
+from app.core import metrics
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Event types
+EMAIL_READ = "email.read"
+EMAIL_UNREAD = "email.unread"
+EMAIL_NEW = "email.new"
+EMAIL_DELETED = "email.deleted"
+MEETING_CREATED = "meeting.created"
+MEETING_UPDATED = "meeting.updated"
+MEETING_DELETED = "meeting.deleted"
+MEETING_REMINDER = "meeting.reminder"
+TODO_UPDATED = "todo.updated"
+DASHBOARD_PATCH = "dashboard.patch"
+REFRESH_DASHBOARD = "REFRESH_DASHBOARD"
+BATCH = "batch"
+
+# Events about one entity (by ID) that are merged within a coalescing window
+_ENTITY_EVENTS = (
+    EMAIL_READ, EMAIL_UNREAD, EMAIL_NEW, EMAIL_DELETED,
+    MEETING_CREATED, MEETING_UPDATED, MEETING_DELETED, TODO_UPDATED
+)
+# Pairs where a later event for an ID cancels the earlier one
+_OPPOSITES = {EMAIL_READ: EMAIL_UNREAD, EMAIL_UNREAD: EMAIL_READ}
+
+# Sent instead of events a client can no longer be given one by one
+RESYNC = json.dumps({"type": REFRESH_DASHBOARD, "reason": "resync"})
+
+# KEYS[1] = stream, KEYS[2] = channel; ARGV = max length, event JSON, stream TTL in ms
+# Appends the event and publishes it with its stream ID in one round trip, so the two always agree
+_PUBLISH_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'event', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+redis.call('PUBLISH', KEYS[2], '{"id":"' .. id .. '","event":' .. ARGV[2] .. '}')
+return id
+"""
+
+# KEYS[1] = pending list, KEYS[2] = window hash, KEYS[3] = open windows
+# ARGV = event JSON, token, TTL in ms, stale owner age in ms, user ID
+# Buffers an event. Returns 1 if the caller now owns flushing this window (it started it,
+# or took over from an owner that stopped flushing), else 0.
+_BUFFER_SCRIPT = """
+pcall(redis.replicate_commands)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('RPUSH', KEYS[1], ARGV[1])
+local owned = 0
+local first = tonumber(redis.call('HGET', KEYS[2], 'first'))
+if not first or now - first > tonumber(ARGV[4]) then
+    redis.call('HSET', KEYS[2], 'first', now, 'owner', ARGV[2])
+    redis.call('ZADD', KEYS[3], now, ARGV[5])
+    owned = 1
+end
+redis.call('HSET', KEYS[2], 'last', now)
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+redis.call('PEXPIRE', KEYS[2], ARGV[3])
+return owned
+"""
+
+# KEYS as above; ARGV = token, quiet window in ms, max delay in ms, user ID
+# Returns {ms to wait} while the window is still open, {0, event...} once it closes
+# (and empties the buffer), or {-1} if another owner has taken over.
+_FLUSH_SCRIPT = """
+pcall(redis.replicate_commands)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[2], 'first', 'last', 'owner')
+if state[3] ~= ARGV[1] then
+    return {-1}
+end
+local wait = math.min(tonumber(state[2]) + tonumber(ARGV[2]) - now, tonumber(state[1]) + tonumber(ARGV[3]) - now)
+if wait > 0 then
+    return {wait}
+end
+local events = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('ZREM', KEYS[3], ARGV[4])
+table.insert(events, 1, 0)
+return events
+"""
+
+# KEYS as above; ARGV = token, stale owner age in ms, user ID
+# Takes over a window whose owner hasn't flushed it in time. Returns 1 if the caller
+# should now flush it, else 0 (it is still in time, or already gone).
+_CLAIM_SCRIPT = """
+pcall(redis.replicate_commands)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local first = tonumber(redis.call('HGET', KEYS[2], 'first'))
+if not first then
+    redis.call('ZREM', KEYS[3], ARGV[3])
+    return 0
+end
+if now - first <= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[2], 'owner', ARGV[1])
+return 1
+"""
+
+_publish = None
+_buffer = None
+_flush = None
+_claim = None
+
+WINDOWS_KEY = "events:pending:windows"
+
+
+def channel(user_id: int) -> str:
+    return f"updates:{user_id}"
+
+
+def stream_key(user_id: int) -> str:
+    return f"events:{user_id}"
+
+
+def parse_message(data: str) -> Tuple[Optional[str], str]:
+    """Split a channel message into (stream ID, event JSON); plain events have no ID"""
+    # Sliced rather than decoded: this runs once per message for every open stream's process
+    if data.startswith('{"id":"'):
+        end = data.find('"', 7)
+        if end > 0 and data.startswith(',"event":', end + 1) and data.endswith('}'):
+            return data[7:end], data[end + 10:-1]
+    return None, data
+
+
+def stream_id_key(event_id: str) -> Tuple[int, int]:
+    """Sortable form of a stream ID ("<ms>-<seq>")"""
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def replay(user_id: int, last_event_id: str) -> Optional[List[Tuple[str, str]]]:
+    """Events after `last_event_id` as (ID, event JSON), or None if some were trimmed away"""
+    try:
+        last = stream_id_key(last_event_id)
+    except ValueError:
+        return None
+    try:
+        oldest = cache.client.xrange(stream_key(user_id), count=1)
+        if not oldest or stream_id_key(oldest[0][0]) > last:
+            # The stream starts after what the client saw: anything in between is gone
+            return None
+        entries = cache.client.xrange(stream_key(user_id), min=last_event_id, count=settings.REALTIME_REPLAY_MAX_EVENTS + 1)
+    except Exception as e:
+        logger.warning(f"Event replay failed for user {user_id}: {e}")
+        return None
+    events = [(event_id, fields["event"]) for event_id, fields in entries if stream_id_key(event_id) > last]
+    if len(events) > settings.REALTIME_REPLAY_MAX_EVENTS:
+        return None  # Cheaper to refetch than to replay this much
+    return events
+
+
+def _event_ids(event: Dict[str, Any]) -> List[str]:
+    data = event.get("data") or {}
+    if data.get("ids"):
+        return [str(i) for i in data["ids"]]
+    return [str(data["id"])] if data.get("id") is not None else []
+
+
+def merge_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Collapse a window of events: one per entity event type (IDs de-duplicated), one refresh"""
+    merged: List[Any] = []
+    groups: Dict[str, Dict[str, Any]] = {}
+    refresh = False
+    for event in events:
+        event_type = event.get("type")
+        if event_type == REFRESH_DASHBOARD:
+            if not refresh:
+                merged.append(event)
+            refresh = True
+            continue
+        if event_type not in _ENTITY_EVENTS:
+            merged.append(event)  # e.g. dashboard patches, which must all arrive in order
+            continue
+        group = groups.get(event_type)
+        if group is None:
+            group = groups[event_type] = {"events": [], "ids": {}, "changes": {}, "threads": {}}
+            merged.append(event_type)
+        group["events"].append(event)
+        opposite = groups.get(_OPPOSITES.get(event_type))
+        for item_id in _event_ids(event):
+            if opposite:
+                opposite["ids"].pop(item_id, None)
+            group["ids"][item_id] = True
+            changes = (event.get("data") or {}).get("changes")
+            if changes:
+                group["changes"].setdefault(item_id, {}).update(changes)
+            thread_id = (event.get("data") or {}).get("thread_id")
+            if thread_id:
+                group["threads"][item_id] = thread_id
+
+    result = []
+    for entry in merged:
+        if not isinstance(entry, str):
+            result.append(entry)
+            continue
+        if refresh:
+            continue  # Clients refetch everything anyway
+        group = groups[entry]
+        if not group["ids"]:
+            continue  # Cancelled out (e.g. read, then unread again)
+        if len(group["events"]) == 1:
+            result.append(group["events"][0])
+            continue
+        data: Dict[str, Any] = {"ids": list(group["ids"])}
+        if entry in _OPPOSITES:
+            data["unread"] = entry == EMAIL_UNREAD
+        if group["changes"]:
+            data["changes_by_id"] = {i: group["changes"][i] for i in group["ids"] if i in group["changes"]}
+        if group["threads"]:
+            data["thread_id_by_id"] = {i: group["threads"][i] for i in group["ids"] if i in group["threads"]}
+        last = group["events"][-1]
+        result.append({"type": entry, "user_id": last.get("user_id"), "timestamp": last.get("timestamp"), "data": data})
+    return result
+
+
+def _send(user_id: int, message: str) -> None:
+    global _publish
+    if _publish is None:
+        _publish = cache.client.register_script(_PUBLISH_SCRIPT)
+    _publish(
+        keys=[stream_key(user_id), channel(user_id)],
+        args=[settings.REALTIME_STREAM_MAXLEN, message, settings.REALTIME_STREAM_TTL_SECONDS * 1000]
+    )
+
+
+def _pending_keys(user_id: int) -> List[str]:
+    return [f"events:pending:{user_id}", f"events:pending:{user_id}:window", WINDOWS_KEY]
+
+
+def _stale_owner_ms() -> int:
+    """How long after its window opened an owner that hasn't flushed is presumed gone"""
+    return settings.REALTIME_COALESCE_MAX_DELAY_MS + 2000
+
+
+def _schedule_flush(user_id: int, token: str, delay_ms: float) -> None:
+    timer = threading.Timer(max(delay_ms, 1) / 1000, _flush_pending, (user_id, token))
+    timer.daemon = True
+    timer.start()
+
+
+def _flush_pending(user_id: int, token: str) -> None:
+    """Publish the user's buffered events once their window has closed"""
+    global _flush
+    try:
+        if _flush is None:
+            _flush = cache.client.register_script(_FLUSH_SCRIPT)
+        result = _flush(
+            keys=_pending_keys(user_id),
+            args=[token, settings.REALTIME_COALESCE_WINDOW_MS, settings.REALTIME_COALESCE_MAX_DELAY_MS, user_id]
+        )
+        status = int(result[0])
+        if status < 0:
+            return
+        if status > 0:
+            _schedule_flush(user_id, token, status)
+            return
+
+        events = [json.loads(item) for item in result[1:]]
+        merged = merge_events(events)
+        if len(events) > len(merged):
+            metrics.record('realtime.coalesced', len(events) - len(merged))
+        if len(merged) == 1:
+            _send(user_id, json.dumps(merged[0], default=str))
+        elif merged:
+            _send(user_id, json.dumps({
+                "type": BATCH,
+                "user_id": user_id,
+                "timestamp": datetime.now().isoformat(),
+                "events": merged
+            }, default=str))
+    except Exception as e:
+        logger.warning(f"Failed to flush realtime events for user {user_id}: {e}")
+
+
+def publish_event(user_id: int, event_type: str, data: Optional[Dict[str, Any]] = None) -> None:
+    """Queue one event for the user's realtime channel (no-op without Redis)"""
+    event = {
+        "type": event_type,
+        "user_id": user_id,
+        "timestamp": datetime.now().isoformat()
+    }
+    if data:
+        event["data"] = data
+    global _buffer
+    if not cache.enabled:
+        return
+    message = json.dumps(event, default=str)
+    try:
+        if settings.REALTIME_COALESCE_WINDOW_MS <= 0:
+            _send(user_id, message)
+            return
+        if _buffer is None:
+            _buffer = cache.client.register_script(_BUFFER_SCRIPT)
+        token = uuid.uuid4().hex
+        # Kept long enough for the sweep to find windows whose owner is gone
+        ttl_ms = settings.REALTIME_COALESCE_MAX_DELAY_MS * 2 + 5000 + settings.REALTIME_COALESCE_SWEEP_SECONDS * 2000
+        owned = _buffer(
+            keys=_pending_keys(user_id),
+            args=[message, token, ttl_ms, _stale_owner_ms(), user_id]
+        )
+        if owned:
+            _schedule_flush(user_id, token, settings.REALTIME_COALESCE_WINDOW_MS)
+    except Exception as e:
+        logger.warning(f"Failed to publish {event_type} for user {user_id}: {e}")
+
+
+def flush_abandoned() -> int:
+    """Flush windows whose owner went away before flushing them; returns how many"""
+    global _claim
+    if not cache.enabled:
+        return 0
+    try:
+        if _claim is None:
+            _claim = cache.client.register_script(_CLAIM_SCRIPT)
+        cutoff = time.time() * 1000 - _stale_owner_ms()
+        user_ids = cache.client.zrangebyscore(WINDOWS_KEY, '-inf', cutoff, start=0, num=1000)
+    except Exception as e:
+        logger.warning(f"Failed to look for abandoned realtime events: {e}")
+        return 0
+    flushed = 0
+    for user_id in user_ids:
+        token = uuid.uuid4().hex
+        try:
+            if _claim(keys=_pending_keys(int(user_id)), args=[token, _stale_owner_ms(), user_id]):
+                _flush_pending(int(user_id), token)
+                flushed += 1
+        except Exception as e:
+            logger.warning(f"Failed to flush abandoned realtime events for user {user_id}: {e}")
+    if flushed:
+        metrics.record('realtime.abandoned_flushed', flushed)
+    return flushed
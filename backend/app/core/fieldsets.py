@@ -0,0 +1,98 @@
+"""
+Sparse Fieldsets
+Lets a client ask for only part of a response. `include=` picks the top-level
+sections of a sectioned response and `fields=` picks the keys kept on each item:
+
+    /api/dashboard/contextual-data?include=counts
+    /api/dashboard/contextual-data?include=emails,todos&fields=emails.subject,emails.unread
+    /api/dashboard/emails?fields=subject,unread
+
+On a sectioned response, `fields` entries are `section.key`, and sections it
+doesn't name keep every key. On a list response they are bare keys. An item's
+`id` is always kept, so clients can still match items to realtime events.
+Unknown names are a 400, so a typo can't quietly return nothing.
+
+Every shape has one canonical string, which callers use to key its cache entry.
+"""
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from typing import Any, Dict, FrozenSet, List, Optional, Type
+
+# Section -> keys kept on it (None for all of them)
+Shape = Dict[str, Optional[FrozenSet[str]]]
+
+
+def keys_of(model: Type[BaseModel]) -> FrozenSet[str]:
+    return frozenset(model.model_fields)
+
+
+def _names(value: Optional[str]) -> List[str]:
+    return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+
+def _unknown(kind: str, names) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Unknown {kind}: {', '.join(sorted(names))}"
+    )
+
+
+def _with_id(keys, allowed: FrozenSet[str]) -> FrozenSet[str]:
+    return frozenset(keys) | (allowed & {'id'})
+
+
+def parse_fields(fields: Optional[str], allowed: FrozenSet[str]) -> Optional[FrozenSet[str]]:
+    """Keys to keep on each item of a list response, or None for all of them"""
+    names = _names(fields)
+    if not names:
+        return None
+    unknown = set(names) - allowed
+    if unknown:
+        raise _unknown("fields", unknown)
+    return _with_id(names, allowed)
+
+
+def parse_shape(include: Optional[str], fields: Optional[str], sections: Dict[str, FrozenSet[str]]) -> Optional[Shape]:
+    """The requested sections and their keys, or None when the whole response was asked for"""
+    included, named = _names(include), _names(fields)
+    if not included and not named:
+        return None
+    unknown = set(included) - set(sections)
+    if unknown:
+        raise _unknown("sections", unknown)
+    shape: Shape = {section: None for section in included or sections}
+
+    selected: Dict[str, set] = {}
+    for name in named:
+        section, _, key = name.partition(".")
+        if key not in sections.get(section, ()):
+            raise _unknown("fields", [name])
+        if section in shape:
+            selected.setdefault(section, set()).add(key)
+    for section, keys in selected.items():
+        shape[section] = _with_id(keys, sections[section])
+    return shape
+
+
+def canonical(shape: Shape) -> str:
+    """e.g. 'counts;emails(id,subject)'; equal shapes always give the same string"""
+    return ";".join(
+        section if keys is None else f"{section}({','.join(sorted(keys))})"
+        for section, keys in sorted(shape.items())
+    )
+
+
+def project(value: Any, keys: Optional[FrozenSet[str]]) -> Any:
+    """Keep only `keys` on a JSON-ready dict, or on each dict in a list"""
+    if keys is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, keys) for item in value]
+    if isinstance(value, dict):
+        return {key: item for key, item in value.items() if key in keys}
+    return value
+
+
+def apply(data: Dict[str, Any], shape: Shape) -> Dict[str, Any]:
+    """The sections of a JSON-ready response that `shape` asks for"""
+    return {section: project(data.get(section), keys) for section, keys in shape.items()}
@@ -2,6 +2,7 @@ from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from app.core.config import settings
+from app.core import deadline
 from typing import Optional, Dict
 import json
 import os
@@ -9,6 +10,13 @@ import os
 # Allow insecure transport for localhost development (HTTP instead of HTTPS)
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
+class BoundedRequest(Request):
+    """Token endpoint transport whose timeout is bounded by the request deadline"""
+    
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        timeout = deadline.bounded(settings.GOOGLE_HTTP_TIMEOUT_SECONDS, "token refresh")
+        return super().__call__(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
 # OAuth 2.0 scopes
 # Note: 'openid' is automatically added by Google, so we include it explicitly
 # Updated to include write permissions for email and calendar management
@@ -121,7 +129,7 @@ def refresh_access_token(refresh_token: str, client_id: str, client_secret: str)
         client_secret=client_secret
     )
     
-    creds.refresh(Request())
+    creds.refresh(BoundedRequest())
     
     return {
         "token": creds.token,
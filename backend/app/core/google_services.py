@@ -1,14 +1,124 @@
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from google_auth_httplib2 import AuthorizedHttp
+from app.core import quota, deadline
+from app.core.google_auth import BoundedRequest
+from app.core.circuit_breaker import breakers, CircuitOpen, is_upstream_failure
+from app.core.config import settings
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 import base64
 import email
+import httplib2
+import time
 from email.utils import parsedate_to_datetime
 
+
+def _set_socket_timeout(http, seconds: float) -> None:
+    """Bound the next call on this client (httplib2 keeps the timeout a connection was opened with)"""
+    http = getattr(http, 'http', http)  # Unwrap AuthorizedHttp
+    http.timeout = seconds
+    for connection in http.connections.values():
+        connection.timeout = seconds
+        if getattr(connection, 'sock', None) is not None:
+            connection.sock.settimeout(seconds)
+
+
+def _call_upstream(service: str, user_id: Optional[int], cost: int, lane: str, http, call):
+    """Make one Google call through the service's circuit breaker and quota governor, within the deadline"""
+    operation = f"Google {service} call"
+    deadline.check(operation)
+    breaker = breakers[service]
+    breaker.before_call(user_id)
+    quota.acquire(service, user_id, cost, lane)
+    _set_socket_timeout(http, deadline.bounded(settings.GOOGLE_HTTP_TIMEOUT_SECONDS, operation))
+    started = time.monotonic()
+    try:
+        result = call()
+    except Exception as error:
+        breaker.record(user_id, time.monotonic() - started, error)
+        raise
+    breaker.record(user_id, time.monotonic() - started)
+    return result
+
+
+class _GovernedRequest(HttpRequest):
+    """HttpRequest that goes through the circuit breaker and quota governor, retrying Google rate limits"""
+    
+    governor_context = None  # (service, user_id, lane), set per service instance
+    
+    def execute(self, http=None, num_retries=0):
+        service, user_id, lane = self.governor_context
+        for attempt in range(settings.QUOTA_MAX_RETRIES + 1):
+            try:
+                return _call_upstream(
+                    service, user_id, quota.request_cost(self.methodId), lane, http or self.http,
+                    lambda: HttpRequest.execute(self, http=http, num_retries=num_retries)
+                )
+            except HttpError as error:
+                if not quota.is_rate_limited(error) or attempt == settings.QUOTA_MAX_RETRIES:
+                    raise
+                backoff = quota.penalize(service, user_id, error)
+                if not quota.cache.enabled:
+                    time.sleep(backoff)  # No shared backoff key to wait on
+
+
+class _GovernedBatch:
+    """Batch request that draws quota for all of its parts and retries the rate-limited ones"""
+    
+    def __init__(self, service, governor_context, callback):
+        self._service = service
+        self._governor_context = governor_context
+        self._callback = callback
+        self._requests = []
+    
+    def add(self, request, request_id=None):
+        self._requests.append((request_id or str(len(self._requests)), request))
+    
+    def execute(self):
+        service, user_id, lane = self._governor_context
+        pending = self._requests
+        for attempt in range(settings.QUOTA_MAX_RETRIES + 1):
+            last_attempt = attempt == settings.QUOTA_MAX_RETRIES
+            throttled = []
+            
+            def callback(request_id, response, exception):
+                if exception is not None and not last_attempt and quota.is_rate_limited(exception):
+                    throttled.append((request_id, exception))
+                else:
+                    self._callback(request_id, response, exception)
+            
+            batch = self._service.new_batch_http_request(callback=callback)
+            for request_id, request in pending:
+                batch.add(request, request_id=request_id)
+            cost = sum(quota.request_cost(r.methodId) for _, r in pending)
+            try:
+                _call_upstream(service, user_id, cost, lane, pending[0][1].http, batch.execute)
+            except HttpError as error:
+                if last_attempt or not quota.is_rate_limited(error):
+                    raise
+                throttled = [(request_id, error) for request_id, _ in pending]
+            
+            if not throttled:
+                return
+            backoff = quota.penalize(service, user_id, throttled[0][1])
+            if not quota.cache.enabled:
+                time.sleep(backoff)
+            retry_ids = {request_id for request_id, _ in throttled}
+            pending = [(request_id, request) for request_id, request in pending if request_id in retry_ids]
+
+
+def _build_governed(api: str, version: str, creds, user_id: Optional[int], lane: str):
+    """Build a Google API client whose requests go through the quota governor, with socket timeouts"""
+    context = (api, user_id, lane)
+    request_class = type('GovernedRequest', (_GovernedRequest,), {'governor_context': context})
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=settings.GOOGLE_HTTP_TIMEOUT_SECONDS))
+    return build(api, version, http=http, requestBuilder=request_class), context
+
 class GmailService:
-    def __init__(self, credentials_dict: Dict):
+    def __init__(self, credentials_dict: Dict, user_id: Optional[int] = None, lane: str = quota.INTERACTIVE):
         """Initialize Gmail service with credentials"""
         # Add required fields if missing
         if 'client_id' not in credentials_dict:
@@ -23,14 +133,16 @@ class GmailService:
         # But we can also explicitly refresh if expired (don't raise on error, let API handle it)
         try:
             if creds.expired and creds.refresh_token:
-                from google.auth.transport.requests import Request
-                creds.refresh(Request())
+                creds.refresh(BoundedRequest())
         except Exception as e:
             print(f"Note: Gmail credentials refresh attempted: {e}")
             # Don't raise - let the API call handle the error
             pass
         
-        self.service = build('gmail', 'v1', credentials=creds)
+        self.service, self._governor_context = _build_governed('gmail', 'v1', creds, user_id, lane)
+    
+    def _new_batch(self, callback):
+        return _GovernedBatch(self.service, self._governor_context, callback)
     
     def get_unread_emails(self, max_results: int = 5) -> List[Dict]:
         """Fetch unread emails using batch requests"""
@@ -59,7 +171,7 @@ class GmailService:
                 else:
                     email_details[request_id] = response
 
-            batch = self.service.new_batch_http_request(callback=callback)
+            batch = self._new_batch(callback)
             
             for msg in messages:
                 batch.add(self.service.users().messages().get(
@@ -71,6 +183,8 @@ class GmailService:
             
             try:
                 batch.execute()
+            except (quota.QuotaExhausted, CircuitOpen):
+                raise  # Going serial would only make more calls that can't succeed
             except Exception as e:
                 print(f"Batch execution failed: {e}")
                 # Fallback to serial execution if batch fails
@@ -126,7 +240,7 @@ class GmailService:
                 else:
                     email_details[request_id] = response
 
-            batch = self.service.new_batch_http_request(callback=callback)
+            batch = self._new_batch(callback)
             
             for msg in messages:
                 batch.add(self.service.users().messages().get(
@@ -174,6 +288,8 @@ class GmailService:
                     metadataHeaders=['From', 'Subject', 'Date']
                 ).execute()
                 emails.append(self._parse_email_message(message))
+            except (quota.QuotaExhausted, CircuitOpen):
+                raise
             except Exception as e:
                 print(f"Error processing message {msg['id']}: {e}")
         return emails
@@ -201,8 +317,10 @@ class GmailService:
         try:
             date_obj = parsedate_to_datetime(date_str) if date_str else datetime.now()
             time_ago = self._get_time_ago(date_obj)
+            timestamp = date_obj.isoformat()
         except:
             time_ago = "Unknown"
+            timestamp = None
         
         return {
             'id': message['id'],
@@ -212,7 +330,8 @@ class GmailService:
             'preview': snippet[:100] + '...' if len(snippet) > 100 else snippet,
             'priority': priority,
             'unread': is_unread,
-            'time': time_ago
+            'time': time_ago,
+            'timestamp': timestamp
         }
     
     def _get_time_ago(self, date_obj: datetime) -> str:
@@ -240,38 +359,79 @@ class GmailService:
                 format='full'
             ).execute()
             
-            payload = message.get('payload', {})
-            headers = payload.get('headers', [])
-            
-            # Extract headers
-            from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-            to_email = next((h['value'] for h in headers if h['name'] == 'To'), '')
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            date_str = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-            thread_id = message.get('threadId', '')
-            
-            # Get email body
-            body = self._get_email_body(payload)
-            
-            # Check if read
-            label_ids = message.get('labelIds', [])
-            is_unread = 'UNREAD' in label_ids
-            
-            return {
-                'id': message_id,
-                'thread_id': thread_id,
-                'from': from_email,
-                'to': to_email,
-                'subject': subject,
-                'body': body,
-                'date': date_str,
-                'unread': is_unread,
-                'snippet': message.get('snippet', '')
-            }
+            return self._parse_full_message(message)
         except HttpError as error:
+            if is_upstream_failure(error):
+                raise
             print(f'Error getting email: {error}')
             return None
     
+    def get_emails_by_ids(self, message_ids: List[str]) -> List[Dict]:
+        """Get full email details for several messages using batch requests"""
+        emails = []
+        email_details = {}
+        
+        def callback(request_id, response, exception):
+            if exception:
+                print(f"Error in batch request: {exception}")
+            else:
+                email_details[request_id] = response
+        
+        # Gmail recommends keeping batches at 50 requests or fewer
+        for i in range(0, len(message_ids), 50):
+            batch = self._new_batch(callback)
+            for message_id in message_ids[i:i + 50]:
+                batch.add(self.service.users().messages().get(
+                    userId='me',
+                    id=message_id,
+                    format='full'
+                ), request_id=message_id)
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"Batch execution failed: {e}")
+        
+        for message_id in message_ids:
+            if message_id not in email_details:
+                continue
+            try:
+                emails.append(self._parse_full_message(email_details[message_id]))
+            except Exception as e:
+                print(f"Error parsing message {message_id}: {e}")
+        return emails
+    
+    def _parse_full_message(self, message: Dict) -> Dict:
+        """Helper to parse a message fetched with format='full'"""
+        payload = message.get('payload', {})
+        headers = payload.get('headers', [])
+        
+        # Extract headers
+        from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+        to_email = next((h['value'] for h in headers if h['name'] == 'To'), '')
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        date_str = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+        message_id_header = next((h['value'] for h in headers if h['name'].lower() == 'message-id'), '')
+        
+        # Get email body
+        body = self._get_email_body(payload)
+        
+        # Check if read
+        label_ids = message.get('labelIds', [])
+        is_unread = 'UNREAD' in label_ids
+        
+        return {
+            'id': message['id'],
+            'thread_id': message.get('threadId', ''),
+            'from': from_email,
+            'to': to_email,
+            'subject': subject,
+            'body': body,
+            'date': date_str,
+            'unread': is_unread,
+            'snippet': message.get('snippet', ''),
+            'message_id_header': message_id_header
+        }
+    
     def _get_email_body(self, payload: Dict) -> str:
         """Extract email body from payload"""
         body = ""
@@ -331,21 +491,68 @@ class GmailService:
             print(f'Error deleting email: {error}')
             return False
     
-    def reply_to_email(self, message_id: str, reply_text: str, user_email: str) -> Optional[str]:
-        """Reply to an email"""
+    def batch_modify(self, message_ids: List[str], add_label_ids: List[str] = None, remove_label_ids: List[str] = None) -> None:
+        """Apply one label change to up to 1000 messages (raises HttpError so callers can retry)"""
+        body = {'ids': message_ids}
+        if add_label_ids:
+            body['addLabelIds'] = add_label_ids
+        if remove_label_ids:
+            body['removeLabelIds'] = remove_label_ids
+        self.service.users().messages().batchModify(userId='me', body=body).execute()
+    
+    def batch_delete(self, message_ids: List[str]) -> None:
+        """Permanently delete up to 1000 messages (raises HttpError so callers can retry)"""
+        self.service.users().messages().batchDelete(userId='me', body={'ids': message_ids}).execute()
+    
+    def get_messages_labels(self, message_ids: List[str]) -> Dict[str, Optional[List[str]]]:
+        """Current label IDs per message; None for messages that no longer exist"""
+        labels = {}
+        
+        def callback(request_id, response, exception):
+            if exception:
+                if isinstance(exception, HttpError) and exception.resp.status == 404:
+                    labels[request_id] = None
+                else:
+                    print(f"Error in batch request: {exception}")
+            else:
+                labels[request_id] = response.get('labelIds', [])
+        
+        for i in range(0, len(message_ids), 50):
+            batch = self._new_batch(callback)
+            for message_id in message_ids[i:i + 50]:
+                batch.add(self.service.users().messages().get(
+                    userId='me',
+                    id=message_id,
+                    format='minimal'
+                ), request_id=message_id)
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"Batch execution failed: {e}")
+        return labels
+    
+    def reply_to_email(self, message_id: str, reply_text: str, user_email: str, original: Optional[Dict] = None) -> Optional[str]:
+        """Reply to an email; `original` is the already-decoded message, if the caller has it"""
         try:
-            # Get original message
-            original_message = self.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='metadata',
-                metadataHeaders=['From', 'To', 'Subject', 'Message-ID']
-            ).execute()
-            
-            headers = original_message['payload'].get('headers', [])
-            from_email = next((h['value'] for h in headers if h['name'] == 'From'), '')
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-            message_id_header = next((h['value'] for h in headers if h['name'] == 'Message-ID'), '')
+            if original:
+                from_email = original.get('from', '')
+                subject = original.get('subject', '')
+                message_id_header = original.get('message_id_header', '')
+                thread_id = original.get('thread_id')
+            else:
+                # Get original message
+                original_message = self.service.users().messages().get(
+                    userId='me',
+                    id=message_id,
+                    format='metadata',
+                    metadataHeaders=['From', 'To', 'Subject', 'Message-ID']
+                ).execute()
+                
+                headers = original_message['payload'].get('headers', [])
+                from_email = next((h['value'] for h in headers if h['name'] == 'From'), '')
+                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+                message_id_header = next((h['value'] for h in headers if h['name'] == 'Message-ID'), '')
+                thread_id = original_message.get('threadId')
             
             # Create reply message
             reply_subject = subject.startswith('Re:') and subject or f'Re: {subject}'
@@ -354,8 +561,9 @@ class GmailService:
             message['To'] = from_email
             message['From'] = user_email
             message['Subject'] = reply_subject
-            message['In-Reply-To'] = message_id_header
-            message['References'] = message_id_header
+            if message_id_header:
+                message['In-Reply-To'] = message_id_header
+                message['References'] = message_id_header
             message.set_content(reply_text)
             
             raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
@@ -365,7 +573,7 @@ class GmailService:
                 userId='me',
                 body={
                     'raw': raw_message,
-                    'threadId': original_message.get('threadId')
+                    'threadId': thread_id
                 }
             ).execute()
             
@@ -374,22 +582,17 @@ class GmailService:
             print(f'Error replying to email: {error}')
             return None
     
-    def forward_email(self, message_id: str, to_emails: List[str], forward_text: str, user_email: str) -> Optional[str]:
-        """Forward an email"""
+    def forward_email(self, message_id: str, to_emails: List[str], forward_text: str, user_email: str, original: Optional[Dict] = None) -> Optional[str]:
+        """Forward an email; `original` is the already-decoded message, if the caller has it"""
         try:
-            # Get original message
-            original_message = self.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='full'
-            ).execute()
-            
-            headers = original_message['payload'].get('headers', [])
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-            from_email = next((h['value'] for h in headers if h['name'] == 'From'), '')
+            if not original:
+                original = self.get_email_by_id(message_id)
+                if not original:
+                    return None
             
-            # Get original body
-            body = self._get_email_body(original_message['payload'])
+            subject = original.get('subject', '')
+            from_email = original.get('from', '')
+            body = original.get('body', '')
             
             # Create forward message
             forward_subject = subject.startswith('Fwd:') and subject or f'Fwd: {subject}'
@@ -450,6 +653,52 @@ class GmailService:
             print(f'Error getting thread: {error}')
             return []
     
+    def get_thread_message_ids(self, thread_id: str) -> List[Dict]:
+        """List the messages of a thread without their bodies (format='minimal')"""
+        try:
+            thread = self.service.users().threads().get(
+                userId='me',
+                id=thread_id,
+                format='minimal'
+            ).execute()
+            
+            return [
+                {'id': msg['id'], 'unread': 'UNREAD' in msg.get('labelIds', [])}
+                for msg in thread.get('messages', [])
+            ]
+        except HttpError as error:
+            if is_upstream_failure(error):
+                raise
+            print(f'Error getting thread: {error}')
+            return []
+
+    def get_threads_message_ids(self, thread_ids: List[str]) -> Dict[str, List[Dict]]:
+        """List the messages of several threads using batch requests (format='minimal')"""
+        threads = {}
+
+        def callback(request_id, response, exception):
+            if exception:
+                print(f"Error in batch request: {exception}")
+            else:
+                threads[request_id] = [
+                    {'id': msg['id'], 'unread': 'UNREAD' in msg.get('labelIds', [])}
+                    for msg in response.get('messages', [])
+                ]
+
+        for i in range(0, len(thread_ids), 50):
+            batch = self._new_batch(callback)
+            for thread_id in thread_ids[i:i + 50]:
+                batch.add(self.service.users().threads().get(
+                    userId='me',
+                    id=thread_id,
+                    format='minimal'
+                ), request_id=thread_id)
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"Batch execution failed: {e}")
+        return threads
+
     def get_all_emails(self, query: str = '', max_results: int = 50) -> List[Dict]:
         """Get all emails with optional query filter"""
         try:
@@ -490,11 +739,13 @@ class GmailService:
             
             return emails
         except HttpError as error:
+            if is_upstream_failure(error):
+                raise
             print(f'Error getting emails: {error}')
             return []
 
 class CalendarService:
-    def __init__(self, credentials_dict: Dict):
+    def __init__(self, credentials_dict: Dict, user_id: Optional[int] = None, lane: str = quota.INTERACTIVE):
         """Initialize Calendar service with credentials"""
         # Add required fields if missing
         if 'client_id' not in credentials_dict:
@@ -509,14 +760,13 @@ class CalendarService:
         # But we can also explicitly refresh if expired
         try:
             if creds.expired and creds.refresh_token:
-                from google.auth.transport.requests import Request
-                creds.refresh(Request())
+                creds.refresh(BoundedRequest())
         except Exception as e:
             print(f"Error refreshing Calendar credentials: {e}")
             # Don't raise here - let the API call fail naturally with a better error message
             pass
         
-        self.service = build('calendar', 'v3', credentials=creds)
+        self.service, self._governor_context = _build_governed('calendar', 'v3', creds, user_id, lane)
     
     def get_upcoming_events(self, max_results: int = 3) -> List[Dict]:
         """Fetch upcoming calendar events"""
@@ -580,6 +830,8 @@ class CalendarService:
             
             return self._format_event(event)
         except HttpError as error:
+            if is_upstream_failure(error):
+                raise
             print(f'Error getting event: {error}')
             return None
     
@@ -605,7 +857,7 @@ class CalendarService:
                    for att in event.get('attendees', [])]
         description = event.get('description', '')
         
-        return {
+        formatted = {
             'id': event['id'],
             'title': event.get('summary', 'No Title'),
             'time': time_str,
@@ -618,6 +870,12 @@ class CalendarService:
             'description': description,
             'upcoming': True
         }
+        # Instances of a recurring series are stored locally as overrides of their master
+        if event.get('recurringEventId'):
+            original_start = event.get('originalStartTime', {})
+            formatted['recurring_event_id'] = event['recurringEventId']
+            formatted['original_start_time'] = original_start.get('dateTime', original_start.get('date'))
+        return formatted
     
     def create_event(self, title: str, start_datetime: str, end_datetime: str, 
                      location: str = '', description: str = '', attendees: List[str] = None) -> Optional[Dict]:
@@ -721,6 +979,59 @@ class CalendarService:
             events = events_result.get('items', [])
             return [self._format_event(event) for event in events]
         except HttpError as error:
+            if is_upstream_failure(error):
+                raise
             print(f'Error getting events: {error}')
             return []
 
+
+    def get_events_for_sync(self, time_min: str, time_max: str) -> List[Dict]:
+        """Get every event overlapping a window for the local calendar store.
+        
+        Recurring events come back as their master (with its RRULE) plus any
+        modified or cancelled instances, so the series can be expanded locally.
+        """
+        events = []
+        page_token = None
+        try:
+            while True:
+                events_result = self.service.events().list(
+                    calendarId='primary',
+                    timeMin=time_min,
+                    timeMax=time_max,
+                    singleEvents=False,
+                    showDeleted=True,
+                    maxResults=2500,
+                    pageToken=page_token
+                ).execute()
+                
+                events.extend(self._format_sync_event(event) for event in events_result.get('items', []))
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    return events
+        except HttpError as error:
+            print(f'Error getting events for sync: {error}')
+            raise
+    
+    def _format_sync_event(self, event: Dict) -> Dict:
+        """Format an event with the recurrence fields the local calendar store needs"""
+        start = event.get('start', {})
+        end = event.get('end', {})
+        original_start = event.get('originalStartTime', {})
+        
+        return {
+            'id': event['id'],
+            'status': event.get('status', 'confirmed'),
+            'title': event.get('summary', 'No Title'),
+            'start_datetime': start.get('dateTime', start.get('date')),
+            'end_datetime': end.get('dateTime', end.get('date')),
+            'all_day': 'date' in start and 'dateTime' not in start,
+            'timezone': start.get('timeZone'),
+            'location': event.get('location', 'Not specified'),
+            'attendees': [att.get('email', att.get('displayName', 'Unknown'))
+                          for att in event.get('attendees', [])],
+            'description': event.get('description', ''),
+            'recurrence': event.get('recurrence'),
+            'recurring_event_id': event.get('recurringEventId'),
+            'original_start_time': original_start.get('dateTime', original_start.get('date'))
+        }
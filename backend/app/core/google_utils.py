@@ -3,7 +3,7 @@ from app.core.models import User, ServiceToken
 from app.core.config import settings
 from datetime import datetime, timezone
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from app.core.google_auth import BoundedRequest
 
 def get_google_credentials(user: User, db: Session) -> dict:
     """Get decrypted Google credentials for user, refreshing if expired"""
@@ -59,7 +59,7 @@ def get_google_credentials(user: User, db: Session) -> dict:
                     client_id=settings.GOOGLE_CLIENT_ID,
                     client_secret=settings.GOOGLE_CLIENT_SECRET
                 )
-                credentials.refresh(Request())
+                credentials.refresh(BoundedRequest())
                 # Update stored token
                 service_token.access_token_encrypted = ServiceToken.encrypt_token(credentials.token)
                 if credentials.expiry:
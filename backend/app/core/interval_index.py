@@ -0,0 +1,189 @@
+"""
+Interval Index
+In-memory busy-time index per user for conflict checks, free/busy and slot
+suggestions, built from the local calendar so none of these call Google.
+
+Events are kept in a start-sorted array and also merged into non-overlapping
+busy blocks. Every query is a bisect plus a short scan. Events longer than
+_MAX_SHORT_SECONDS (multi-day blocks) are few and kept in a separate list so
+they don't widen the scan window for everything else.
+
+Each process caches one index per user. The cached index is rebuilt when the
+user's calendar version in Redis changes (bumped by sync and by meeting writes),
+or after INTERVAL_INDEX_TTL_SECONDS when Redis is unavailable.
+"""
+from sqlalchemy.orm import Session
+from app.core.cache import cache
+from app.core.calendar_store import CalendarStore, as_utc, parse_event_time
+from app.core.config import settings
+from app.core.models import User
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from typing import Dict, List, Optional, Tuple
+import threading
+import time
+
+# Events at most this long are found by bisecting on start time; longer ones are scanned linearly
+_MAX_SHORT_SECONDS = 24 * 3600
+
+_indexes: Dict[int, Tuple[Optional[str], float, "IntervalIndex"]] = {}
+_lock = threading.Lock()
+
+
+def _ts(dt: datetime) -> float:
+    return as_utc(dt).timestamp()
+
+
+def _dt(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+class IntervalIndex:
+    """Sorted-array interval index over one user's busy time"""
+
+    def __init__(self, events: List[Dict], horizon_start: datetime, horizon_end: datetime):
+        self.horizon_start = _ts(horizon_start)
+        self.horizon_end = _ts(horizon_end)
+
+        intervals = []
+        for event in events:
+            # All-day events (holidays, OOO markers) are "free" by default in Google Calendar
+            if event.get('all_day'):
+                continue
+            start, end = parse_event_time(event['start_datetime']), parse_event_time(event['end_datetime'])
+            if start is None or end is None or end <= start:
+                continue
+            intervals.append((start.timestamp(), end.timestamp(), event))
+        intervals.sort(key=lambda i: i[0])
+
+        short = [i for i in intervals if i[1] - i[0] <= _MAX_SHORT_SECONDS]
+        self._starts = [i[0] for i in short]
+        self._ends = [i[1] for i in short]
+        self._events = [i[2] for i in short]
+        self._long = [i for i in intervals if i[1] - i[0] > _MAX_SHORT_SECONDS]
+        self._count = len(intervals)
+
+        # Union of all intervals as non-overlapping blocks
+        self._busy_starts, self._busy_ends = [], []
+        for start, end, _ in intervals:
+            if self._busy_ends and start <= self._busy_ends[-1]:
+                self._busy_ends[-1] = max(self._busy_ends[-1], end)
+            else:
+                self._busy_starts.append(start)
+                self._busy_ends.append(end)
+
+    def __len__(self):
+        return self._count
+
+    def covers(self, start: datetime, end: datetime) -> bool:
+        return self.horizon_start <= _ts(start) and _ts(end) <= self.horizon_end
+
+    def overlapping(self, start: datetime, end: datetime) -> List[Dict]:
+        """Events overlapping [start, end), in start order"""
+        query_start, query_end = _ts(start), _ts(end)
+        lo = bisect_left(self._starts, query_start - _MAX_SHORT_SECONDS)
+        hi = bisect_left(self._starts, query_end)
+        found = [(self._starts[i], self._events[i]) for i in range(lo, hi) if self._ends[i] > query_start]
+        found.extend((s, event) for s, e, event in self._long if s < query_end and e > query_start)
+        found.sort(key=lambda f: f[0])
+        return [event for _, event in found]
+
+    def busy(self, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        """Merged busy blocks clipped to [start, end)"""
+        query_start, query_end = _ts(start), _ts(end)
+        i = bisect_right(self._busy_ends, query_start)
+        blocks = []
+        while i < len(self._busy_starts) and self._busy_starts[i] < query_end:
+            blocks.append((_dt(max(self._busy_starts[i], query_start)), _dt(min(self._busy_ends[i], query_end))))
+            i += 1
+        return blocks
+
+    def free_slots(
+        self,
+        start: datetime,
+        end: datetime,
+        duration: timedelta,
+        step: timedelta = timedelta(minutes=15),
+        limit: int = 5,
+        work_start_hour: Optional[int] = None,
+        work_end_hour: Optional[int] = None,
+        tz: str = "UTC"
+    ) -> List[Tuple[datetime, datetime]]:
+        """Up to `limit` open slots of `duration` in [start, end), aligned to `step`"""
+        zone = ZoneInfo(tz)
+        length, step_s = duration.total_seconds(), max(step.total_seconds(), 60)
+        query_start, query_end = _ts(start), _ts(end)
+
+        def within_hours(slot_start: float) -> Optional[float]:
+            """None if the slot fits working hours, else the next time worth trying"""
+            if work_start_hour is None or work_end_hour is None:
+                return None
+            local = _dt(slot_start).astimezone(zone)
+            midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            day_open = midnight + timedelta(hours=work_start_hour)
+            day_close = midnight + timedelta(hours=work_end_hour)
+            if local < day_open:
+                return day_open.timestamp()
+            if local.timestamp() + length > day_close.timestamp():
+                return (day_open + timedelta(days=1)).timestamp()
+            return None
+
+        slots = []
+        candidate = query_start
+        block = bisect_right(self._busy_ends, candidate)
+        while len(slots) < limit and candidate + length <= query_end:
+            # Snap to the step grid
+            candidate = query_start + -(-(candidate - query_start) // step_s) * step_s
+
+            skip_to = within_hours(candidate)
+            if skip_to is not None:
+                candidate = skip_to
+                continue
+
+            # Skip busy blocks that end before the candidate
+            while block < len(self._busy_starts) and self._busy_ends[block] <= candidate:
+                block += 1
+            if block < len(self._busy_starts) and self._busy_starts[block] < candidate + length:
+                candidate = self._busy_ends[block]
+                continue
+
+            if candidate + length <= query_end:
+                slots.append((_dt(candidate), _dt(candidate + length)))
+            candidate += length
+        return slots
+
+
+def _version(user_id: int) -> Optional[str]:
+    return cache.get(f"calendar:version:{user_id}")
+
+
+def bump_calendar_version(user_id: int) -> None:
+    """Mark the user's calendar as changed so every process rebuilds its index"""
+    cache.incr(f"calendar:version:{user_id}")
+    with _lock:
+        _indexes.pop(user_id, None)
+
+
+def get_index(db: Session, user_id: int) -> IntervalIndex:
+    """Return the user's index, rebuilding it when the calendar version has moved"""
+    version = _version(user_id)
+    with _lock:
+        cached = _indexes.get(user_id)
+    if cached:
+        cached_version, built_at, index = cached
+        if cache.enabled and cached_version == version:
+            return index
+        if not cache.enabled and time.monotonic() - built_at < settings.INTERVAL_INDEX_TTL_SECONDS:
+            return index
+
+    user = db.query(User).filter(User.id == user_id).first()
+    now = datetime.now(timezone.utc)
+    horizon_start = as_utc(user.calendar_synced_from) if user and user.calendar_synced_from else now - timedelta(days=settings.CALENDAR_SYNC_PAST_DAYS)
+    horizon_end = as_utc(user.calendar_synced_until) if user and user.calendar_synced_until else now + timedelta(days=settings.CALENDAR_SYNC_FUTURE_DAYS)
+
+    events = CalendarStore(db, user_id).query_range(horizon_start, horizon_end)
+    index = IntervalIndex(events, horizon_start, horizon_end)
+    with _lock:
+        _indexes[user_id] = (version, time.monotonic(), index)
+    return index
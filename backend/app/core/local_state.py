@@ -0,0 +1,252 @@
+"""
+Local State Write-Through
+Applies a successful email/meeting mutation to the local tables right away,
+instead of waiting for the next background sync. It then invalidates only the
+caches that could show the changed item and publishes a granular realtime event.
+"""
+from sqlalchemy.orm import Session
+from app.core.cache import cache
+from app.core import counters, dashboard_patch
+from app.core.calendar_store import CalendarStore, parse_event_time
+from app.core.events import (
+    publish_event, EMAIL_READ, EMAIL_UNREAD, EMAIL_NEW, EMAIL_DELETED,
+    MEETING_CREATED, MEETING_UPDATED, MEETING_DELETED
+)
+from app.core.interval_index import bump_calendar_version
+from app.core.message_store import MessageStore
+from app.core.models import Email, Meeting
+from app.core.prefetch import invalidate_thread_listing
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Meeting fields reported in meeting.updated events
+_MEETING_FIELDS = ('title', 'start_datetime', 'end_datetime', 'location', 'description', 'attendees')
+_TIME_FIELDS = ('start_datetime', 'end_datetime')
+
+
+def _dashboard_key(user_id: int) -> str:
+    return f"dashboard:summary:{user_id}"
+
+
+def invalidate_dashboard(user_id: int) -> None:
+    cache.delete(_dashboard_key(user_id), dashboard_patch.shapes_key(user_id))
+
+
+def invalidate_dashboard_shapes(user_id: int) -> None:
+    """Drop cached partial responses, which can be cached without a summary to check against"""
+    cache.delete(dashboard_patch.shapes_key(user_id))
+
+
+def dashboard_shows(user_id: int, section: str, item_id: str) -> bool:
+    """True if the cached dashboard lists `item_id` (or an instance of it) in `section`"""
+    cached = cache.get(_dashboard_key(user_id))
+    if not cached:
+        return False
+    try:
+        items = json.loads(cached).get(section) or []
+    except Exception:
+        return True  # Can't tell, so assume it does
+    return any(
+        str(item.get('id')) == item_id or str(item.get('id', '')).startswith(f"{item_id}_")
+        for item in items
+    )
+
+
+# --- Emails ---------------------------------------------------------------
+
+def email_read_changed(db: Session, user_id: int, message_id: str, read: bool) -> None:
+    """Record a read/unread change made in Gmail"""
+    try:
+        counters.emails_changing(db, user_id, [message_id], read)
+        db.query(Email).filter(Email.user_id == user_id, Email.id == message_id).update(
+            {Email.is_read: read}, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to update read state of {message_id}: {e}")
+
+    if dashboard_shows(user_id, 'emails', message_id):
+        invalidate_dashboard(user_id)
+    else:
+        invalidate_dashboard_shapes(user_id)
+    publish_event(user_id, EMAIL_READ if read else EMAIL_UNREAD, {"id": message_id, "unread": not read})
+
+
+def email_deleted(db: Session, user_id: int, message_id: str) -> None:
+    """Record an email deleted in Gmail"""
+    thread_id = None
+    try:
+        email = db.query(Email).filter(Email.user_id == user_id, Email.id == message_id).first()
+        if email:
+            thread_id = email.thread_id
+            db.delete(email)
+            db.commit()
+        MessageStore(db, user_id).delete(message_id)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to remove {message_id} locally: {e}")
+
+    if thread_id:
+        invalidate_thread_listing(user_id, thread_id)
+    if dashboard_shows(user_id, 'emails', message_id):
+        invalidate_dashboard(user_id)
+    else:
+        invalidate_dashboard_shapes(user_id)
+    publish_event(user_id, EMAIL_DELETED, {"id": message_id, "thread_id": thread_id})
+
+
+def email_restored(user_id: int, message_id: str) -> None:
+    """An email removed locally still exists in Gmail (e.g. its delete failed); the next sync brings it back"""
+    invalidate_dashboard(user_id)
+    publish_event(user_id, EMAIL_NEW, {"id": message_id})
+
+
+def emails_read_changed(db: Session, user_id: int, message_ids: List[str], read: bool) -> None:
+    """Bulk version of email_read_changed: one update, one cache check, one event"""
+    try:
+        for i in range(0, len(message_ids), 500):
+            counters.emails_changing(db, user_id, message_ids[i:i + 500], read)
+            db.query(Email).filter(Email.user_id == user_id, Email.id.in_(message_ids[i:i + 500])).update(
+                {Email.is_read: read}, synchronize_session=False
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to update read state of {len(message_ids)} emails: {e}")
+
+    if any(dashboard_shows(user_id, 'emails', message_id) for message_id in message_ids[:50]) or len(message_ids) > 50:
+        invalidate_dashboard(user_id)
+    else:
+        invalidate_dashboard_shapes(user_id)
+    publish_event(user_id, EMAIL_READ if read else EMAIL_UNREAD, {"ids": message_ids, "unread": not read})
+
+
+def emails_removed(db: Session, user_id: int, message_ids: List[str], keep_bodies: bool = False) -> None:
+    """Bulk removal from the local inbox (delete, trash or archive).
+
+    Archived mail is still in Gmail and can still be opened, so `keep_bodies`
+    leaves its stored bodies in place.
+    """
+    thread_ids = set()
+    try:
+        for i in range(0, len(message_ids), 500):
+            chunk = message_ids[i:i + 500]
+            thread_ids.update(row[0] for row in db.query(Email.thread_id).filter(
+                Email.user_id == user_id, Email.id.in_(chunk)
+            ).all() if row[0])
+            counters.emails_changing(db, user_id, chunk, None)
+            db.query(Email).filter(Email.user_id == user_id, Email.id.in_(chunk)).delete(synchronize_session=False)
+        db.commit()
+        if not keep_bodies:
+            MessageStore(db, user_id).delete_many(message_ids)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to remove {len(message_ids)} emails locally: {e}")
+
+    for thread_id in thread_ids:
+        invalidate_thread_listing(user_id, thread_id)
+    invalidate_dashboard(user_id)
+    publish_event(user_id, EMAIL_DELETED, {"ids": message_ids})
+
+
+# --- Meetings -------------------------------------------------------------
+
+def _changed_fields(previous: Optional[Dict], event: Dict) -> Dict:
+    """Fields of `event` that differ from the stored version (all of them if there was none)"""
+    changed = {}
+    for field in _MEETING_FIELDS:
+        value = event.get(field)
+        if previous is not None:
+            old = previous.get(field)
+            same = parse_event_time(old) == parse_event_time(value) if field in _TIME_FIELDS else old == value
+            if same:
+                continue
+        changed[field] = value
+    return changed
+
+
+def _is_upcoming(event: Dict) -> bool:
+    end = parse_event_time(event.get('end_datetime'))
+    return end is None or end >= datetime.now(timezone.utc)
+
+
+def _instance_fields(db: Session, user_id: int, event: Dict) -> Dict:
+    """Series fields for an instance ("<master>_<start>") of a stored recurring event, or {}"""
+    if event.get('recurring_event_id') and event.get('original_start_time'):
+        return {'recurring_event_id': event['recurring_event_id'], 'original_start_time': event['original_start_time']}
+    master_id, _, suffix = event['id'].rpartition('_')
+    original_start = parse_event_time(suffix)
+    if not master_id or original_start is None:
+        return {}
+    master = db.query(Meeting.id).filter(
+        Meeting.user_id == user_id,
+        Meeting.id == master_id,
+        Meeting.recurrence.isnot(None)
+    ).first()
+    if not master:
+        return {}
+    return {'recurring_event_id': master_id, 'original_start_time': original_start.isoformat()}
+
+
+def meeting_saved(db: Session, user_id: int, event: Dict, created: bool = False) -> Dict:
+    """Record a meeting created/updated in Google Calendar; returns the fields that changed"""
+    store = CalendarStore(db, user_id)
+    previous = None
+    try:
+        row = db.query(Meeting).filter(Meeting.user_id == user_id, Meeting.id == event['id']).first()
+        previous = store.format_meeting(row) if row else None
+        if '_' not in event['id']:
+            store.upsert_event(event)
+        else:
+            # An instance of a recurring series is stored as an override of its master
+            instance = _instance_fields(db, user_id, event)
+            if instance:
+                store.upsert_event({**event, **instance})
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to store meeting {event.get('id')} locally: {e}")
+    bump_calendar_version(user_id)
+
+    changed = _changed_fields(previous, event)
+    # Only the upcoming list on the dashboard can be affected
+    if dashboard_shows(user_id, 'meetings', event['id']) or _is_upcoming(event):
+        invalidate_dashboard(user_id)
+    else:
+        invalidate_dashboard_shapes(user_id)
+    publish_event(
+        user_id,
+        MEETING_CREATED if created else MEETING_UPDATED,
+        {"id": event['id'], "changes": changed}
+    )
+    return changed
+
+
+def meeting_deleted(db: Session, user_id: int, event_id: str) -> None:
+    """Record a meeting deleted in Google Calendar"""
+    try:
+        instance = _instance_fields(db, user_id, {'id': event_id})
+        if instance:
+            # Cancelled overrides stop the series expanding the deleted occurrence
+            CalendarStore(db, user_id).upsert_event({
+                'id': event_id,
+                'status': 'cancelled',
+                'start_datetime': instance['original_start_time'],
+                **instance
+            })
+        else:
+            CalendarStore(db, user_id).delete_event(event_id)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to remove meeting {event_id} locally: {e}")
+    bump_calendar_version(user_id)
+
+    if dashboard_shows(user_id, 'meetings', event_id):
+        invalidate_dashboard(user_id)
+    else:
+        invalidate_dashboard_shapes(user_id)
+    publish_event(user_id, MEETING_DELETED, {"id": event_id})
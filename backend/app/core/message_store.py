@@ -0,0 +1,190 @@
+"""
+Message Body Store
+Local, compressed copy of decoded Gmail message bodies.
+
+Gmail messages are immutable once received, so a stored body never goes
+stale. Only the UNREAD label changes over time; that flag is taken from the
+local `emails` row when one exists.
+"""
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.core.models import MessageBody, Email
+from app.core.config import settings
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import json
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+def _compress(message: Dict) -> bytes:
+    return zlib.compress(json.dumps(message, default=str).encode('utf-8'), 6)
+
+
+def _decompress(data: bytes) -> Dict:
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class MessageStore:
+    """Per-user LRU store of decoded message bodies backed by `message_bodies`"""
+
+    def __init__(self, db: Session, user_id: int, budget_bytes: int = None):
+        self.db = db
+        self.user_id = user_id
+        self.budget_bytes = budget_bytes or settings.MESSAGE_STORE_USER_BUDGET_BYTES
+
+    def get(self, message_id: str) -> Optional[Dict]:
+        """Return the stored message, or None on a miss"""
+        return self.get_many([message_id]).get(message_id)
+
+    def get_many(self, message_ids: List[str]) -> Dict[str, Dict]:
+        """Return stored messages keyed by message ID, touching their LRU position (at most every few minutes)"""
+        if not message_ids:
+            return {}
+        try:
+            rows = self.db.query(MessageBody).filter(
+                MessageBody.user_id == self.user_id,
+                MessageBody.message_id.in_(message_ids)
+            ).all()
+            if not rows:
+                return {}
+
+            # Label state comes from the synced emails table when we have it
+            read_state = dict(self.db.query(Email.id, Email.is_read).filter(
+                Email.user_id == self.user_id,
+                Email.id.in_([row.message_id for row in rows])
+            ).all())
+
+            touch_before = datetime.now(timezone.utc) - timedelta(minutes=settings.MESSAGE_STORE_TOUCH_MINUTES)
+            messages = {}
+            stale = []
+            for row in rows:
+                message = _decompress(row.data)
+                if read_state.get(row.message_id) is not None:
+                    message['unread'] = not read_state[row.message_id]
+                messages[row.message_id] = message
+                accessed = row.last_accessed_at
+                if accessed is not None and accessed.tzinfo is None:
+                    accessed = accessed.replace(tzinfo=timezone.utc)
+                if accessed is None or accessed < touch_before:
+                    stale.append(row.id)
+            self._touch(stale)
+            return messages
+        except Exception as e:
+            logger.warning(f"Message store read failed for user {self.user_id}: {e}")
+            return {}
+
+    def _touch(self, row_ids: List[int]) -> None:
+        """Move rows up the LRU in one UPDATE, in a session of its own so a read never commits the caller's"""
+        if not row_ids:
+            return
+        session = SessionLocal()
+        try:
+            session.query(MessageBody).filter(MessageBody.id.in_(row_ids)).update(
+                {MessageBody.last_accessed_at: datetime.now(timezone.utc)}, synchronize_session=False
+            )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"Message store LRU update failed for user {self.user_id}: {e}")
+        finally:
+            session.close()
+
+    def missing(self, message_ids: List[str]) -> List[str]:
+        """Return the subset of message IDs that are not stored yet"""
+        if not message_ids:
+            return []
+        stored = {row[0] for row in self.db.query(MessageBody.message_id).filter(
+            MessageBody.user_id == self.user_id,
+            MessageBody.message_id.in_(message_ids)
+        ).all()}
+        return [message_id for message_id in message_ids if message_id not in stored]
+
+    def put(self, message: Dict) -> None:
+        """Store a decoded message (as returned by GmailService.get_email_by_id)"""
+        self.put_many([message])
+
+    def put_many(self, messages: List[Dict]) -> None:
+        """Store several decoded messages, then enforce the per-user budget"""
+        messages = [m for m in messages if m and m.get('id')]
+        if not messages:
+            return
+        try:
+            existing = {row.message_id for row in self.db.query(MessageBody.message_id).filter(
+                MessageBody.user_id == self.user_id,
+                MessageBody.message_id.in_([m['id'] for m in messages])
+            ).all()}
+
+            for message in messages:
+                if message['id'] in existing:
+                    continue
+                data = _compress(message)
+                self.db.add(MessageBody(
+                    user_id=self.user_id,
+                    message_id=message['id'],
+                    thread_id=message.get('thread_id'),
+                    data=data,
+                    size_bytes=len(data),
+                    last_accessed_at=datetime.now(timezone.utc)
+                ))
+                existing.add(message['id'])
+            self.db.commit()
+            self._enforce_budget()
+        except Exception as e:
+            logger.warning(f"Message store write failed for user {self.user_id}: {e}")
+            self.db.rollback()
+
+    def delete(self, message_id: str) -> None:
+        """Drop a message from the store (e.g. after it is deleted in Gmail)"""
+        self.delete_many([message_id])
+
+    def delete_many(self, message_ids: List[str]) -> None:
+        for i in range(0, len(message_ids), 500):
+            self.db.query(MessageBody).filter(
+                MessageBody.user_id == self.user_id,
+                MessageBody.message_id.in_(message_ids[i:i + 500])
+            ).delete(synchronize_session=False)
+        self.db.commit()
+
+    def _enforce_budget(self) -> None:
+        """Evict least recently used bodies until the user is within budget"""
+        total = self.db.query(func.coalesce(func.sum(MessageBody.size_bytes), 0)).filter(
+            MessageBody.user_id == self.user_id
+        ).scalar()
+        if total <= self.budget_bytes:
+            return
+
+        evict_ids = []
+        rows = self.db.query(MessageBody.id, MessageBody.size_bytes).filter(
+            MessageBody.user_id == self.user_id
+        ).order_by(MessageBody.last_accessed_at.asc()).all()
+        for row_id, size_bytes in rows:
+            if total <= self.budget_bytes:
+                break
+            evict_ids.append(row_id)
+            total -= size_bytes
+
+        if evict_ids:
+            self.db.query(MessageBody).filter(MessageBody.id.in_(evict_ids)).delete(synchronize_session=False)
+            self.db.commit()
+            logger.info(f"Evicted {len(evict_ids)} message bodies for user {self.user_id}")
+
+    def warm(self, gmail_service, limit: int = None) -> int:
+        """Fetch and store bodies for recent and high-priority mail; returns how many were added"""
+        limit = limit or settings.MESSAGE_STORE_WARM_LIMIT
+        recent_cutoff = datetime.now(timezone.utc) - timedelta(days=settings.MESSAGE_STORE_WARM_DAYS)
+
+        candidates = self.db.query(Email.id).filter(
+            Email.user_id == self.user_id,
+            (Email.priority == 'high') | (Email.received_at >= recent_cutoff)
+        ).order_by(Email.received_at.desc()).limit(limit).all()
+
+        missing_ids = self.missing([row[0] for row in candidates])
+        if not missing_ids:
+            return 0
+
+        messages = gmail_service.get_emails_by_ids(missing_ids)
+        self.put_many(messages)
+        return len(messages)
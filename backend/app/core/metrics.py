@@ -0,0 +1,34 @@
+"""
+Lightweight counters for cache hit rates and background work.
+Counters live in a Redis hash so every worker and Celery process adds to the
+same totals; without Redis they are kept per process.
+"""
+from app.core.cache import cache
+from collections import Counter
+from typing import Dict
+
+METRICS_KEY = "metrics:counters"
+
+# Per-process fallback when Redis is unavailable
+_local_counters = Counter()
+
+
+def record(name: str, amount: int = 1) -> None:
+    """Add `amount` to the named counter"""
+    if cache.hincrby(METRICS_KEY, name, amount) is None:
+        _local_counters[name] += amount
+
+
+def snapshot() -> Dict[str, int]:
+    """Return all counters, plus a hit rate for every `<name>.hit`/`<name>.miss` pair"""
+    counters = {name: int(value) for name, value in cache.hgetall(METRICS_KEY).items()}
+    for name, value in _local_counters.items():
+        counters[name] = counters.get(name, 0) + value
+
+    for name in list(counters):
+        if name.endswith('.hit'):
+            prefix = name[:-len('.hit')]
+            total = counters[name] + counters.get(f"{prefix}.miss", 0)
+            if total:
+                counters[f"{prefix}.hit_rate"] = round(counters[name] / total, 4)
+    return counters
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, JSON, Index
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, JSON, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -28,6 +28,8 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     last_synced_at = Column(DateTime(timezone=True), nullable=True) # For Sync Circuit Breaker
+    calendar_synced_from = Column(DateTime(timezone=True), nullable=True) # Local calendar horizon
+    calendar_synced_until = Column(DateTime(timezone=True), nullable=True)
     
     # Relationships
     service_tokens = relationship("ServiceToken", back_populates="user", cascade="all, delete-orphan")
@@ -37,6 +39,9 @@ class User(Base):
     push_subscriptions = relationship("PushSubscription", cascade="all, delete-orphan")
     emails = relationship("Email", back_populates="user", cascade="all, delete-orphan")
     meetings = relationship("Meeting", back_populates="user", cascade="all, delete-orphan")
+    message_bodies = relationship("MessageBody", back_populates="user", cascade="all, delete-orphan")
+    pending_mutations = relationship("PendingMutation", back_populates="user", cascade="all, delete-orphan")
+    counters = relationship("UserCounters", back_populates="user", cascade="all, delete-orphan", uselist=False)
 
 class ServiceToken(Base):
     __tablename__ = "service_tokens"
@@ -94,6 +99,8 @@ class Notification(Base):
     message = Column(String, nullable=False)
     read = Column(Boolean, default=False)
     related_id = Column(Integer, nullable=True)  # ID of related email/meeting/etc.
+    count = Column(Integer, nullable=True)  # Items folded into a digest row
+    details = Column(JSON, nullable=True)  # Digest state, e.g. {"email_ids": [...], "senders": [...]}
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationship
@@ -156,6 +163,12 @@ class Meeting(Base):
     location = Column(String, nullable=True)
     attendees = Column(JSON, nullable=True)
     description = Column(Text, nullable=True)
+    all_day = Column(Boolean, default=False)
+    timezone = Column(String, nullable=True)  # IANA zone recurring events are expanded in
+    recurrence = Column(JSON(none_as_null=True), nullable=True)  # RRULE/EXDATE/RDATE lines of a recurring master
+    recurring_event_id = Column(String, nullable=True, index=True)  # Set on modified/cancelled instances
+    original_start_time = Column(DateTime(timezone=True), nullable=True)
+    status = Column(String, default="confirmed")  # confirmed, tentative, cancelled
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     __table_args__ = (
@@ -165,3 +178,61 @@ class Meeting(Base):
     # Relationship
     user = relationship("User", back_populates="meetings")
 
+
+class MessageBody(Base):
+    __tablename__ = "message_bodies"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    message_id = Column(String, nullable=False)
+    thread_id = Column(String, index=True)
+    data = Column(LargeBinary, nullable=False)  # zlib-compressed JSON of the decoded message
+    size_bytes = Column(Integer, nullable=False)
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index('idx_message_body_user_message', 'user_id', 'message_id', unique=True),
+        Index('idx_message_body_user_access', 'user_id', 'last_accessed_at'),
+    )
+
+    # Relationship
+    user = relationship("User", back_populates="message_bodies")
+
+class PendingMutation(Base):
+    __tablename__ = "pending_mutations"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    message_id = Column(String, nullable=False)
+    action = Column(String, nullable=False)  # modify, delete
+    add_label_ids = Column(JSON, nullable=True)
+    remove_label_ids = Column(JSON, nullable=True)
+    status = Column(String, default="pending")  # pending, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index('idx_pending_mutation_user_message', 'user_id', 'message_id'),
+        Index('idx_pending_mutation_due', 'status', 'next_attempt_at'),
+    )
+
+    # Relationship
+    user = relationship("User", back_populates="pending_mutations")
+
+class UserCounters(Base):
+    __tablename__ = "user_counters"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    todos_total = Column(Integer, nullable=False, default=0)
+    todos_completed = Column(Integer, nullable=False, default=0)
+    notifications_total = Column(Integer, nullable=False, default=0)
+    notifications_unread = Column(Integer, nullable=False, default=0)
+    emails_unread = Column(Integer, nullable=False, default=0)
+    emails_high_unread = Column(Integer, nullable=False, default=0)
+    reconciled_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationship
+    user = relationship("User", back_populates="counters")
@@ -0,0 +1,279 @@
+"""
+Gmail Mutation Queue
+Write-behind queue for label changes (read/unread, ...) and deletes.
+
+Endpoints update local state, append a row to `pending_mutations` and return.
+A background drain then folds each message's queued rows into one net change,
+groups messages with the same change, and sends them to Gmail as
+batchModify/batchDelete calls of up to 1000 IDs. Transient failures are retried
+with exponential backoff. A permanent failure splits the call in halves until
+the IDs at fault are found. Mutations that keep failing are marked `failed`, and
+the local state for those messages is reconciled against Gmail.
+"""
+from sqlalchemy.orm import Session
+from googleapiclient.errors import HttpError
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.models import PendingMutation, Email
+from app.core.quota import QuotaExhausted
+from app.core.circuit_breaker import CircuitOpen
+from app.core import metrics, local_state
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+# Gmail's limit for batchModify/batchDelete
+BATCH_LIMIT = 1000
+
+MODIFY = "modify"
+DELETE = "delete"
+
+
+def _is_transient(error: Exception) -> bool:
+    """Rate limits, server errors and network problems are worth retrying; other 4xx are not"""
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    return True
+
+
+def _backoff(attempts: int) -> timedelta:
+    delay = min(settings.MUTATION_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), settings.MUTATION_BACKOFF_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+class MutationQueue:
+    """Pending Gmail mutations for one user"""
+
+    def __init__(self, db: Session, user_id: int):
+        self.db = db
+        self.user_id = user_id
+
+    # --- Enqueue ---------------------------------------------------------
+
+    def enqueue_modify(self, message_ids: Iterable[str], add_label_ids: List[str] = None, remove_label_ids: List[str] = None) -> int:
+        rows = [
+            PendingMutation(
+                user_id=self.user_id, message_id=message_id, action=MODIFY,
+                add_label_ids=list(add_label_ids or []), remove_label_ids=list(remove_label_ids or [])
+            )
+            for message_id in message_ids
+        ]
+        return self._enqueue(rows)
+
+    def enqueue_delete(self, message_ids: Iterable[str]) -> int:
+        rows = [PendingMutation(user_id=self.user_id, message_id=message_id, action=DELETE) for message_id in message_ids]
+        return self._enqueue(rows)
+
+    def _enqueue(self, rows: List[PendingMutation]) -> int:
+        if not rows:
+            return 0
+        self.db.add_all(rows)
+        self.db.commit()
+        metrics.record('mutations.queued', len(rows))
+        schedule_drain(self.user_id)
+        return len(rows)
+
+    def pending_message_ids(self) -> Set[str]:
+        """Messages whose local state is ahead of Gmail (sync must not overwrite them)"""
+        return {row[0] for row in self.db.query(PendingMutation.message_id).filter(
+            PendingMutation.user_id == self.user_id,
+            PendingMutation.status == "pending"
+        ).all()}
+
+    def outcomes(self, message_ids: List[str]) -> Dict[str, Tuple[str, Optional[str]]]:
+        """(status, last error) for each message: done if nothing is left in the queue"""
+        results = {message_id: ("done", None) for message_id in message_ids}
+        for i in range(0, len(message_ids), 500):
+            for row in self.db.query(PendingMutation).filter(
+                PendingMutation.user_id == self.user_id,
+                PendingMutation.message_id.in_(message_ids[i:i + 500])
+            ).all():
+                if row.status == "failed":
+                    status = "failed"
+                else:
+                    status = "retrying" if row.attempts else "queued"
+                if results[row.message_id][0] != "failed":
+                    results[row.message_id] = (status, row.last_error)
+        return results
+
+    # --- Drain -----------------------------------------------------------
+
+    def drain(self, gmail_service, limit: int = 5000) -> Dict[str, int]:
+        """Send due mutations to Gmail; returns counts of sent, retried and failed rows"""
+        lock_key = f"mutations:draining:{self.user_id}"
+        if cache.enabled and not cache.set(lock_key, "1", ex=120, nx=True):
+            return {"sent": 0, "calls": 0, "retried": 0, "failed": 0, "busy": 1}
+        try:
+            return self._drain(gmail_service, limit)
+        finally:
+            cache.delete(lock_key)
+
+    def _drain(self, gmail_service, limit: int) -> Dict[str, int]:
+        now = datetime.now(timezone.utc)
+        due = self.db.query(PendingMutation.message_id).filter(
+            PendingMutation.user_id == self.user_id,
+            PendingMutation.status == "pending",
+            PendingMutation.next_attempt_at <= now
+        )
+        # Take every queued row of a due message, so an older row waiting on backoff is never applied after a newer one
+        rows = self.db.query(PendingMutation).filter(
+            PendingMutation.user_id == self.user_id,
+            PendingMutation.status == "pending",
+            PendingMutation.message_id.in_(due.scalar_subquery())
+        ).order_by(PendingMutation.id).limit(limit).all()
+        stats = {"sent": 0, "calls": 0, "retried": 0, "failed": 0}
+        if not rows:
+            return stats
+
+        # Fold each message's rows (oldest first) into one net change
+        net: Dict[str, Dict] = {}
+        for row in rows:
+            change = net.setdefault(row.message_id, {"delete": False, "add": set(), "remove": set(), "rows": []})
+            change["rows"].append(row)
+            if row.action == DELETE:
+                change["delete"] = True
+            elif not change["delete"]:
+                add, remove = set(row.add_label_ids or []), set(row.remove_label_ids or [])
+                change["add"] = (change["add"] - remove) | add
+                change["remove"] = (change["remove"] - add) | remove
+
+        # Group messages that need the same call
+        groups: Dict[Tuple, List[str]] = {}
+        done: List[PendingMutation] = []
+        for message_id, change in net.items():
+            if change["delete"]:
+                key = (DELETE,)
+            elif change["add"] or change["remove"]:
+                key = (MODIFY, tuple(sorted(change["add"])), tuple(sorted(change["remove"])))
+            else:
+                done.extend(change["rows"])  # No label changes left to send
+                continue
+            groups.setdefault(key, []).append(message_id)
+
+        retry: List[Tuple[PendingMutation, str]] = []
+        deferred: List[Tuple[PendingMutation, str, float]] = []
+        failed: List[Tuple[PendingMutation, str]] = []
+
+        def send(key: Tuple, chunk: List[str]) -> None:
+            chunk_rows = [row for message_id in chunk for row in net[message_id]["rows"]]
+            try:
+                if key[0] == DELETE:
+                    gmail_service.batch_delete(chunk)
+                else:
+                    gmail_service.batch_modify(chunk, list(key[1]), list(key[2]))
+                stats["calls"] += 1
+                done.extend(chunk_rows)
+            except (QuotaExhausted, CircuitOpen) as e:
+                # The call was never made, so it doesn't count as an attempt
+                deferred.extend((row, str(e), e.retry_after) for row in chunk_rows)
+            except Exception as e:
+                if _is_transient(e):
+                    retry.extend((row, str(e)) for row in chunk_rows)
+                elif len(chunk) == 1:
+                    failed.extend((row, str(e)) for row in chunk_rows)
+                else:
+                    # One bad ID (e.g. a message deleted in Gmail) fails the whole call;
+                    # split the chunk so only the IDs that really fail are marked failed
+                    middle = len(chunk) // 2
+                    send(key, chunk[:middle])
+                    send(key, chunk[middle:])
+
+        for key, message_ids in groups.items():
+            for i in range(0, len(message_ids), BATCH_LIMIT):
+                send(key, message_ids[i:i + BATCH_LIMIT])
+
+        for row in done:
+            self.db.delete(row)
+        for row, error in retry:
+            row.attempts = (row.attempts or 0) + 1
+            row.last_error = error[:1000]
+            if row.attempts >= settings.MUTATION_MAX_ATTEMPTS:
+                row.status = "failed"
+                stats["failed"] += 1
+            else:
+                row.next_attempt_at = now + _backoff(row.attempts)
+                stats["retried"] += 1
+        for row, error, retry_after in deferred:
+            row.last_error = error[:1000]
+            row.next_attempt_at = now + timedelta(seconds=retry_after)
+            stats["retried"] += 1
+        for row, error in failed:
+            row.attempts = (row.attempts or 0) + 1
+            row.last_error = error[:1000]
+            row.status = "failed"
+            stats["failed"] += 1
+        self.db.commit()
+
+        stats["sent"] = len(done)
+        metrics.record('mutations.sent', stats["sent"])
+        metrics.record('mutations.batch_calls', stats["calls"])
+        metrics.record('mutations.retried', stats["retried"])
+        metrics.record('mutations.failed', stats["failed"])
+        return stats
+
+    def next_due(self) -> Optional[datetime]:
+        row = self.db.query(PendingMutation.next_attempt_at).filter(
+            PendingMutation.user_id == self.user_id,
+            PendingMutation.status == "pending"
+        ).order_by(PendingMutation.next_attempt_at).first()
+        return row[0] if row else None
+
+    # --- Reconcile -------------------------------------------------------
+
+    def reconcile(self, gmail_service) -> int:
+        """Bring local state back in line with Gmail for mutations that permanently failed"""
+        failed = self.db.query(PendingMutation).filter(
+            PendingMutation.user_id == self.user_id,
+            PendingMutation.status == "failed"
+        ).all()
+        if not failed:
+            return 0
+
+        # Newer queued changes for the same message still express what the user wants
+        pending = self.pending_message_ids()
+        message_ids = sorted({row.message_id for row in failed} - pending)
+        labels = gmail_service.get_messages_labels(message_ids) if message_ids else {}
+
+        for message_id in message_ids:
+            if message_id not in labels:
+                continue  # Couldn't check; leave local state alone until the next sync
+            if labels[message_id] is None:
+                local_state.email_deleted(self.db, self.user_id, message_id)
+                continue
+            exists = self.db.query(Email.id).filter(Email.user_id == self.user_id, Email.id == message_id).first()
+            if exists:
+                local_state.email_read_changed(self.db, self.user_id, message_id, 'UNREAD' not in labels[message_id])
+            else:
+                # A delete that didn't happen; the next sync brings the message back
+                local_state.email_restored(self.user_id, message_id)
+
+        for row in failed:
+            logger.warning(f"Gmail {row.action} of {row.message_id} failed after {row.attempts} attempts: {row.last_error}")
+            self.db.delete(row)
+        self.db.commit()
+        metrics.record('mutations.reconciled', len(failed))
+        return len(failed)
+
+
+def schedule_drain(user_id: int, delay: int = None) -> None:
+    """Queue a drain for the user, debounced so a burst of actions goes out as one batch"""
+    delay = settings.MUTATION_DRAIN_DELAY_SECONDS if delay is None else delay
+    if cache.enabled and not cache.set(f"mutations:scheduled:{user_id}", "1", ex=delay + 30, nx=True):
+        return  # A drain is already on its way and will pick these rows up
+    try:
+        from app.core.background_tasks import drain_mutations
+        drain_mutations.apply_async((user_id,), countdown=delay)
+    except Exception as e:
+        cache.delete(f"mutations:scheduled:{user_id}")
+        logger.warning(f"Mutation drain trigger failed for user {user_id}: {e}")
+
+
+def users_with_due_mutations(db: Session) -> List[int]:
+    now = datetime.now(timezone.utc)
+    return [row[0] for row in db.query(PendingMutation.user_id).filter(
+        PendingMutation.status == "pending",
+        PendingMutation.next_attempt_at <= now
+    ).distinct().all()]
@@ -0,0 +1,138 @@
+"""
+Dashboard Prefetch
+Fetches bodies and thread listings for the emails currently on a user's
+dashboard, so opening one of them is a local read.
+
+Bodies go into the MessageStore. Thread listings (which message IDs belong to
+a thread) can change when replies arrive, so they are cached in Redis with a
+short TTL and dropped by sync when a new message lands in the thread.
+"""
+from sqlalchemy.orm import Session
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.message_store import MessageStore
+from app.core.models import Email
+from app.core import metrics
+from typing import Dict, List, Optional
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _thread_listing_key(user_id: int, thread_id: str) -> str:
+    return f"thread:listing:{user_id}:{thread_id}"
+
+
+def get_thread_listing(user_id: int, thread_id: str) -> Optional[List[str]]:
+    """Return the cached message IDs of a thread, or None on a miss"""
+    cached = cache.get(_thread_listing_key(user_id, thread_id))
+    if not cached:
+        return None
+    try:
+        return json.loads(cached)
+    except Exception:
+        return None
+
+
+def set_thread_listing(user_id: int, thread_id: str, message_ids: List[str]) -> None:
+    cache.set(_thread_listing_key(user_id, thread_id), json.dumps(message_ids), ex=settings.PREFETCH_THREAD_TTL_SECONDS)
+
+
+def invalidate_thread_listing(user_id: int, thread_id: str) -> None:
+    cache.delete(_thread_listing_key(user_id, thread_id))
+
+
+def _consume_budget(user_id: int, requested: int) -> int:
+    """Take up to `requested` fetches from the per-user and global per-minute budgets"""
+    if requested <= 0:
+        return 0
+    if not cache.enabled:
+        # No shared accounting without Redis; keep each run within the per-user budget
+        return min(requested, settings.PREFETCH_USER_BUDGET_PER_MINUTE)
+
+    window = int(time.time() // 60)
+    user_key = f"prefetch:budget:user:{user_id}:{window}"
+    global_key = f"prefetch:budget:global:{window}"
+    user_used = cache.incr(user_key, requested, ex=120)
+    global_used = cache.incr(global_key, requested, ex=120)
+    if user_used is None or global_used is None:
+        return 0
+
+    allowed = min(
+        requested,
+        max(0, settings.PREFETCH_USER_BUDGET_PER_MINUTE - (user_used - requested)),
+        max(0, settings.PREFETCH_GLOBAL_BUDGET_PER_MINUTE - (global_used - requested))
+    )
+    # Give back what we could not use so other users/runs can have it
+    if allowed < requested:
+        cache.incr(user_key, allowed - requested)
+        cache.incr(global_key, allowed - requested)
+        metrics.record('prefetch.throttled', requested - allowed)
+    return allowed
+
+
+def dashboard_email_ids(db: Session, user_id: int) -> List[str]:
+    """IDs of the emails shown on the dashboard (same ordering as get_contextual_data)"""
+    rows = db.query(Email.id).filter(Email.user_id == user_id).order_by(
+        Email.received_at.desc()
+    ).limit(settings.PREFETCH_DASHBOARD_EMAILS).all()
+    return [row[0] for row in rows]
+
+
+def request_prefetch(user_id: int, email_ids: List[str]) -> None:
+    """Queue a background prefetch for the given dashboard emails (at most one queued per user)"""
+    if not email_ids:
+        return
+    if not cache.set(f"prefetch:queued:{user_id}", "1", ex=30, nx=True):
+        return
+    try:
+        from app.core.background_tasks import prefetch_dashboard_emails
+        prefetch_dashboard_emails.delay(user_id, email_ids[:settings.PREFETCH_DASHBOARD_EMAILS])
+    except Exception as e:
+        cache.delete(f"prefetch:queued:{user_id}")
+        logger.warning(f"Prefetch trigger failed for user {user_id}: {e}")
+
+
+def prefetch_emails(db: Session, user_id: int, gmail_service, email_ids: List[str]) -> Dict[str, int]:
+    """Fetch missing bodies and thread listings for `email_ids` within the rate budgets"""
+    store = MessageStore(db, user_id)
+    stats = {"bodies": 0, "threads": 0}
+
+    # 1. Bodies of the emails themselves
+    missing_ids = store.missing(email_ids)
+    allowed = _consume_budget(user_id, len(missing_ids))
+    if allowed:
+        messages = gmail_service.get_emails_by_ids(missing_ids[:allowed])
+        store.put_many(messages)
+        stats["bodies"] += len(messages)
+
+    # 2. Their threads: one batched listing call, then any bodies we still lack
+    thread_ids = [row[0] for row in db.query(Email.thread_id).filter(
+        Email.user_id == user_id,
+        Email.id.in_(email_ids),
+        Email.thread_id.isnot(None)
+    ).distinct().all() if row[0]]
+    thread_ids = [t for t in thread_ids if get_thread_listing(user_id, t) is None]
+    thread_ids = thread_ids[:_consume_budget(user_id, len(thread_ids))]
+
+    if thread_ids:
+        listings = gmail_service.get_threads_message_ids(thread_ids)
+        thread_message_ids = []
+        for thread_id, listing in listings.items():
+            message_ids = [msg['id'] for msg in listing]
+            set_thread_listing(user_id, thread_id, message_ids)
+            thread_message_ids.extend(message_ids)
+        stats["threads"] = len(listings)
+
+        missing_ids = store.missing(thread_message_ids)
+        allowed = _consume_budget(user_id, len(missing_ids))
+        if allowed:
+            messages = gmail_service.get_emails_by_ids(missing_ids[:allowed])
+            store.put_many(messages)
+            stats["bodies"] += len(messages)
+
+    metrics.record('prefetch.bodies', stats["bodies"])
+    metrics.record('prefetch.threads', stats["threads"])
+    return stats
@@ -2,16 +2,11 @@
 Push Notification Service
 Handles browser push notifications for important events
 """
-from app.core.models import PushSubscription, Notification
+from app.core import web_push
 from sqlalchemy.orm import Session
-from typing import List, Optional
-import json
 
-# Note: For production, you'll need to:
-# 1. Generate VAPID keys
-# 2. Install pywebpush: pip install pywebpush
-# 3. Configure VAPID keys in settings
-# 4. Set up service worker on frontend
+# Setup: generate a VAPID key pair (e.g. `npx web-push generate-vapid-keys`), set
+# VAPID_PRIVATE_KEY and VAPID_ADMIN_EMAIL here and VITE_VAPID_PUBLIC_KEY on the frontend
 
 class PushNotificationService:
     """Service for sending push notifications"""
@@ -26,66 +21,22 @@ class PushNotificationService:
         body: str, 
         icon: str = None,
         badge: str = None,
-        data: dict = None
+        data: dict = None,
+        topic: str = None
     ) -> bool:
         """
-        Send push notification to user
-        Returns True if sent successfully, False otherwise
+        Queue a push notification to all of the user's subscriptions
+        Returns True if it was queued, False otherwise (delivery happens in the background)
+        A newer notification with the same topic replaces this one, in the push service and on screen
         """
-        try:
-            # Get user's push subscriptions
-            subscriptions = self.db.query(PushSubscription).filter(
-                PushSubscription.user_id == user_id
-            ).all()
-            
-            if not subscriptions:
-                return False
-            
-            # Prepare notification payload
-            payload = {
-                "title": title,
-                "body": body,
-                "icon": icon or "/icon-192x192.png",
-                "badge": badge or "/badge-72x72.png",
-                "data": data or {}
-            }
-            
-            # TODO: Implement actual push notification sending
-            # This requires:
-            # 1. VAPID keys setup
-            # 2. pywebpush library
-            # 3. Service worker registration
-            
-            # For now, we'll just log it
-            print(f"Push notification for user {user_id}: {title} - {body}")
-            
-            # In production, uncomment and implement:
-            # from pywebpush import webpush, WebPushException
-            # for subscription in subscriptions:
-            #     try:
-            #         webpush(
-            #             subscription_info={
-            #                 "endpoint": subscription.endpoint,
-            #                 "keys": {
-            #                     "p256dh": subscription.p256dh,
-            #                     "auth": subscription.auth
-            #                 }
-            #             },
-            #             data=json.dumps(payload),
-            #             vapid_private_key=settings.VAPID_PRIVATE_KEY,
-            #             vapid_claims={
-            #                 "sub": f"mailto:{settings.VAPID_ADMIN_EMAIL}"
-            #             }
-            #         )
-            #     except WebPushException as e:
-            #         print(f"Error sending push notification: {e}")
-            #         # Remove invalid subscription
-            #         self.db.delete(subscription)
-            
-            return True
-        except Exception as e:
-            print(f"Error in push notification service: {e}")
-            return False
+        payload = {
+            "title": title,
+            "body": body,
+            "icon": icon or "/icon-192x192.png",
+            "badge": badge or "/badge-72x72.png",
+            "data": {**(data or {}), "tag": topic} if topic else (data or {})
+        }
+        return web_push.enqueue(user_id, payload, topic)
     
     def send_email_notification(self, user_id: int, email_subject: str, from_email: str, priority: str = "medium"):
         """Send push notification for new high-priority email"""
@@ -0,0 +1,217 @@
+"""
+Google API Quota Governor
+Token buckets in Redis that every worker draws from before calling Google, so that
+sync bursts, dashboard-triggered syncs and interactive requests stay under
+Gmail/Calendar quotas together.
+
+Each service has a per-user bucket and a project-wide bucket, measured in Google's
+quota units (e.g. messages.get = 5 units). Two lanes share the buckets:
+- interactive (a user is waiting) may use the whole bucket;
+- background (sync, prefetch, queued mutations) may not dip into the reserved
+  QUOTA_BACKGROUND_RESERVE fraction, so background work can't starve interactive traffic.
+
+When Google answers 429 or a rate-limit 403, the governor sets a backoff key for
+the user (or the whole project). It uses Retry-After when Google sends one, and
+otherwise exponential backoff with jitter. All workers wait out the backoff
+before drawing again.
+"""
+from googleapiclient.errors import HttpError
+from app.core.cache import cache
+from app.core.config import settings
+from app.core import metrics, deadline
+from typing import Optional
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Quota units per method (https://developers.google.com/gmail/api/reference/quota); anything else costs 1
+_COSTS = {
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.delete': 10,
+    'gmail.users.messages.trash': 5,
+    'gmail.users.messages.send': 100,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.batchDelete': 50,
+    'gmail.users.threads.get': 10,
+    'gmail.users.threads.list': 10,
+    'gmail.users.labels.list': 1,
+}
+
+# KEYS[1] = user bucket, KEYS[2] = project bucket, KEYS[3] = user backoff, KEYS[4] = project backoff
+# ARGV = cost, user rate/s, project rate/s, reserved fraction for this lane
+# Buckets hold one second's worth of units. Returns 0 if granted, else ms to wait.
+_ACQUIRE_SCRIPT = """
+pcall(redis.replicate_commands)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local reserve = tonumber(ARGV[4])
+
+local backoff = math.max(redis.call('PTTL', KEYS[3]), redis.call('PTTL', KEYS[4]))
+if backoff > 0 then
+    return backoff
+end
+
+local levels = {}
+local wait = 0
+for i = 1, 2 do
+    local rate = tonumber(ARGV[i + 1]) / 1000
+    local capacity = tonumber(ARGV[i + 1])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    local usable = tokens - capacity * reserve
+    if usable < cost then
+        wait = math.max(wait, math.ceil((cost - usable) / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+
+for i = 1, 2 do
+    redis.call('HSET', KEYS[i], 'tokens', levels[i] - cost, 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], 60000)
+end
+return 0
+"""
+
+_acquire = None
+
+
+class QuotaExhausted(Exception):
+    """No quota became available within the lane's wait budget"""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"Google {service} quota exhausted; retry in {retry_after:.1f}s")
+        self.service = service
+        self.retry_after = retry_after
+
+
+def request_cost(method_id: Optional[str]) -> int:
+    return _COSTS.get(method_id or '', 1)
+
+
+def _rates(service: str):
+    if service == 'calendar':
+        return settings.CALENDAR_QUOTA_USER_PER_SECOND, settings.CALENDAR_QUOTA_PROJECT_PER_SECOND
+    return settings.GMAIL_QUOTA_USER_PER_SECOND, settings.GMAIL_QUOTA_PROJECT_PER_SECOND
+
+
+def _keys(service: str, user_id: Optional[int]):
+    user = user_id if user_id is not None else "anonymous"
+    return [
+        f"quota:{service}:user:{user}",
+        f"quota:{service}:project",
+        f"quota:{service}:backoff:user:{user}",
+        f"quota:{service}:backoff:project",
+    ]
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def acquire(service: str, user_id: Optional[int], cost: int, lane: str = INTERACTIVE, max_wait: float = None) -> None:
+    """Block until `cost` units are granted, or raise QuotaExhausted after the lane's wait budget"""
+    global _acquire
+    if not cache.enabled:
+        return
+    if max_wait is None:
+        max_wait = settings.QUOTA_MAX_WAIT_INTERACTIVE_SECONDS if lane == INTERACTIVE else settings.QUOTA_MAX_WAIT_BACKGROUND_SECONDS
+
+    # Never wait past the request's deadline
+    max_wait = deadline.bounded(max_wait, f"Google {service} quota")
+    if _on_event_loop():
+        # Sleeping here would stall every request on this worker; callers run Google calls in a thread
+        logger.warning(f"Google {service} call made on the event loop; not waiting for quota")
+        max_wait = 0
+
+    user_rate, project_rate = _rates(service)
+    # A single request can't cost more than a full bucket, or it would never be granted
+    cost = min(cost, user_rate, project_rate)
+    reserve = 0 if lane == INTERACTIVE else settings.QUOTA_BACKGROUND_RESERVE
+    give_up = time.monotonic() + max_wait
+    waited = False
+
+    while True:
+        try:
+            if _acquire is None:
+                _acquire = cache.client.register_script(_ACQUIRE_SCRIPT)
+            wait_ms = int(_acquire(keys=_keys(service, user_id), args=[cost, user_rate, project_rate, reserve]))
+        except Exception as e:
+            logger.warning(f"Quota governor unavailable ({e}); proceeding ungoverned")
+            return
+        if wait_ms <= 0:
+            if waited:
+                metrics.record(f'quota.{service}.{lane}.waited')
+            return
+
+        remaining = give_up - time.monotonic()
+        if wait_ms / 1000 > remaining:
+            metrics.record(f'quota.{service}.{lane}.exhausted')
+            raise QuotaExhausted(service, wait_ms / 1000)
+        waited = True
+        # Jitter keeps workers that were refused together from retrying together
+        time.sleep(min(remaining, wait_ms / 1000 * random.uniform(1.0, 1.25)))
+
+
+def _rate_limit_reason(error: HttpError) -> Optional[str]:
+    """'user' or 'project' if the error is a Google rate limit, else None"""
+    status = error.resp.status
+    if status == 429:
+        return 'user'
+    if status != 403:
+        return None
+    try:
+        details = json.loads(error.content.decode('utf-8')).get('error', {}).get('errors', [])
+        reasons = {d.get('reason') for d in details}
+    except Exception:
+        return None
+    if 'userRateLimitExceeded' in reasons:
+        return 'user'
+    if 'rateLimitExceeded' in reasons or 'quotaExceeded' in reasons:
+        return 'project'
+    return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return isinstance(error, HttpError) and _rate_limit_reason(error) is not None
+
+
+def penalize(service: str, user_id: Optional[int], error: HttpError) -> float:
+    """Record a rate-limit response; returns the backoff (seconds) every worker will now observe"""
+    scope = _rate_limit_reason(error) or 'user'
+    keys = _keys(service, user_id)
+    backoff_key = keys[3] if scope == 'project' else keys[2]
+
+    retry_after = None
+    try:
+        retry_after = float(error.resp.get('retry-after'))
+    except (TypeError, ValueError):
+        pass
+    if retry_after is None:
+        strikes = cache.incr(f"{backoff_key}:strikes", ex=300) or 1
+        ceiling = min(settings.QUOTA_BACKOFF_MAX_SECONDS, settings.QUOTA_BACKOFF_BASE_SECONDS * (2 ** (strikes - 1)))
+        retry_after = random.uniform(settings.QUOTA_BACKOFF_BASE_SECONDS, max(settings.QUOTA_BACKOFF_BASE_SECONDS, ceiling))
+
+    cache.set(backoff_key, "1", ex=max(1, math.ceil(retry_after)))
+    metrics.record(f'quota.{service}.throttled')
+    logger.warning(f"Google {service} rate limited ({scope}) for user {user_id}; backing off {retry_after:.1f}s")
+    return retry_after
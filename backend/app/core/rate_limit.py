@@ -1,71 +1,97 @@
-from fastapi import HTTPException, Request
+from fastapi import HTTPException, Request, Response
 from app.core.cache import cache
-import time
-from collections import defaultdict
+from app.core.security import verify_token
+from app.core.rate_limit_fallback import fallback_store
+from typing import Dict, Tuple
+import math
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Fallback in-memory store
-_memory_store = defaultdict(list)
+# GCRA (generic cell rate algorithm): each key stores a "theoretical arrival time" (TAT).
+# A request is allowed if it arrives no earlier than TAT - window; each allowed request
+# pushes TAT forward by window / limit. This permits bursts of up to `limit` requests and
+# a steady rate of limit per window, with one key and one round trip per request.
+#
+# KEYS[1] = limiter key
+# ARGV[1] = emission interval in ms (window / limit)
+# ARGV[2] = window in ms
+# Returns {allowed, remaining, retry_after_ms, reset_ms}
+_GCRA_SCRIPT = """
+pcall(redis.replicate_commands)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+
+local new_tat = tat + interval
+local allow_at = new_tat - window
+if allow_at > now then
+    return {0, 0, allow_at - now, tat - now}
+end
+
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return {1, math.floor((now - allow_at) / interval), 0, new_tat - now}
+"""
+
+_gcra = None
+
+
+def _redis_gcra(key: str, interval_ms: int, window_ms: int) -> Tuple[int, int, int, int]:
+    global _gcra
+    if _gcra is None:
+        _gcra = cache.client.register_script(_GCRA_SCRIPT)
+    allowed, remaining, retry_after_ms, reset_ms = _gcra(keys=[key], args=[interval_ms, window_ms])
+    return int(allowed), int(remaining), int(retry_after_ms), int(reset_ms)
+
+
+def client_identity(request: Request) -> str:
+    """User ID from a valid bearer token, else the client IP"""
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        payload = verify_token(auth_header.split(" ", 1)[1])
+        if payload and payload.get("sub"):
+            return f"user:{payload['sub']}"
+    return "ip:" + (request.client.host if request.client else "unknown")
+
 
 class RateLimiter:
     def __init__(self, key_prefix: str, limit: int, window: int = 60):
         self.key_prefix = key_prefix
         self.limit = limit
         self.window = window
+        self.window_ms = window * 1000
+        self.interval_ms = max(1, self.window_ms // limit)
 
-    async def __call__(self, request: Request):
-        # Identify user
-        user_id = "ip:" + request.client.host
-        # Try to extract user ID from state or auth header if available (simplified)
-        # In a real app with Depends(get_current_user), we might need to access it differently,
-        # but middleware usually runs before auth dependency returns user object in request.state.
-        # However, since we use this as a Dependency on the route, we *can* get the user?
-        # Actually simplest is to rely on IP or Token from header if present for now.
-        
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-             # Use token hash or part of it as ID roughly
-             user_id = "token:" + auth_header.split(" ")[1][:10]
-
-        current_time = int(time.time())
-        limit_key = f"ratelimit:{self.key_prefix}:{user_id}"
-
-        # 1. Try Redis (SafeCache)
+    def check(self, identity: str) -> Dict[str, str]:
+        """Charge one request to `identity`; returns the rate limit headers, or raises a 429"""
+        limit_key = f"ratelimit:{self.key_prefix}:{identity}"
+
+        result = None
         if cache.enabled:
             try:
-                # Use Redis List or Sorted Set. 
-                # Simple implementation: fixed window counter or sliding log?
-                # Fixed window is safer for simple usage.
-                # Let's use simple key expiration for a "requests in last minute" check? 
-                # Or simply increment a counter.
-                
-                # Sliding window logic using Redis Pipeline
-                pipe = cache.client.pipeline()
-                pipe.zremrangebyscore(limit_key, 0, current_time - self.window)
-                pipe.zadd(limit_key, {str(current_time): current_time})
-                pipe.zcard(limit_key)
-                pipe.expire(limit_key, self.window + 10)
-                results = pipe.execute()
-                
-                request_count = results[2]
-                if request_count > self.limit:
-                    raise HTTPException(status_code=429, detail="Rate limit exceeded")
-                return True
-            except HTTPException:
-                raise
+                result = _redis_gcra(limit_key, self.interval_ms, self.window_ms)
             except Exception as e:
                 logger.warning(f"Rate limit Redis error: {e}. Falling back to memory.")
-                # Fallthrough to memory
-        
-        # 2. Memory Fallback
-        history = _memory_store[limit_key]
-        # Clean old
-        _memory_store[limit_key] = [t for t in history if t > current_time - self.window]
-        
-        if len(_memory_store[limit_key]) >= self.limit:
-             raise HTTPException(status_code=429, detail="Rate limit exceeded (Local)")
-             
-        _memory_store[limit_key].append(current_time)
+        if result is None:
+            result = fallback_store.acquire(limit_key, self.interval_ms, self.window_ms)
+
+        allowed, remaining, retry_after_ms, reset_ms = result
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(0, remaining)),
+            "X-RateLimit-Reset": str(math.ceil(reset_ms / 1000)),
+        }
+        if not allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(retry_after_ms / 1000)))
+            raise HTTPException(status_code=429, detail="Rate limit exceeded", headers=headers)
+        return headers
+
+    async def __call__(self, request: Request, response: Response):
+        response.headers.update(self.check(client_identity(request)))
         return True
@@ -0,0 +1,128 @@
+"""
+Rate Limit Fallback Store
+GCRA state used while Redis is unavailable.
+
+Each process keeps an LRU-bounded map of key -> TAT (theoretical arrival time).
+Expired entries are swept periodically, so memory stays flat however many clients
+show up during an outage. Workers on the same host also share a fixed-size table
+of TAT slots in a memory-mapped file. Before deciding, a worker folds in the
+shared TAT for the key, and after allowing a request it writes its own TAT back.
+The host as a whole then enforces roughly one limit, instead of one per worker.
+Hash collisions and races only make the sharing approximate, never unbounded.
+"""
+from app.core.config import settings
+from collections import OrderedDict
+from typing import Optional, Tuple
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# One shared slot: 8-byte key fingerprint + TAT in ms (double)
+_SLOT = struct.Struct("<Qd")
+
+
+def _fingerprint(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+class SharedSlots:
+    """Fixed-size TAT table in a memory-mapped file, shared by the workers on this host"""
+
+    def __init__(self, path: str, slots: int):
+        self.slots = slots
+        size = slots * _SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def read(self, fingerprint: int) -> Optional[float]:
+        stored, tat = _SLOT.unpack_from(self._map, (fingerprint % self.slots) * _SLOT.size)
+        return tat if stored == fingerprint else None
+
+    def write(self, fingerprint: int, tat: float, now: float) -> None:
+        offset = (fingerprint % self.slots) * _SLOT.size
+        stored, current = _SLOT.unpack_from(self._map, offset)
+        # Don't evict another key that is still being limited
+        if stored == fingerprint or stored == 0 or current <= now:
+            _SLOT.pack_into(self._map, offset, fingerprint, max(tat, current) if stored == fingerprint else tat)
+
+
+def _open_shared_slots() -> Optional[SharedSlots]:
+    if settings.RATE_LIMIT_SHARED_SLOTS <= 0:
+        return None
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    path = settings.RATE_LIMIT_SHARED_PATH or os.path.join(directory, "proactive-ratelimit.slots")
+    try:
+        return SharedSlots(path, settings.RATE_LIMIT_SHARED_SLOTS)
+    except Exception as e:
+        logger.warning(f"Shared rate limit slots unavailable ({e}); limits are per worker.")
+        return None
+
+
+class LocalGCRAStore:
+    """LRU-bounded GCRA state for one process, optionally merged with the shared slots"""
+
+    def __init__(self, max_keys: int, sweep_interval: float, shared: Optional[SharedSlots] = None):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self.shared = shared
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self._tats)
+
+    def acquire(self, key: str, interval_ms: int, window_ms: int) -> Tuple[int, int, int, int]:
+        """GCRA decision for one request: (allowed, remaining, retry_after_ms, reset_ms)"""
+        now = time.time() * 1000
+        fingerprint = _fingerprint(key) if self.shared else None
+        with self._lock:
+            self._maybe_sweep(now)
+
+            tat = self._tats.get(key, now)
+            if self.shared:
+                shared_tat = self.shared.read(fingerprint)
+                if shared_tat is not None:
+                    tat = max(tat, shared_tat)
+            tat = max(tat, now)
+
+            new_tat = tat + interval_ms
+            allow_at = new_tat - window_ms
+            if allow_at > now:
+                return 0, 0, int(allow_at - now), int(tat - now)
+
+            self._tats[key] = new_tat
+            self._tats.move_to_end(key)
+            while len(self._tats) > self.max_keys:
+                self._tats.popitem(last=False)
+            if self.shared:
+                self.shared.write(fingerprint, new_tat, now)
+        return 1, int((now - allow_at) // interval_ms), 0, int(new_tat - now)
+
+    def _maybe_sweep(self, now: float) -> None:
+        # A TAT in the past means the key is back to a full burst, same as having no entry
+        if time.monotonic() - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = time.monotonic()
+        for key in [key for key, tat in self._tats.items() if tat <= now]:
+            del self._tats[key]
+
+
+# Global instance
+fallback_store = LocalGCRAStore(
+    max_keys=settings.RATE_LIMIT_FALLBACK_MAX_KEYS,
+    sweep_interval=settings.RATE_LIMIT_FALLBACK_SWEEP_SECONDS,
+    shared=_open_shared_slots()
+)
@@ -0,0 +1,255 @@
+"""
+Realtime Hub
+One Redis connection and one heartbeat ticker per process for every open event stream.
+
+The hub holds a single async pattern subscription on `updates:*` and routes each
+message to the outbound buffers of that user's streams. If the Redis connection
+drops, the hub reconnects with backoff and tells every stream to refresh,
+because events may have been missed in the meantime.
+
+Each stream's buffer is bounded by count (REALTIME_QUEUE_SIZE) and by size
+(REALTIME_STREAM_BUFFER_BYTES; a single event larger than that is still let
+into an empty buffer). A stream that falls behind either bound gets its
+overflow policy applied:
+- resync: the backlog is replaced with one REFRESH_DASHBOARD hint;
+- disconnect: the backlog is dropped and the stream gets OVERFLOW, so it
+  closes, and the client reconnects and resumes from its last event ID.
+The ticker also sheds the largest buffers whenever all of the process's buffers
+together pass REALTIME_MEMORY_BUDGET_BYTES.
+
+The same ticker sends heartbeats in one pass to streams that have had nothing
+to send since the last tick, so an idle stream holds no timer of its own.
+"""
+from app.core.config import settings
+from app.core.events import RESYNC, parse_message
+from app.core import metrics
+from collections import deque
+from typing import Dict, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+_PATTERN = "updates:*"
+# Buffer items are (stream ID or None, event JSON)
+_RESYNC = (None, RESYNC)
+HEARTBEAT = (None, json.dumps({"type": "heartbeat"}))
+# Put on a disconnect-policy buffer in place of its backlog
+OVERFLOW = (None, None)
+
+# Overflow policies
+RESYNC_ON_OVERFLOW = "resync"
+DISCONNECT_ON_OVERFLOW = "disconnect"
+
+
+def _size(item: Tuple[Optional[str], Optional[str]]) -> int:
+    return len(item[1]) if item[1] else 0
+
+
+class Subscription:
+    """One open stream's outbound buffer"""
+
+    __slots__ = ('user_id', 'overflow', 'heartbeat', 'buffered_bytes', 'active', '_items', '_waiter')
+
+    def __init__(self, user_id: Optional[int], overflow: str, heartbeat: bool):
+        self.user_id = user_id
+        self.overflow = overflow
+        self.heartbeat = heartbeat
+        self.buffered_bytes = 0
+        self.active = False  # Anything sent since the last heartbeat tick
+        self._items = deque()
+        self._waiter: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def get(self) -> Tuple[Optional[str], Optional[str]]:
+        while not self._items:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        item = self._items.popleft()
+        self.buffered_bytes -= _size(item)
+        return item
+
+    def _push(self, item) -> None:
+        self._items.append(item)
+        self.buffered_bytes += _size(item)
+        self.active = True
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _replace_backlog(self) -> None:
+        self._items.clear()
+        self.buffered_bytes = 0
+        self._push(OVERFLOW if self.overflow == DISCONNECT_ON_OVERFLOW else _RESYNC)
+
+
+class RealtimeHub:
+    """Fans Redis pub/sub messages out to the event streams open in this process"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._connections: Dict[int, Set[Subscription]] = {}
+        self._streams: Set[Subscription] = set()
+        self._reader: Optional[asyncio.Task] = None
+        self._ticker: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self._client = None
+
+    @property
+    def connections(self) -> int:
+        return len(self._streams)
+
+    def stats(self) -> Dict[str, int]:
+        """Stream count and outbound buffer memory for this process"""
+        sizes = [stream.buffered_bytes for stream in self._streams]
+        return {
+            "connections": len(sizes),
+            "buffered_bytes": sum(sizes),
+            "largest_buffer_bytes": max(sizes, default=0),
+            "memory_budget_bytes": settings.REALTIME_MEMORY_BUDGET_BYTES,
+        }
+
+    def register(self, user_id: Optional[int], overflow: str = RESYNC_ON_OVERFLOW, heartbeat: bool = True) -> Subscription:
+        """Attach a stream without waiting for Redis; with no user it only gets heartbeats"""
+        self._ensure_ticker()
+        stream = Subscription(user_id, overflow, heartbeat)
+        self._streams.add(stream)
+        if user_id is not None:
+            self._connections.setdefault(user_id, set()).add(stream)
+        return stream
+
+    async def subscribe(self, user_id: int, overflow: str = RESYNC_ON_OVERFLOW, heartbeat: bool = True) -> Optional[Subscription]:
+        """Register a user's stream once events can flow; None if Redis can't be reached"""
+        self._ensure_reader()
+        if not self._connected.is_set():
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout=settings.REALTIME_CONNECT_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return None
+        return self.register(user_id, overflow, heartbeat)
+
+    def unsubscribe(self, stream: Subscription) -> None:
+        self._streams.discard(stream)
+        streams = self._connections.get(stream.user_id)
+        if streams is None:
+            return
+        streams.discard(stream)
+        if not streams:
+            del self._connections[stream.user_id]
+
+    def _ensure_reader(self) -> None:
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.get_running_loop().create_task(self._read_forever())
+
+    def _ensure_ticker(self) -> None:
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.get_running_loop().create_task(self._tick_forever())
+
+    async def _read_forever(self) -> None:
+        import redis.asyncio as aioredis
+
+        backoff = 1
+        while True:
+            pubsub = None
+            try:
+                self._client = aioredis.from_url(settings.REDIS_URL or "redis://localhost:6379/0", decode_responses=True)
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.psubscribe(_PATTERN)
+                self._connected.set()
+                backoff = 1
+                logger.info("Realtime hub subscribed to %s", _PATTERN)
+                async for message in pubsub.listen():
+                    if message.get("type") == "pmessage":
+                        self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Realtime hub lost Redis ({e}); reconnecting in {backoff}s")
+            finally:
+                self._connected.clear()
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+                if self._client is not None:
+                    try:
+                        await self._client.aclose()
+                    except Exception:
+                        pass
+                    self._client = None
+            # Anything published while we were away is gone; have clients refetch
+            for streams in self._connections.values():
+                for stream in streams:
+                    self._offer(stream, _RESYNC)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def _tick_forever(self) -> None:
+        while True:
+            await asyncio.sleep(settings.REALTIME_HEARTBEAT_SECONDS)
+            try:
+                self._tick()
+            except Exception as e:
+                logger.warning(f"Realtime heartbeat tick failed: {e}")
+
+    def _tick(self) -> None:
+        """Heartbeat idle streams and enforce the process memory budget, in one pass"""
+        total = 0
+        for stream in self._streams:
+            if stream.heartbeat and not stream.active:
+                self._offer(stream, HEARTBEAT)
+            stream.active = False
+            total += stream.buffered_bytes
+
+        if total > settings.REALTIME_MEMORY_BUDGET_BYTES:
+            logger.warning(f"Realtime buffers hold {total} bytes, over the {settings.REALTIME_MEMORY_BUDGET_BYTES} byte budget; shedding the largest")
+            for stream in sorted(self._streams, key=lambda s: s.buffered_bytes, reverse=True):
+                if total <= settings.REALTIME_MEMORY_BUDGET_BYTES or not stream.buffered_bytes:
+                    break
+                total -= stream.buffered_bytes
+                stream._replace_backlog()
+                metrics.record('realtime.shed')
+
+    def _dispatch(self, channel: str, data: str) -> None:
+        try:
+            user_id = int(channel.split(":", 1)[1])
+        except (IndexError, ValueError):
+            return
+        streams = self._connections.get(user_id)
+        if not streams:
+            return
+        item = parse_message(data)
+        for stream in streams:
+            self._offer(stream, item)
+
+    def _offer(self, stream: Subscription, item) -> None:
+        too_big = stream.buffered_bytes + _size(item) > settings.REALTIME_STREAM_BUFFER_BYTES
+        # An event larger than the whole buffer still goes to a stream that has caught up,
+        # or it could never be delivered
+        if len(stream) >= self.queue_size or (too_big and len(stream) > 0):
+            # Too far behind to catch up event by event
+            stream._replace_backlog()
+            metrics.record('realtime.overflow')
+            return
+        stream._push(item)
+
+    async def close(self) -> None:
+        for task in (self._reader, self._ticker):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._reader = None
+        self._ticker = None
+
+
+# Global instance
+hub = RealtimeHub(queue_size=settings.REALTIME_QUEUE_SIZE)
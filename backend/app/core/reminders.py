@@ -0,0 +1,226 @@
+"""
+Meeting Reminders
+A Redis delayed queue of reminders, fed by writes to the meetings table.
+
+Every pending reminder is one member of the `reminders:due` sorted set,
+"{user_id}:{meeting_id}", scored by the epoch second it should fire at
+(MEETING_REMINDER_MINUTES before the start). Inserting or updating a meeting
+row schedules it once the transaction commits. Because a meeting has one
+member, a reschedule just moves its score, and a cancellation removes it. A
+recurring series is scheduled for its next occurrence only, and the dispatcher
+queues the one after when it fires.
+
+`dispatch_due` pops due members in batches with one script, so each reminder
+goes to exactly one worker however many run it. Rows removed with bulk deletes
+(sync_window, delete_event) skip the ORM hooks. Their members are dropped when
+they come due, because every reminder is checked against its row before it is
+sent. Nothing scans the meetings table on a schedule; `schedule_upcoming` is
+only for seeding the queue once.
+"""
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session, object_session
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.models import Meeting
+from app.core.calendar_store import CalendarStore, as_utc
+from app.core.events import publish_event, MEETING_REMINDER
+from app.core.push_notifications import PushNotificationService
+from app.core import metrics
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DUE_KEY = "reminders:due"
+# Session.info key for reminder changes waiting on the commit
+_PENDING = "reminders.pending"
+
+# KEYS[1] = due set; ARGV = now (epoch seconds), batch size
+# Returns up to a batch of due members with their scores, removed from the set
+_POP_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+for i = 1, #due, 2 do
+    redis.call('ZREM', KEYS[1], due[i])
+end
+return due
+"""
+_pop = None
+
+
+def _lead() -> timedelta:
+    return timedelta(minutes=settings.MEETING_REMINDER_MINUTES)
+
+
+def _member(user_id: int, meeting_id: str) -> str:
+    return f"{user_id}:{meeting_id}"
+
+
+def _remindable(meeting: Meeting) -> bool:
+    return meeting.status != 'cancelled' and not meeting.all_day and meeting.start_time is not None
+
+
+def fire_at(meeting: Meeting, now: datetime = None) -> Optional[datetime]:
+    """When the meeting's next reminder is due, or None if it shouldn't get one"""
+    if not _remindable(meeting):
+        return None
+    now = now or datetime.now(timezone.utc)
+    if meeting.recurrence:
+        start = CalendarStore(object_session(meeting), meeting.user_id).next_occurrence(meeting, now)
+    else:
+        start = as_utc(meeting.start_time)
+    if start is None or start <= now:
+        return None
+    return start - _lead()
+
+
+def schedule(changes: Dict[Tuple[int, str], Optional[datetime]]) -> None:
+    """Add, move or (for None) remove reminders, keyed by (user_id, meeting_id)"""
+    if not changes or not cache.enabled:
+        return
+    try:
+        pipe = cache.client.pipeline(transaction=False)
+        for (user_id, meeting_id), when in changes.items():
+            if when is None:
+                pipe.zrem(DUE_KEY, _member(user_id, meeting_id))
+            else:
+                pipe.zadd(DUE_KEY, {_member(user_id, meeting_id): int(when.timestamp())})
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to schedule {len(changes)} meeting reminders: {e}")
+
+
+# --- Write hooks -----------------------------------------------------------
+
+def _queue(target: Meeting, when: Optional[datetime]) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING, {})[(target.user_id, target.id)] = when
+
+
+@event.listens_for(Meeting, "after_insert")
+@event.listens_for(Meeting, "after_update")
+def _meeting_written(mapper, connection, target):
+    try:
+        _queue(target, fire_at(target))
+    except Exception as e:
+        logger.warning(f"Could not work out the reminder for meeting {target.id}: {e}")
+
+
+@event.listens_for(Meeting, "after_delete")
+def _meeting_deleted(mapper, connection, target):
+    _queue(target, None)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _schedule_committed(session):
+    schedule(session.info.pop(_PENDING, None))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)
+
+
+# --- Dispatch --------------------------------------------------------------
+
+def _pop_due(now: float, limit: int) -> List[Tuple[str, float]]:
+    global _pop
+    if _pop is None:
+        _pop = cache.client.register_script(_POP_SCRIPT)
+    flat = _pop(keys=[DUE_KEY], args=[int(now), limit])
+    return [(flat[i], float(flat[i + 1])) for i in range(0, len(flat), 2)]
+
+
+def _send(db: Session, store: CalendarStore, meeting: Meeting, start: datetime, now: datetime) -> None:
+    minutes = max(0, round((start - now).total_seconds() / 60))
+    PushNotificationService(db).send_meeting_reminder(meeting.user_id, meeting.title or "(No title)", minutes)
+    event = store.format_meeting(meeting, start if meeting.recurrence else None)
+    publish_event(meeting.user_id, MEETING_REMINDER, {
+        "id": event['id'],
+        "title": event['title'],
+        "start_datetime": event['start_datetime'],
+        "location": event['location'],
+        "minutes_before": minutes
+    })
+
+
+def _dispatch_batch(db: Session, due: List[Tuple[str, float]]) -> int:
+    entries = []
+    for member, score in due:
+        user_id, _, meeting_id = member.partition(":")
+        if user_id.isdigit() and meeting_id:
+            entries.append((int(user_id), meeting_id, score))
+    rows = {m.id: m for m in db.query(Meeting).filter(Meeting.id.in_([e[1] for e in entries])).all()}
+
+    now = datetime.now(timezone.utc)
+    sent = 0
+    follow_ups = {}
+    for user_id, meeting_id, score in entries:
+        meeting = rows.get(meeting_id)
+        # Deleted, cancelled or moved since it was queued (a move queues its own reminder)
+        if meeting is None or meeting.user_id != user_id or not _remindable(meeting):
+            metrics.record('reminders.stale')
+            continue
+        start = datetime.fromtimestamp(score, timezone.utc) + _lead()
+        store = CalendarStore(db, user_id)
+        if meeting.recurrence:
+            follow_ups[(user_id, meeting_id)] = fire_at(meeting, max(now, start))
+            if not store.occurs_at(meeting, start):
+                metrics.record('reminders.stale')
+                continue
+        elif abs(as_utc(meeting.start_time).timestamp() - start.timestamp()) >= 1:
+            metrics.record('reminders.stale')
+            continue
+        if start < now:
+            # Popped after the meeting began (workers were down); too late to be useful
+            metrics.record('reminders.late')
+            continue
+        try:
+            _send(db, store, meeting, start, now)
+            sent += 1
+        except Exception as e:
+            logger.warning(f"Failed to send reminder for meeting {meeting_id}: {e}")
+    schedule(follow_ups)
+    if sent:
+        metrics.record('reminders.sent', sent)
+    return sent
+
+
+def dispatch_due(db: Session) -> int:
+    """Send every reminder that is due, a batch at a time; returns how many were sent"""
+    if not cache.enabled:
+        return 0
+    sent = 0
+    stop_at = time.monotonic() + settings.REMINDER_POLL_SECONDS
+    while time.monotonic() < stop_at:
+        due = _pop_due(time.time(), settings.REMINDER_BATCH_SIZE)
+        if due:
+            sent += _dispatch_batch(db, due)
+        if len(due) < settings.REMINDER_BATCH_SIZE:
+            break
+    return sent
+
+
+def schedule_upcoming(db: Session) -> int:
+    """Queue reminders for meetings already stored (to seed the queue once, not on a schedule)"""
+    now = datetime.now(timezone.utc)
+    query = db.query(Meeting).filter(or_(
+        Meeting.start_time > now,
+        Meeting.recurrence.isnot(None)
+    )).yield_per(settings.REMINDER_BATCH_SIZE)
+
+    scheduled = 0
+    changes = {}
+    for meeting in query:
+        when = fire_at(meeting, now)
+        if when is not None:
+            changes[(meeting.user_id, meeting.id)] = when
+        if len(changes) >= settings.REMINDER_BATCH_SIZE:
+            schedule(changes)
+            scheduled += len(changes)
+            changes = {}
+    schedule(changes)
+    return scheduled + len(changes)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 # User Schemas
@@ -66,7 +66,36 @@ class EmailThreadResponse(BaseModel):
     thread_id: str
     messages: List[EmailDetailResponse]
 
+class EmailBulkQuery(BaseModel):
+    """Selects messages from the local emails table instead of listing IDs"""
+    priority: Optional[str] = None
+    unread: Optional[bool] = None
+    thread_id: Optional[str] = None
+
+class EmailBulkActionRequest(BaseModel):
+    action: str  # read, unread, archive, trash, label, unlabel
+    message_ids: Optional[List[str]] = None
+    query: Optional[EmailBulkQuery] = None
+    label_id: Optional[str] = None  # For label/unlabel
+    wait: bool = False  # Send to Gmail before responding and report the outcome per message
+
+class EmailBulkResult(BaseModel):
+    id: str
+    status: str  # queued, done, retrying, failed
+    error: Optional[str] = None
+
+class EmailBulkResponse(BaseModel):
+    action: str
+    total: int
+    results: List[EmailBulkResult]
+
 # Meeting Schemas
+class MeetingConflict(BaseModel):
+    id: str
+    title: str
+    start_datetime: Optional[str] = None
+    end_datetime: Optional[str] = None
+
 class MeetingBase(BaseModel):
     title: str
     time: str
@@ -81,10 +110,26 @@ class MeetingResponse(MeetingBase):
     start_datetime: Optional[str] = None
     end_datetime: Optional[str] = None
     description: Optional[str] = None
+    conflicts: Optional[List[MeetingConflict]] = None  # Set on create/update when the new time overlaps other events
     
     class Config:
         from_attributes = True
 
+class TimeSlot(BaseModel):
+    start: str
+    end: str
+
+class FreeBusyResponse(BaseModel):
+    start: str
+    end: str
+    busy: List[TimeSlot]
+    complete: bool = True  # False when part of the range is outside the synced calendar
+
+class SlotSuggestionResponse(BaseModel):
+    duration_minutes: int
+    slots: List[TimeSlot]
+    complete: bool = True
+
 class MeetingCreate(BaseModel):
     title: str
     start_datetime: str
@@ -158,4 +203,6 @@ class DashboardData(BaseModel):
     todos: List[TodoResponse] = []
     notifications: List[NotificationResponse] = []
     suggestions: List[Suggestion] = []
+    counts: Optional[Dict[str, int]] = None  # Badge counts from user_counters
+    version: Optional[int] = None  # Dashboard patches apply on top of this version
 
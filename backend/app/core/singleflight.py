@@ -0,0 +1,135 @@
+"""
+Single-Flight Upstream Reads
+Identical Google reads that overlap in time share one call.
+
+Calls are keyed by (user, operation, args). Within a process, the first caller
+runs the call in a worker thread and later callers await the same future.
+Across processes, the first caller also claims a short Redis lock. Callers
+elsewhere that find the lock wait for that call's result, which is written to
+a result slot named after the lock's token. The slot only serves callers that
+were waiting on that particular call, so nobody gets a result from a call
+that finished before they asked.
+"""
+from app.core.cache import cache
+from app.core.config import settings
+from app.core import deadline, metrics
+from typing import Any, Callable, Dict, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# In-flight calls in this process: key -> future shared by every waiter
+_inflight: Dict[str, asyncio.Future] = {}
+
+_POLL_SECONDS = 0.05
+_FAILED = "__failed__"
+
+
+def _key(user_id: int, operation: str, args: tuple) -> str:
+    digest = hashlib.sha1(json.dumps(args, default=str, sort_keys=True).encode()).hexdigest()
+    return f"singleflight:{user_id}:{operation}:{digest}"
+
+
+async def coalesce(user_id: int, operation: str, args: tuple, fn: Callable[[], Any]) -> Any:
+    """Run `fn` (blocking, JSON-serializable result) once for all overlapping identical calls"""
+    key = _key(user_id, operation, args)
+    shared = _inflight.get(key)
+    if shared is not None:
+        metrics.record('singleflight.shared')
+        try:
+            return await asyncio.shield(shared)
+        except asyncio.CancelledError:
+            if not shared.cancelled():
+                raise  # We were cancelled ourselves
+            # The leading request was cancelled (e.g. its deadline); make the call ourselves
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _run(key, fn)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark retrieved, in case nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+
+async def _run(key: str, fn: Callable[[], Any]) -> Any:
+    """Call fn, or wait for the same call in another process"""
+    if not cache.enabled:
+        return await _lead(key, None, fn)
+    token = uuid.uuid4().hex
+    if cache.set(f"{key}:lock", token, ex=settings.SINGLEFLIGHT_LOCK_SECONDS, nx=True):
+        return await _lead(key, token, fn)
+
+    # Another process is making this call; wait for its result slot
+    leader = cache.get(f"{key}:lock")
+    if leader:
+        found, result = await _await_result(key, leader)
+        if found:
+            metrics.record('singleflight.remote_shared')
+            return result
+    return await _lead(key, None, fn)
+
+
+async def _lead(key: str, token: Optional[str], fn: Callable[[], Any]) -> Any:
+    metrics.record('singleflight.leader')
+    try:
+        result = await asyncio.to_thread(fn)  # Copies the context, so the deadline still applies
+    except BaseException:
+        if token:
+            _publish(key, token, None, failed=True)
+        raise
+    if token:
+        _publish(key, token, result)
+    return result
+
+
+def _publish(key: str, token: str, result: Any, failed: bool = False) -> None:
+    value = _FAILED
+    if not failed:
+        try:
+            value = json.dumps({"result": result}, default=str)
+        except (TypeError, ValueError):
+            pass
+    cache.set(f"{key}:result:{token}", value, ex=settings.SINGLEFLIGHT_RESULT_SECONDS)
+    # Only release our own lock; a slow call may have outlived it
+    if cache.get(f"{key}:lock") == token:
+        cache.delete(f"{key}:lock")
+
+
+async def _await_result(key: str, token: str):
+    """(True, result) once the leader publishes, (False, None) if it fails, vanishes or we run out of time"""
+    wait = settings.SINGLEFLIGHT_LOCK_SECONDS
+    left = deadline.remaining()
+    if left is not None:
+        wait = min(wait, left - 0.1)
+    give_up = time.monotonic() + wait
+    while time.monotonic() < give_up:
+        value = cache.get(f"{key}:result:{token}")
+        if value is not None:
+            if value == _FAILED:
+                return False, None
+            try:
+                return True, json.loads(value)["result"]
+            except Exception:
+                return False, None
+        if cache.get(f"{key}:lock") != token:
+            # The lock went away without a result; check the slot once more, then give up
+            value = cache.get(f"{key}:result:{token}")
+            if value is None or value == _FAILED:
+                return False, None
+            continue
+        await asyncio.sleep(_POLL_SECONDS)
+    return False, None
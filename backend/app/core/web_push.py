@@ -0,0 +1,327 @@
+"""
+Web Push Delivery
+Encrypts and sends Web Push messages (RFC 8291 aes128gcm, VAPID per RFC 8292).
+
+Notifications are never sent from the code that raises them. `enqueue` appends
+them to the `push:outbox` Redis list and schedules one `deliver_pushes` task. The
+task drains the list in batches, resolves each user's subscriptions with one
+query per batch, and sends everything concurrently. There is one connection
+pool per push service origin, which uses HTTP/2 when the optional `h2` package
+is installed, so a burst shares a few multiplexed connections per service.
+
+The VAPID signing key is loaded once, and the signed JWT is reused per push
+service until shortly before it expires. Parsed subscription keys are cached.
+Only the per-message ECDH key pair and salt are new every time, as the
+encryption scheme requires.
+
+A message can carry a Web Push `Topic`, so a newer message (e.g. an updated
+digest) replaces one the push service still holds for an offline device.
+
+Subscriptions that the push service reports gone (404/410) are deleted. 429 and
+5xx responses are retried with backoff.
+
+Endpoints must be https unless PUSH_ALLOW_INSECURE_ENDPOINTS is set. Setting it
+lets a local stand-in push service (http://localhost:...) receive the same
+requests, to test against.
+"""
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from sqlalchemy.orm import Session
+from app.core.cache import cache
+from app.core.config import settings
+from app.core.models import PushSubscription
+from app.core import metrics
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (lets httpx speak HTTP/2)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_KEY = "push:outbox"
+_SCHEDULED_KEY = "push:scheduled"
+# aes128gcm record size; a push message is always a single record
+_RECORD_SIZE = 4096
+# Refresh a cached VAPID JWT this long before it expires
+_JWT_LIFETIME_SECONDS = 12 * 3600
+_JWT_REFRESH_MARGIN_SECONDS = 3600
+
+_jwts: Dict[str, Tuple[str, float]] = {}
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _b64encode(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).rstrip(b"=").decode()
+
+
+# --- Keys and signing ------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def _vapid_key() -> Optional[ec.EllipticCurvePrivateKey]:
+    """The VAPID private key, as PEM or the base64url raw scalar web-push tools print"""
+    value = settings.VAPID_PRIVATE_KEY
+    if not value:
+        return None
+    if value.lstrip().startswith("-----BEGIN"):
+        return serialization.load_pem_private_key(value.encode(), password=None)
+    return ec.derive_private_key(int.from_bytes(_b64decode(value.strip()), "big"), ec.SECP256R1())
+
+
+@lru_cache(maxsize=1)
+def _vapid_public_key() -> str:
+    return _b64encode(_vapid_key().public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    ))
+
+
+def _origin(endpoint: str) -> str:
+    parts = urlsplit(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def vapid_authorization(endpoint: str) -> str:
+    """`Authorization` header for the endpoint's push service, signed once per service and lifetime"""
+    audience = _origin(endpoint)
+    cached = _jwts.get(audience)
+    if cached and cached[1] > time.time() + _JWT_REFRESH_MARGIN_SECONDS:
+        return cached[0]
+
+    expires = int(time.time()) + _JWT_LIFETIME_SECONDS
+    header = _b64encode(json.dumps({"typ": "JWT", "alg": "ES256"}).encode())
+    claims = _b64encode(json.dumps({
+        "aud": audience, "exp": expires, "sub": f"mailto:{settings.VAPID_ADMIN_EMAIL}"
+    }).encode())
+    signing_input = f"{header}.{claims}".encode()
+    r, s = decode_dss_signature(_vapid_key().sign(signing_input, ec.ECDSA(hashes.SHA256())))
+    token = f"{signing_input.decode()}.{_b64encode(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))}"
+
+    value = f"vapid t={token}, k={_vapid_public_key()}"
+    _jwts[audience] = (value, expires)
+    return value
+
+
+@lru_cache(maxsize=4096)
+def _subscriber_key(p256dh: str) -> Tuple[ec.EllipticCurvePublicKey, bytes]:
+    raw = _b64decode(p256dh)
+    return ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), raw), raw
+
+
+def encrypt(payload: bytes, p256dh: str, auth: str) -> bytes:
+    """aes128gcm body for one subscription (RFC 8291)"""
+    ua_key, ua_public = _subscriber_key(p256dh)
+    local_key = ec.generate_private_key(ec.SECP256R1())
+    as_public = local_key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    shared = local_key.exchange(ec.ECDH(), ua_key)
+
+    ikm = HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=_b64decode(auth),
+        info=b"WebPush: info\x00" + ua_public + as_public
+    ).derive(shared)
+    salt = os.urandom(16)
+    cek = HKDF(algorithm=hashes.SHA256(), length=16, salt=salt, info=b"Content-Encoding: aes128gcm\x00").derive(ikm)
+    nonce = HKDF(algorithm=hashes.SHA256(), length=12, salt=salt, info=b"Content-Encoding: nonce\x00").derive(ikm)
+
+    # \x02 marks the last (only) record; no further padding
+    ciphertext = AESGCM(cek).encrypt(nonce, payload + b"\x02", None)
+    return salt + _RECORD_SIZE.to_bytes(4, "big") + bytes([len(as_public)]) + as_public + ciphertext
+
+
+# --- Sending ---------------------------------------------------------------
+
+# Delivery outcomes
+SENT = "sent"
+GONE = "gone"
+RETRY = "retry"
+FAILED = "failed"
+
+
+def _outcome(status_code: int) -> str:
+    if status_code in (200, 201, 202):
+        return SENT
+    if status_code in (404, 410):
+        return GONE
+    if status_code == 429 or status_code >= 500:
+        return RETRY
+    return FAILED
+
+
+async def _send_one(clients: Dict[str, httpx.AsyncClient], limiter: asyncio.Semaphore,
+                    subscription: PushSubscription, message: Dict[str, Any]) -> str:
+    endpoint = subscription.endpoint
+    origin = _origin(endpoint)
+    if not origin.startswith("https://") and not settings.PUSH_ALLOW_INSECURE_ENDPOINTS:
+        return FAILED
+    client = clients.get(origin)
+    if client is None:
+        client = clients[origin] = httpx.AsyncClient(
+            http2=_HTTP2,
+            limits=httpx.Limits(max_connections=settings.PUSH_CONNECTIONS_PER_HOST),
+            timeout=settings.PUSH_TIMEOUT_SECONDS
+        )
+    headers = {
+        "Authorization": vapid_authorization(endpoint),
+        "Content-Encoding": "aes128gcm",
+        "Content-Type": "application/octet-stream",
+        "TTL": str(settings.PUSH_TTL_SECONDS),
+    }
+    if message.get("topic"):
+        # The push service replaces an undelivered message with the same topic
+        headers["Topic"] = message["topic"]
+    async with limiter:
+        try:
+            body = encrypt(json.dumps(message["payload"]).encode(), subscription.p256dh, subscription.auth)
+            response = await client.post(endpoint, content=body, headers=headers)
+        except (httpx.HTTPError, OSError) as e:
+            logger.info(f"Push to {origin} failed: {e}")
+            return RETRY
+        except ValueError as e:
+            # Malformed keys on the subscription; it can never be delivered to
+            logger.info(f"Push subscription {subscription.id} has unusable keys: {e}")
+            return GONE
+    outcome = _outcome(response.status_code)
+    if outcome == FAILED:
+        logger.warning(f"Push to {origin} rejected with {response.status_code}: {response.text[:200]}")
+    return outcome
+
+
+async def deliver(jobs: List[Tuple[PushSubscription, Dict[str, Any]]]) -> List[str]:
+    """Send every (subscription, message) concurrently; returns the outcome of each, in order"""
+    clients: Dict[str, httpx.AsyncClient] = {}
+    limiter = asyncio.Semaphore(settings.PUSH_CONCURRENCY)
+    try:
+        return await asyncio.gather(*(_send_one(clients, limiter, sub, message) for sub, message in jobs))
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients.values()), return_exceptions=True)
+
+
+# --- Outbox ----------------------------------------------------------------
+
+def schedule_delivery(countdown: int = 0) -> None:
+    """Start a delivery task unless one is already on its way"""
+    if cache.enabled and not cache.set(_SCHEDULED_KEY, "1", ex=countdown + 60, nx=True):
+        return
+    try:
+        from app.core.background_tasks import deliver_pushes
+        deliver_pushes.apply_async(countdown=countdown)
+    except Exception as e:
+        cache.delete(_SCHEDULED_KEY)
+        logger.warning(f"Push delivery trigger failed: {e}")
+
+
+def enqueue(user_id: int, payload: Dict[str, Any], topic: Optional[str] = None) -> bool:
+    """Queue a notification for all of a user's subscriptions; False if it couldn't be queued
+
+    Later messages with the same topic replace earlier ones the push service hasn't delivered yet.
+    """
+    if _vapid_key() is None:
+        logger.info(f"Push notification for user {user_id} (VAPID not configured): {payload.get('title')} - {payload.get('body')}")
+        return False
+    message = json.dumps({"user_id": user_id, "payload": payload, "topic": topic})
+    if cache.enabled:
+        try:
+            cache.client.rpush(OUTBOX_KEY, message)
+        except Exception as e:
+            logger.warning(f"Failed to queue push notification for user {user_id}: {e}")
+            return False
+        schedule_delivery()
+        return True
+    try:
+        from app.core.background_tasks import deliver_pushes
+        deliver_pushes.delay([json.loads(message)])
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to queue push notification for user {user_id}: {e}")
+        return False
+
+
+def _take(limit: int) -> List[Dict[str, Any]]:
+    if not cache.enabled:
+        return []
+    items = cache.client.lpop(OUTBOX_KEY, limit) or []
+    return [json.loads(item) for item in items]
+
+
+def _resolve(db: Session, messages: List[Dict[str, Any]]) -> List[Tuple[PushSubscription, Dict[str, Any]]]:
+    """Expand messages (to a user, or a retry to one subscription) into (subscription, message) jobs"""
+    by_user = defaultdict(list)
+    by_id = defaultdict(list)
+    for message in messages:
+        if message.get("subscription_id"):
+            # Several notifications to one subscription can be retried together
+            by_id[message["subscription_id"]].append(message)
+        else:
+            by_user[message["user_id"]].append(message)
+
+    jobs = []
+    if by_user:
+        for subscription in db.query(PushSubscription).filter(PushSubscription.user_id.in_(list(by_user))).all():
+            jobs += [(subscription, message) for message in by_user[subscription.user_id]]
+    if by_id:
+        for subscription in db.query(PushSubscription).filter(PushSubscription.id.in_(list(by_id))).all():
+            jobs += [(subscription, message) for message in by_id[subscription.id]]
+    return jobs
+
+
+def drain(db: Session, messages: List[Dict[str, Any]] = None) -> Dict[str, int]:
+    """Deliver the given messages, then the outbox, until it's empty or the time budget runs out"""
+    stats = defaultdict(int)
+    retries = []
+    stop_at = time.monotonic() + settings.PUSH_DRAIN_SECONDS
+    batch = list(messages or []) or _take(settings.PUSH_BATCH_SIZE)
+    while batch:
+        jobs = _resolve(db, batch)
+        outcomes = asyncio.run(deliver(jobs)) if jobs else []
+
+        counts = defaultdict(int)
+        gone = set()
+        for (subscription, message), outcome in zip(jobs, outcomes):
+            counts[outcome] += 1
+            if outcome == GONE:
+                gone.add(subscription.id)
+            elif outcome == RETRY and message.get("attempt", 0) + 1 < settings.PUSH_MAX_ATTEMPTS:
+                retries.append({
+                    "subscription_id": subscription.id,
+                    "payload": message["payload"],
+                    "topic": message.get("topic"),
+                    "attempt": message.get("attempt", 0) + 1
+                })
+        if gone:
+            db.query(PushSubscription).filter(PushSubscription.id.in_(gone)).delete(synchronize_session=False)
+            db.commit()
+        for outcome, count in counts.items():
+            stats[outcome] += count
+            metrics.record(f"push.{outcome}", count)
+
+        if time.monotonic() >= stop_at:
+            if cache.enabled and cache.client.llen(OUTBOX_KEY):
+                schedule_delivery()
+            break
+        batch = _take(settings.PUSH_BATCH_SIZE)
+
+    if retries:
+        from app.core.background_tasks import deliver_pushes
+        attempt = min(message["attempt"] for message in retries)
+        deliver_pushes.apply_async((retries,), countdown=min(settings.PUSH_RETRY_BASE_SECONDS * 2 ** (attempt - 1), 300))
+    return dict(stats)
@@ -1,8 +1,12 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 # Force reload
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from app.api import auth, dashboard, emails, meetings, realtime, push, admin
+from app.core.deadline import DeadlineMiddleware, DeadlineExceeded
+from app.core.realtime_hub import hub
+from app.core import counters, reminders  # noqa: F401  (hooks on meetings/todos/notifications/emails writes)
+from app.api import auth, dashboard, emails, meetings, realtime, push, admin, batch
 
 from app.core.database import Base, engine
 
@@ -11,14 +15,22 @@ Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="MajorProject API", version="1.0.0")
 
+# Added before CORS so that deadline responses still get CORS headers
+app.add_middleware(DeadlineMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[settings.FRONTEND_URL, "http://localhost:3000", "http://localhost:5173"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "X-Stale", "Age", "Warning"],
 )
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(dashboard.router)
@@ -27,6 +39,11 @@ app.include_router(meetings.router)
 app.include_router(realtime.router)
 app.include_router(push.router)
 app.include_router(admin.router)
+app.include_router(batch.router)
+
+@app.on_event("shutdown")
+async def close_realtime_hub():
+    await hub.close()
 
 @app.get("/health")
 def health_check():
@@ -11,26 +11,41 @@ def fix_database():
     engine = create_engine(settings.DATABASE_URL)
     
     with engine.connect() as connection:
-        # 1. Fix Users table (Add last_synced_at)
-        try:
-            print("Attempting to add last_synced_at to users table...")
-            # SQLite specific syntax, but works in PG too mostly for simple ADD COLUMN (PG needs datatype diffs usually but simple types often match)
-            # Actually SA handles connection details, but pure SQL dialects differ.
-            # Assuming SQLite per error message.
-            connection.execute(text("ALTER TABLE users ADD COLUMN last_synced_at DATETIME"))
-            connection.commit()
-            print("Successfully added last_synced_at column.")
-        except Exception as e:
-            if "duplicate column" in str(e).lower() or "already exists" in str(e).lower():
-                print("Column last_synced_at already exists.")
-            else:
-                print(f"Error adding column (might be expected if exists): {e}")
+        # 1. Add columns introduced after the tables were first created
+        # SQLite specific syntax, but works in PG too mostly for simple ADD COLUMN (PG needs datatype diffs usually but simple types often match)
+        columns_to_add = [
+            ("users", "last_synced_at", "DATETIME"),
+            ("users", "calendar_synced_from", "DATETIME"),
+            ("users", "calendar_synced_until", "DATETIME"),
+            ("meetings", "all_day", "BOOLEAN"),
+            ("meetings", "timezone", "VARCHAR"),
+            ("meetings", "recurrence", "JSON"),
+            ("meetings", "recurring_event_id", "VARCHAR"),
+            ("meetings", "original_start_time", "DATETIME"),
+            ("meetings", "status", "VARCHAR"),
+            ("notifications", "count", "INTEGER"),
+            ("notifications", "details", "JSON"),
+        ]
+
+        for table, column, column_type in columns_to_add:
+            try:
+                print(f"Attempting to add {column} to {table} table...")
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+                connection.commit()
+                print(f"Successfully added {column} column.")
+            except Exception as e:
+                connection.rollback()
+                if "duplicate column" in str(e).lower() or "already exists" in str(e).lower():
+                    print(f"Column {column} already exists.")
+                else:
+                    print(f"Error adding column (might be expected if exists): {e}")
 
         # 2. Add Indexes (Idempotent-ish check not easy in raw SQL without querying schema, so we'll try/catch)
         indexes_to_create = [
             ("idx_email_user_date", "CREATE INDEX idx_email_user_date ON emails (user_id, received_at)"),
             ("idx_meeting_user_start", "CREATE INDEX idx_meeting_user_start ON meetings (user_id, start_time)"),
-            ("idx_token_user_service", "CREATE INDEX idx_token_user_service ON service_tokens (user_id, service_name)")
+            ("idx_token_user_service", "CREATE INDEX idx_token_user_service ON service_tokens (user_id, service_name)"),
+            ("ix_meetings_recurring_event_id", "CREATE INDEX ix_meetings_recurring_event_id ON meetings (recurring_event_id)")
         ]
 
         for idx_name, sql in indexes_to_create:
@@ -40,6 +55,7 @@ def fix_database():
                 connection.commit()
                 print("Index created.")
             except Exception as e:
+                connection.rollback()
                 print(f"Could not create index {idx_name} (might exist): {e}")
 
 if __name__ == "__main__":
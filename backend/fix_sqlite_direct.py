@@ -12,22 +12,38 @@ def fix_db_direct():
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
 
-    # 1. Add last_synced_at column
-    try:
-        print("Adding last_synced_at column to users...")
-        cursor.execute("ALTER TABLE users ADD COLUMN last_synced_at DATETIME")
-        print("Column added.")
-    except sqlite3.OperationalError as e:
-        if "duplicate column" in str(e) or "no such table" in str(e): # SQLite doesn't say 'duplicate', it says 'duplicate column name'
-             print(f"Skipping column add: {e}")
-        else:
-             print(f"Error adding column: {e}")
+    # 1. Add columns introduced after the tables were first created
+    columns = [
+        ("users", "last_synced_at", "DATETIME"),
+        ("users", "calendar_synced_from", "DATETIME"),
+        ("users", "calendar_synced_until", "DATETIME"),
+        ("meetings", "all_day", "BOOLEAN"),
+        ("meetings", "timezone", "VARCHAR"),
+        ("meetings", "recurrence", "JSON"),
+        ("meetings", "recurring_event_id", "VARCHAR"),
+        ("meetings", "original_start_time", "DATETIME"),
+        ("meetings", "status", "VARCHAR"),
+        ("notifications", "count", "INTEGER"),
+        ("notifications", "details", "JSON"),
+    ]
+
+    for table, column, column_type in columns:
+        try:
+            print(f"Adding {column} column to {table}...")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            print("Column added.")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" in str(e) or "no such table" in str(e): # SQLite doesn't say 'duplicate', it says 'duplicate column name'
+                 print(f"Skipping column add: {e}")
+            else:
+                 print(f"Error adding column: {e}")
 
     # 2. Add Indexes
     indexes = [
         ("idx_email_user_date", "CREATE INDEX IF NOT EXISTS idx_email_user_date ON emails (user_id, received_at)"),
         ("idx_meeting_user_start", "CREATE INDEX IF NOT EXISTS idx_meeting_user_start ON meetings (user_id, start_time)"),
-        ("idx_token_user_service", "CREATE INDEX IF NOT EXISTS idx_token_user_service ON service_tokens (user_id, service_name)")
+        ("idx_token_user_service", "CREATE INDEX IF NOT EXISTS idx_token_user_service ON service_tokens (user_id, service_name)"),
+        ("ix_meetings_recurring_event_id", "CREATE INDEX IF NOT EXISTS ix_meetings_recurring_event_id ON meetings (recurring_event_id)")
     ]
 
     for name, sql in indexes:
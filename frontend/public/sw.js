@@ -18,7 +18,8 @@ self.addEventListener('push', (event) => {
     title: 'Proactive AI',
     body: 'You have a new notification',
     icon: '/icon-192x192.png',
-    badge: '/badge-72x72.png'
+    badge: '/badge-72x72.png',
+    data: {}
   };
 
   if (event.data) {
@@ -42,7 +43,9 @@ self.addEventListener('push', (event) => {
       icon: notificationData.icon,
       badge: notificationData.badge,
       data: notificationData.data,
-      tag: 'proactive-ai-notification',
+      // Notifications with their own tag (e.g. digests) replace their earlier versions
+      tag: notificationData.data.tag || 'proactive-ai-notification',
+      renotify: Boolean(notificationData.data.tag),
       requireInteraction: false
     })
   );
@@ -2,12 +2,20 @@ import { useTheme } from '../context/ThemeContext.jsx';
 import { useAuth } from '../context/AuthContext.jsx';
 import ThemeToggle from './ThemeToggle.jsx';
 import { Bell } from 'lucide-react';
-import { useState } from 'react';
+import { useQuery } from '@tanstack/react-query';
+import { dashboardAPI } from '../utils/api.jsx';
 
 const Navbar = () => {
   const { theme, toggleTheme } = useTheme();
   const { user } = useAuth();
-  const [notifications] = useState(3); // Mock notification count
+  // Only the badge counts, not the whole dashboard
+  const { data: counts } = useQuery({
+    queryKey: ['dashboard-counts'],
+    queryFn: async () => (await dashboardAPI.getContextualData({ include: 'counts' })).data.counts,
+    enabled: !!user,
+    staleTime: 60 * 1000,
+  });
+  const notifications = counts?.notifications_unread || 0;
 
   return (
     <header className="bg-white dark:bg-gray-900 border-b border-gray-200 dark:border-gray-800 px-4 lg:px-6 py-4">
@@ -1,13 +1,47 @@
+import { useCallback } from 'react';
 import { useQuery, useQueryClient } from '@tanstack/react-query';
 import { dashboardAPI } from '../utils/api.jsx';
 
+const QUERY_KEY = ['dashboard-contextual'];
+
+// Apply one section of a dashboard patch to a list of items with ids
+const patchList = (items, ops) => {
+  const removed = new Set((ops.removed || []).map(String));
+  const byId = new Map();
+  items.forEach((item) => {
+    if (!removed.has(String(item.id))) {
+      byId.set(String(item.id), item);
+    }
+  });
+  Object.entries(ops.changed || {}).forEach(([id, fields]) => {
+    if (byId.has(id)) {
+      byId.set(id, { ...byId.get(id), ...fields });
+    }
+  });
+  (ops.added || []).forEach((item) => byId.set(String(item.id), item));
+  const order = ops.order || [...byId.keys()];
+  return order.map((id) => byId.get(String(id))).filter(Boolean);
+};
+
+const applyPatch = (current, patch, version) => {
+  const next = { ...current, version };
+  Object.entries(patch).forEach(([section, ops]) => {
+    if ('replace' in ops) {
+      next[section] = ops.replace;
+    } else {
+      next[section] = patchList(current[section] || [], ops);
+    }
+  });
+  return next;
+};
+
 // Hook for fetching contextual dashboard data
 // This fetches real data from the backend API
 export function useContextualData() {
   const queryClient = useQueryClient();
 
   const { data, isLoading, error, refetch } = useQuery({
-    queryKey: ['dashboard-contextual'],
+    queryKey: QUERY_KEY,
     queryFn: async () => {
       const response = await dashboardAPI.getContextualData();
       return {
@@ -17,6 +51,8 @@ export function useContextualData() {
         todos: response.data.todos || [],
         notifications: response.data.notifications || [],
         suggestions: response.data.suggestions || [],
+        counts: response.data.counts || null,
+        version: response.data.version ?? null,
       };
     },
     // Use staleTime from global config (5 minutes) or override here
@@ -26,6 +62,20 @@ export function useContextualData() {
     retry: 1,
   });
 
+  // Apply a 'dashboard.patch' event, or fetch a snapshot if we're not on its base version
+  const applyDashboardPatch = useCallback((event) => {
+    const { base, version, patch } = event.data || {};
+    const current = queryClient.getQueryData(QUERY_KEY);
+    if (current && current.version != null && version <= current.version) {
+      return; // Already have it (e.g. the snapshot was fetched after this change)
+    }
+    if (!current || current.version == null || !patch || base !== current.version) {
+      refetch();
+      return;
+    }
+    queryClient.setQueryData(QUERY_KEY, applyPatch(current, patch, version));
+  }, [queryClient, refetch]);
+
   // Default empty state to prevent null crashes while loading
   const defaultData = {
     dailyBrief: null,
@@ -34,6 +84,8 @@ export function useContextualData() {
     todos: [],
     notifications: [],
     suggestions: [],
+    counts: null,
+    version: null,
   };
 
   return {
@@ -41,6 +93,6 @@ export function useContextualData() {
     isLoading,
     error: error?.response?.data?.detail || error?.message || null,
     refetch,
+    applyDashboardPatch,
   };
 }
-
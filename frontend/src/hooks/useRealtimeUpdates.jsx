@@ -1,11 +1,13 @@
 import { useEffect, useState, useRef } from 'react';
 import { realtimeAPI } from '../utils/api.jsx';
 
-export const useRealtimeUpdates = (onEmailUpdate, onMeetingUpdate) => {
+export const useRealtimeUpdates = (onEmailUpdate, onMeetingUpdate, onDashboardPatch) => {
   const [connected, setConnected] = useState(false);
   const [connectionStatus, setConnectionStatus] = useState('disconnected');
   const [error, setError] = useState(null);
   const eventSourceRef = useRef(null);
+  // Last event received, so a new connection resumes where the previous one stopped
+  const lastEventIdRef = useRef(null);
 
   useEffect(() => {
     const token = localStorage.getItem('auth_token');
@@ -15,13 +17,88 @@ export const useRealtimeUpdates = (onEmailUpdate, onMeetingUpdate) => {
 
     const controller = new AbortController();
 
+    // Call a refetch-style handler, at most once per batch
+    const notify = (callback, data, notified) => {
+      if (!callback || (notified && notified.has(callback))) {
+        return;
+      }
+      if (notified) {
+        notified.add(callback);
+      }
+      callback(data);
+    };
+
+    const handleEvent = (data, notified = null) => {
+      switch (data.type) {
+        case 'status':
+          setConnectionStatus(data.status); // 'connected' or 'degraded'
+          if (data.status === 'degraded') {
+            console.warn(data.message);
+          }
+          break;
+        case 'connected': // Fallback legacy
+          setConnectionStatus('connected');
+          break;
+        case 'emails':
+          if (onEmailUpdate && data.data) {
+            onEmailUpdate(data.data);
+          }
+          break;
+        case 'meetings':
+          if (onMeetingUpdate && data.data) {
+            onMeetingUpdate(data.data);
+          }
+          break;
+        case 'email.read':
+        case 'email.unread':
+        case 'email.new':
+        case 'email.deleted':
+          notify(onEmailUpdate, data, notified);
+          break;
+        case 'meeting.created':
+        case 'meeting.updated':
+        case 'meeting.deleted':
+        case 'meeting.reminder':
+          notify(onMeetingUpdate, data, notified);
+          break;
+        case 'dashboard.patch':
+          if (onDashboardPatch) {
+            onDashboardPatch(data);
+          } else {
+            notify(onEmailUpdate, data, notified);
+          }
+          break;
+        case 'REFRESH_DASHBOARD':
+          notify(onEmailUpdate, data, notified);
+          break;
+        case 'batch': {
+          // Events coalesced on the server, in the order they happened
+          const seen = notified || new Set();
+          (data.events || []).forEach((event) => handleEvent(event, seen));
+          break;
+        }
+        case 'heartbeat':
+          // Keep connection alive
+          break;
+        case 'error':
+          console.error('Real-time update error:', data.message);
+          setError(data.message);
+          break;
+        default:
+          console.log('Unknown event type:', data.type);
+      }
+    };
+
     // Use fetchEventSource to support headers
     import('@microsoft/fetch-event-source').then(({ fetchEventSource }) => {
+      const headers = { Authorization: `Bearer ${token}` };
+      if (lastEventIdRef.current) {
+        headers['Last-Event-ID'] = lastEventIdRef.current;
+      }
+      // fetchEventSource sends Last-Event-ID itself when it reconnects
       fetchEventSource(realtimeAPI.getStreamUrl(), {
         method: 'GET',
-        headers: {
-          Authorization: `Bearer ${token}`,
-        },
+        headers,
         signal: controller.signal,
         onopen(response) {
           if (response.ok) {
@@ -30,47 +107,18 @@ export const useRealtimeUpdates = (onEmailUpdate, onMeetingUpdate) => {
             return; // everything is good
           } else {
             setConnected(false);
-            // if (response.status >= 400 && response.status < 500 && response.status !== 429) {
-            //     // client-side errors are usually fatal retry will not help
-            //     throw new FatalError();
-            // } 
-            throw new Error(`Connection failed: ${response.statusText}`);
+            const error = new Error(`Connection failed: ${response.statusText}`);
+            // Client errors (bad or expired token) won't be fixed by retrying
+            error.fatal = response.status >= 400 && response.status < 500 && response.status !== 429;
+            throw error;
           }
         },
         onmessage(msg) {
+          if (msg.id) {
+            lastEventIdRef.current = msg.id;
+          }
           try {
-            const data = JSON.parse(msg.data);
-
-            switch (data.type) {
-              case 'status':
-                setConnectionStatus(data.status); // 'connected' or 'degraded'
-                if (data.status === 'degraded') {
-                  console.warn(data.message);
-                }
-                break;
-              case 'connected': // Fallback legacy
-                setConnectionStatus('connected');
-                break;
-              case 'emails':
-                if (onEmailUpdate && data.data) {
-                  onEmailUpdate(data.data);
-                }
-                break;
-              case 'meetings':
-                if (onMeetingUpdate && data.data) {
-                  onMeetingUpdate(data.data);
-                }
-                break;
-              case 'heartbeat':
-                // Keep connection alive
-                break;
-              case 'error':
-                console.error('Real-time update error:', data.message);
-                setError(data.message);
-                break;
-              default:
-                console.log('Unknown event type:', data.type);
-            }
+            handleEvent(JSON.parse(msg.data));
           } catch (err) {
             console.error('Error parsing SSE message:', err);
           }
@@ -78,13 +126,19 @@ export const useRealtimeUpdates = (onEmailUpdate, onMeetingUpdate) => {
         onclose() {
           setConnected(false);
           setConnectionStatus('disconnected');
+          // The server closes streams that fall too far behind; reconnect and resume
+          throw new Error('Realtime stream closed');
         },
         onerror(err) {
           console.error('SSE connection error:', err);
           setError('Connection error');
           setConnected(false);
           setConnectionStatus('disconnected');
-          throw err;
+          if (err && err.fatal) {
+            throw err;
+          }
+          // Otherwise retry; missed events are replayed from Last-Event-ID
+          return 2000 + Math.random() * 3000;
         }
       }).catch(err => {
         console.error('Failed to initialize SSE:', err);
@@ -96,7 +150,7 @@ export const useRealtimeUpdates = (onEmailUpdate, onMeetingUpdate) => {
       controller.abort();
       setConnected(false);
     };
-  }, [onEmailUpdate, onMeetingUpdate]);
+  }, [onEmailUpdate, onMeetingUpdate, onDashboardPatch]);
 
   return { connected, connectionStatus, error };
 };
@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useCallback } from 'react';
 import { Card, CardHeader, CardTitle, CardContent } from '../components/ui/card.jsx';
 import { useContextualData } from '../hooks/useContextualData.jsx';
 import { useRealtimeUpdates } from '../hooks/useRealtimeUpdates.jsx';
@@ -6,24 +6,25 @@ import { Mail, Calendar, CheckSquare, Bell, Lightbulb, Clock, User, AlertCircle
 import { Button } from '../components/ui/button.jsx';
 
 const Dashboard = () => {
-  const { dailyBrief, emails, meetings, todos, notifications, suggestions, isLoading, error, refetch } = useContextualData();
+  const { dailyBrief, emails, meetings, todos, notifications, suggestions, isLoading, error, refetch, applyDashboardPatch } = useContextualData();
   
-  // Real-time updates
-  const handleEmailUpdate = (newEmails) => {
+  // Real-time updates (stable callbacks, so re-renders don't reconnect the stream)
+  const handleEmailUpdate = useCallback((newEmails) => {
     // Refresh dashboard data when new emails arrive
     if (refetch) {
       refetch();
     }
-  };
+  }, [refetch]);
 
-  const handleMeetingUpdate = (newMeetings) => {
+  const handleMeetingUpdate = useCallback((newMeetings) => {
     // Refresh dashboard data when new meetings arrive
     if (refetch) {
       refetch();
     }
-  };
+  }, [refetch]);
 
-  const { connected } = useRealtimeUpdates(handleEmailUpdate, handleMeetingUpdate);
+  // Sync results arrive as versioned patches applied in place
+  const { connected } = useRealtimeUpdates(handleEmailUpdate, handleMeetingUpdate, applyDashboardPatch);
 
   if (isLoading) {
     return (
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Card, CardHeader, CardTitle, CardContent } from '../components/ui/card.jsx';
-import { authAPI, dashboardAPI } from '../utils/api.jsx';
+import { batchAPI } from '../utils/api.jsx';
 import { useAuth } from '../context/AuthContext.jsx';
 import PushNotificationSetup from '../components/PushNotificationSetup.jsx';
 import { User, Mail, Calendar, CheckSquare, Bell, Settings as SettingsIcon, Link2, Link2Off } from 'lucide-react';
@@ -26,37 +26,35 @@ const Settings = () => {
       setIsLoading(true);
       setError(null);
 
-      // Fetch profile data
-      const profileResponse = await authAPI.getUserProfile();
-      setProfileData(profileResponse.data.user);
-      setStats(profileResponse.data.stats);
-      setIntegrations(profileResponse.data.integrations);
+      // One round trip for everything on the page; each part succeeds or fails on its own
+      const response = await batchAPI.run([
+        { id: 'profile', path: '/auth/profile' },
+        { id: 'todos', path: '/api/dashboard/todos' },
+        { id: 'notifications', path: '/api/dashboard/notifications' },
+        { id: 'emails', path: '/api/dashboard/emails' },
+        { id: 'meetings', path: '/api/dashboard/meetings' },
+      ]);
+      const results = Object.fromEntries(response.data.responses.map((item) => [item.id, item]));
+      const bodyOf = (id) => (results[id]?.status === 200 ? results[id].body : null);
 
-      // Fetch todos
-      const todosResponse = await dashboardAPI.getTodos();
-      setTodos(todosResponse.data || []);
-
-      // Fetch notifications
-      const notificationsResponse = await dashboardAPI.getNotifications();
-      setNotifications(notificationsResponse.data || []);
-
-      // Fetch emails
-      try {
-        const emailsResponse = await dashboardAPI.getEmails();
-        setEmails(emailsResponse.data || []);
-      } catch (e) {
-        console.error('Error fetching emails:', e);
-        setEmails([]);
+      const profile = bodyOf('profile');
+      if (!profile) {
+        throw new Error(results.profile?.body?.detail || 'Failed to load profile');
       }
+      setProfileData(profile.user);
+      setStats(profile.stats);
+      setIntegrations(profile.integrations);
 
-      // Fetch meetings
-      try {
-        const meetingsResponse = await dashboardAPI.getMeetings();
-        setMeetings(meetingsResponse.data || []);
-      } catch (e) {
-        console.error('Error fetching meetings:', e);
-        setMeetings([]);
-      }
+      setTodos(bodyOf('todos') || []);
+      setNotifications(bodyOf('notifications') || []);
+
+      ['emails', 'meetings'].forEach((id) => {
+        if (results[id]?.status !== 200) {
+          console.error(`Error fetching ${id}:`, results[id]?.body?.detail);
+        }
+      });
+      setEmails(bodyOf('emails') || []);
+      setMeetings(bodyOf('meetings') || []);
     } catch (err) {
       console.error('Error fetching profile data:', err);
       setError(err.response?.data?.detail || err.message || 'Failed to load data');
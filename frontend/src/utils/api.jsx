@@ -59,17 +59,18 @@ export const authAPI = {
 
 // Dashboard API
 export const dashboardAPI = {
-  // Get all contextual dashboard data
-  getContextualData: () => apiClient.get('/api/dashboard/contextual-data'),
+  // Get all contextual dashboard data, or only some of it,
+  // e.g. { include: 'counts' } or { include: 'emails', fields: 'emails.subject,emails.unread' }
+  getContextualData: (params) => apiClient.get('/api/dashboard/contextual-data', { params }),
   
   // Get emails
-  getEmails: () => apiClient.get('/api/dashboard/emails'),
+  getEmails: (params) => apiClient.get('/api/dashboard/emails', { params }),
   
   // Get meetings
-  getMeetings: () => apiClient.get('/api/dashboard/meetings'),
+  getMeetings: (params) => apiClient.get('/api/dashboard/meetings', { params }),
   
   // Get todos
-  getTodos: () => apiClient.get('/api/dashboard/todos'),
+  getTodos: (params) => apiClient.get('/api/dashboard/todos', { params }),
   
   // Create todo
   createTodo: (todoData) => apiClient.post('/api/dashboard/todos', todoData),
@@ -78,7 +79,7 @@ export const dashboardAPI = {
   updateTodo: (todoId, todoData) => apiClient.patch(`/api/dashboard/todos/${todoId}`, todoData),
   
   // Get notifications
-  getNotifications: () => apiClient.get('/api/dashboard/notifications'),
+  getNotifications: (params) => apiClient.get('/api/dashboard/notifications', { params }),
   
   // Mark notification as read
   markNotificationRead: (notificationId) => 
@@ -115,6 +116,19 @@ export const emailAPI = {
   
   // Get email thread
   getEmailThread: (threadId) => apiClient.get(`/api/emails/thread/${threadId}`),
+  
+  // Apply one action (read, unread, archive, trash, label, unlabel) to many emails
+  bulkAction: (action, { messageIds, query, labelId, wait = false } = {}) => 
+    apiClient.post('/api/emails/bulk', { 
+      action, 
+      message_ids: messageIds, 
+      query, 
+      label_id: labelId, 
+      wait 
+    }),
+  
+  // Mark all unread high-priority emails as read
+  markHighPriorityRead: () => apiClient.post('/api/emails/bulk/mark-high-priority-read'),
 };
 
 // Meeting API
@@ -178,6 +192,12 @@ export const pushAPI = {
   getSubscriptions: () => apiClient.get('/api/push/subscriptions'),
 };
 
+// Batch API
+export const batchAPI = {
+  // Run several GETs in one round trip: [{ id, path, params? }] -> { responses: [{ id, status, body }] }
+  run: (requests) => apiClient.post('/api/batch', { requests }),
+};
+
 // Admin API
 export const adminAPI = {
   // Clear dashboard cache